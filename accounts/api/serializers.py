@@ -27,6 +27,24 @@ class UserSerializerWithProfile(UserSerializer):
         return None
 
 
+class UserSerializerForDetail(UserSerializerWithProfile):
+    # 只有用户详情里才有粉丝数和关注数，嵌套在 tweet，评论等里面的 user 不需要
+    # 直接读 profile 上的 counter，不需要 COUNT friendship 表
+    followers_count = serializers.IntegerField(source='profile.followers_count')
+    followings_count = serializers.IntegerField(source='profile.followings_count')
+
+    class Meta:
+        model = User
+        fields = (
+            'id',
+            'username',
+            'nickname',
+            'avatar_url',
+            'followers_count',
+            'followings_count',
+        )
+
+
 class UserSerializerForTweet(UserSerializerWithProfile):
     pass
 
@@ -101,3 +119,10 @@ class UserProfileSerializerForUpdate(serializers.ModelSerializer):
     class Meta:
         model = UserProfile
         fields = ('nickname', 'avatar')
+
+    def update(self, instance, validated_data):
+        # 只写入修改的字段，避免用旧的值覆盖掉并发更新的 followers_count 等 counter
+        for attr, value in validated_data.items():
+            setattr(instance, attr, value)
+        instance.save(update_fields=[*validated_data, 'updated_at'])
+        return instance
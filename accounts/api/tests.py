@@ -1,7 +1,9 @@
+from django.contrib.auth.models import User
 from django.core.files.uploadedfile import SimpleUploadedFile
 from rest_framework.test import APIClient
 
 from accounts.models import UserProfile
+from friendships.models import Friendship
 from testing.testcases import TestCase
 
 # URL 一定要以/结尾，否则不管什么请求都会有一个301的redirect
@@ -10,6 +12,7 @@ LOGOUT_URL = '/api/accounts/logout/'
 SIGNUP_URL = '/api/accounts/signup/'
 LOGIN_STATUS_URL = '/api/accounts/login_status/'
 USER_PROFILE_DETAIL_URL = '/api/profiles/{}/'
+USER_DETAIL_URL = '/api/users/{}/'
 
 
 class AccountApiTests(TestCase):
@@ -205,4 +208,19 @@ class UserProfileAPITests(TestCase):
         self.assertIsNotNone(p.avatar)
 
 
+class UserApiTests(TestCase):
+    def test_retrieve_with_counts(self):
+        linghu = self.create_user('linghu')
+        dongxie = self.create_user('dongxie')
+        Friendship.objects.create(from_user=dongxie, to_user=linghu)
+        admin = User.objects.create_superuser('admin', 'admin@twitter.com', 'password')
+        admin_client = APIClient()
+        admin_client.force_authenticate(admin)
 
+        response = admin_client.get(USER_DETAIL_URL.format(linghu.id))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['followers_count'], 1)
+        self.assertEqual(response.data['followings_count'], 0)
+        response = admin_client.get(USER_DETAIL_URL.format(dongxie.id))
+        self.assertEqual(response.data['followers_count'], 0)
+        self.assertEqual(response.data['followings_count'], 1)
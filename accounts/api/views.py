@@ -15,7 +15,7 @@ from accounts.api.serializers import (
     LoginSerializer,
     SignupSerializer,
     UserProfileSerializerForUpdate,
-    UserSerializerWithProfile,
+    UserSerializerForDetail,
 )
 from accounts.models import UserProfile
 
@@ -28,7 +28,7 @@ class UserViewSet(viewsets.ModelViewSet):
     API endpoint that allows users to be viewed or edited.
     """
     queryset = User.objects.all()
-    serializer_class = UserSerializerWithProfile
+    serializer_class = UserSerializerForDetail
     permission_classes = (permissions.IsAdminUser,)
 
 
@@ -1,4 +1,4 @@
 def profile_changed(sender, instance, **kwargs):
     # import 写在函数里面避免循环依赖
     from accounts.services import UserService
-    UserService.invalidate_profile(instance.user_id)
\ No newline at end of file
+    UserService.update_profile_cache(instance.user_id)
\ No newline at end of file
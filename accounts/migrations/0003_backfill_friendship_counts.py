@@ -0,0 +1,48 @@
+from django.db import migrations
+from django.db.models import Count
+
+
+def backfill_friendship_counts(apps, schema_editor):
+    UserProfile = apps.get_model('accounts', 'UserProfile')
+    Friendship = apps.get_model('friendships', 'Friendship')
+
+    # order_by() 去掉 Meta.ordering 对 GROUP BY 的影响
+    followers_counts = dict(
+        Friendship.objects.filter(to_user_id__isnull=False)
+        .order_by().values_list('to_user_id').annotate(Count('id'))
+    )
+    followings_counts = dict(
+        Friendship.objects.filter(from_user_id__isnull=False)
+        .order_by().values_list('from_user_id').annotate(Count('id'))
+    )
+    user_ids = set(followers_counts) | set(followings_counts)
+
+    # 之后 follow 和 unfollow 的时候只会在已有的 counter 上加减，所以 profile 需要先建好
+    existing_user_ids = set(
+        UserProfile.objects.filter(user_id__in=user_ids)
+        .values_list('user_id', flat=True)
+    )
+    UserProfile.objects.bulk_create([
+        UserProfile(user_id=user_id)
+        for user_id in user_ids - existing_user_ids
+    ])
+    for user_id in user_ids:
+        UserProfile.objects.filter(user_id=user_id).update(
+            followers_count=followers_counts.get(user_id, 0),
+            followings_count=followings_counts.get(user_id, 0),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_auto_20261018_0633'),
+        ('friendships', '0002_auto_20210914_0216'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            backfill_friendship_counts,
+            migrations.RunPython.noop,
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.1.3 on 2026-10-18 07:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_backfill_friendship_counts'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='userprofile',
+            name='followers_count',
+            field=models.IntegerField(db_index=True, default=0),
+        ),
+    ]
@@ -3,6 +3,7 @@ from django.db import models
 from django.db.models.signals import post_save, pre_delete
 
 from accounts.listeners import profile_changed
+from utils.cache_codecs import ModelCodec
 from utils.listeners import invalidate_object_cache
 
 
@@ -10,6 +11,10 @@ class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.SET_NULL, null=True)
     avatar = models.FileField(null=True)
     nickname = models.CharField(null=True, max_length=200)
+    # 冗余存储的粉丝数和关注数，在 follow 和 unfollow 的时候用 F expression 更新
+    # 大V的集合按照粉丝数查询，所以 followers_count 加上 index
+    followers_count = models.IntegerField(default=0, db_index=True)
+    followings_count = models.IntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -37,6 +42,18 @@ def get_profile(user):
 User.profile = property(get_profile)
 
 
+# cache 里只存需要展示的字段，password 之类的字段不放进 cache
+ModelCodec.register(User, fields=[
+    'id',
+    'username',
+    'email',
+    'first_name',
+    'last_name',
+    'is_active',
+    'date_joined',
+])
+ModelCodec.register(UserProfile, version=2)
+
 # hook up with listeners to invalidate cache
 pre_delete.connect(invalidate_object_cache, sender=User)
 post_save.connect(invalidate_object_cache, sender=User)
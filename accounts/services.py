@@ -1,11 +1,8 @@
-from django.conf import settings
 from django.contrib.auth.models import User
-from django.core.cache import caches
 
 from accounts.models import UserProfile
 from twitter.cache import USER_PROFILE_PATTERN
-
-cache = caches['testing'] if settings.TESTING else caches['default']
+from utils.memcached_helper import MemcachedHelper
 
 
 class UserService:
@@ -13,19 +10,66 @@ class UserService:
     @classmethod
     def get_profile_through_cache(cls, user_id):
         key = USER_PROFILE_PATTERN.format(user_id=user_id)
+        # cache miss 的时候只有一个 worker 会去数据库里读
+        return MemcachedHelper.get_through_cache(
+            key,
+            lambda: UserProfile.objects.get_or_create(user_id=user_id)[0],
+        )
 
-        # read from cache first
-        profile = cache.get(key)
-        # cache hit return
-        if profile is not None:
-            return profile
+    @classmethod
+    def get_profile_map_through_cache(cls, user_ids):
+        # 批量版本的 get_profile_through_cache，返回 {user_id: profile}
+        keys = {
+            USER_PROFILE_PATTERN.format(user_id=user_id): user_id
+            for user_id in set(user_ids)
+            if user_id is not None
+        }
+        return MemcachedHelper.get_many_through_cache(keys, cls._load_profile_map)
 
-        # cache miss, read from db
-        profile, _ = UserProfile.objects.get_or_create(user_id=user_id)
-        cache.set(key, profile)
-        return profile
+    @classmethod
+    def _load_profile_map(cls, user_ids):
+        profile_map = {
+            profile.user_id: profile
+            for profile in UserProfile.objects.filter(user_id__in=user_ids)
+        }
+        # 还没有 profile 的用户和 get_profile_through_cache 一样创建一个
+        for user_id in user_ids:
+            if user_id not in profile_map:
+                profile_map[user_id], _ = UserProfile.objects.get_or_create(
+                    user_id=user_id,
+                )
+        return profile_map
 
     @classmethod
-    def invalidate_profile(cls, user_id):
+    def update_profile_cache(cls, user_id):
+        # profile 被删掉的时候不写 tombstone，下次读的时候 get_or_create
         key = USER_PROFILE_PATTERN.format(user_id=user_id)
-        cache.delete(key)
+        MemcachedHelper.update_through_cache(
+            key,
+            lambda: UserProfile.objects.filter(user_id=user_id).first(),
+            allow_tombstone=False,
+        )
+
+    @classmethod
+    def get_users_through_cache(cls, user_ids):
+        # 按照 user_ids 的顺序返回 users，并且预先加载好每个 user 的 profile
+        users = MemcachedHelper.get_objects_through_cache(User, user_ids)
+        profile_map = cls.get_profile_map_through_cache([user.id for user in users])
+        for user in users:
+            setattr(user, '_cached_user_profile', profile_map[user.id])
+        return users
+
+    @classmethod
+    def hydrate_users(cls, objects, user_id_field='user_id', cached_field='_cached_user'):
+        """
+        给一页 objects 批量加载 user 和 profile，放在 cached_field 里
+        model 上的 cached_user 之类的 property 会优先使用它
+        """
+        users = cls.get_users_through_cache([
+            getattr(obj, user_id_field)
+            for obj in objects
+        ])
+        user_map = {user.id: user for user in users}
+        for obj in objects:
+            setattr(obj, cached_field, user_map.get(getattr(obj, user_id_field)))
+        return objects
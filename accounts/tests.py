@@ -1,5 +1,10 @@
+from django.contrib.auth.models import User
+
 from accounts.models import UserProfile
 from testing.testcases import TestCase
+from utils.memcached_helper import MemcachedHelper
+
+LOGIN_URL = '/api/accounts/login/'
 
 
 class UserProfileTests(TestCase):
@@ -12,4 +17,30 @@ class UserProfileTests(TestCase):
         self.assertEqual(UserProfile.objects.count(), 0)
         p = linghu.profile
         self.assertEqual(isinstance(p, UserProfile), True)
-        self.assertEqual(UserProfile.objects.count(), 1)
\ No newline at end of file
+        self.assertEqual(UserProfile.objects.count(), 1)
+
+    def test_user_cache_invalidation(self):
+        linghu = self.create_user('linghu')
+        MemcachedHelper.get_object_through_cache(User, linghu.id)
+
+        # 登录的时候只更新了 last_login，cache 里的 user 不需要 invalidate
+        response = self.client.post(LOGIN_URL, {
+            'username': 'linghu',
+            'password': 'generic password',
+        })
+        self.assertEqual(response.status_code, 200)
+        with self.assertNumQueries(0):
+            user = MemcachedHelper.get_object_through_cache(User, linghu.id)
+        self.assertEqual(user.username, 'linghu')
+
+        # 修改了 cache 里存的字段需要 invalidate
+        linghu.username = 'linghuchong'
+        linghu.save(update_fields=['username'])
+        user = MemcachedHelper.get_object_through_cache(User, linghu.id)
+        self.assertEqual(user.username, 'linghuchong')
+
+        # 不知道修改了哪些字段的时候也需要 invalidate
+        linghu.email = 'linghuchong@jiuzhang.com'
+        linghu.save()
+        user = MemcachedHelper.get_object_through_cache(User, linghu.id)
+        self.assertEqual(user.email, 'linghuchong@jiuzhang.com')
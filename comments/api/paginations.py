@@ -0,0 +1,100 @@
+from django.conf import settings
+from rest_framework.response import Response
+
+from utils.paginations import EndlessPagination
+
+
+class CommentPagination(EndlessPagination):
+    """
+    评论按照 (created_at, id) 正序排列，第一页是最早的评论，next_cursor 往后翻
+    tweet 详情里预览的是最新的几条评论，它给出的 older cursor 往前翻更早的评论
+    每一页都是 (tweet, created_at) index 上的一次范围扫描
+    slice_* 方法返回的都是离 cursor 由近到远的最多 page_size + 1 条数据
+    """
+
+    def slice_queryset(self, queryset, request):
+        direction, created_at, object_id = self.decode_cursor(request)
+        if direction == self.OLDER:
+            if object_id is None:
+                queryset = queryset.filter(created_at__lt=created_at)
+            else:
+                queryset = queryset.filter(created_at__lte=created_at).exclude(
+                    created_at=created_at,
+                    id__gte=object_id,
+                )
+            return list(queryset.order_by('-created_at', '-id')[:self.page_size + 1])
+
+        if direction == self.NEWER:
+            if object_id is None:
+                queryset = queryset.filter(created_at__gt=created_at)
+            else:
+                queryset = queryset.filter(created_at__gte=created_at).exclude(
+                    created_at=created_at,
+                    id__lte=object_id,
+                )
+        return list(queryset.order_by('created_at', 'id')[:self.page_size + 1])
+
+    def slice_ordered_list(self, ordered_list, request):
+        # ordered_list 按照 (created_at, id) 正序排列
+        direction, created_at, object_id = self.decode_cursor(request)
+        if direction is not None:
+            ordered_list = [
+                obj
+                for obj in ordered_list
+                if self._is_after_cursor(obj, direction, created_at, object_id)
+            ]
+        if direction == self.OLDER:
+            ordered_list = ordered_list[::-1]
+        return ordered_list[:self.page_size + 1]
+
+    def slice_cached_list(self, cached_list, request, limit=None):
+        """
+        cached_list 是最新的 limit 条评论，按照 (created_at, id) 倒序排列
+        cursor 之后的评论不全在 cache 里的时候返回 None，调用者需要去数据库里查询
+        """
+        if limit is None:
+            limit = settings.CACHED_LIST_LENGTH_LIMIT
+        objects = self.slice_ordered_list(cached_list[::-1], request)
+        # cached_list 的长度不足最大限制，说明已经是所有的评论了
+        if len(cached_list) < limit:
+            return objects
+        direction, created_at, object_id = self.decode_cursor(request)
+        # 往前翻的时候，能从 cache 里拿到完整的一页 (以及判断下一页的那一条) 就够了
+        if direction == self.OLDER:
+            return objects if len(objects) > self.page_size else None
+        # 第一页是最早的评论，不在 cache 里
+        if direction is None:
+            return None
+        # cache 里最早的一条不比 cursor 新，cursor 之后的评论就都在 cache 里
+        if self._is_after_cursor(cached_list[-1], direction, created_at, object_id):
+            return None
+        return objects
+
+    def paginate_queryset(self, queryset, request, view=None):
+        # list 是 slice_queryset 或者 slice_cached_list 已经切好的数据
+        if type(queryset) != list:
+            queryset = self.slice_queryset(queryset, request)
+        return self._paginate_objects(queryset, request)
+
+    def _paginate_objects(self, objects, request):
+        self.direction, _, _ = self.decode_cursor(request)
+        self.has_next_page = len(objects) > self.page_size
+        self.page = objects[:self.page_size]
+        # 往前翻的时候取出来的是倒序的，返回的一页仍然按照时间正序排列
+        if self.direction == self.OLDER:
+            self.page = self.page[::-1]
+        return self.page
+
+    def get_next_cursor(self):
+        if not self.has_next_page:
+            return None
+        if self.direction == self.OLDER:
+            return self.encode_cursor(self.page[0], self.OLDER)
+        return self.encode_cursor(self.page[-1], self.NEWER)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'comments': data,
+            'has_next_page': self.has_next_page,
+            'next_cursor': self.get_next_cursor(),
+        })
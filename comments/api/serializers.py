@@ -27,9 +27,14 @@ class CommentSerializer(serializers.ModelSerializer):
         )
 
     def get_likes_count(self, obj):
-        return obj.like_set.count()
+        # cache 里的计数器比数据库里的 likes_count 更新
+        return LikeService.get_likes_count(obj)
 
     def get_has_liked(self, obj):
+        # 列表页会把整页的结果通过 LikeService.get_liked_object_ids 预先算好
+        liked_comment_ids = self.context.get('liked_comment_ids')
+        if liked_comment_ids is not None:
+            return obj.id in liked_comment_ids
         return LikeService.has_liked(self.context['request'].user, obj)
 
 
@@ -64,6 +69,7 @@ class CommentSerializerForUpdate(serializers.ModelSerializer):
 
     def update(self, instance, validated_data):
         instance.content = validated_data['content']
-        instance.save()
+        # 只更新 content，避免覆盖掉并发更新的 likes_count
+        instance.save(update_fields=['content', 'updated_at'])
         # update 方法要求 return 修改后的 instance 作为返回值
         return instance
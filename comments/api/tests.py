@@ -1,6 +1,8 @@
+from django.test import override_settings
 from django.utils import timezone
 from rest_framework.test import APIClient
 
+from comments.api.paginations import CommentPagination
 from comments.models import Comment
 from testing.testcases import TestCase
 
@@ -162,4 +164,72 @@ class CommentApiTests(TestCase):
         self.create_newsfeed(self.dongxie, tweet)
         response = self.dongxie_client.get(NEWSFEED_LIST_API)
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(response.data['results'][0]['tweet']['comments_count'], 2)
\ No newline at end of file
+        self.assertEqual(response.data['results'][0]['tweet']['comments_count'], 2)
+
+    def _list_all_comments(self, client, page_size):
+        contents, params = [], {'tweet_id': self.tweet.id}
+        while True:
+            response = client.get(COMMENT_URL, params)
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.data['comments']), page_size)
+            contents += [c['content'] for c in response.data['comments']]
+            if not response.data['has_next_page']:
+                self.assertEqual(response.data['next_cursor'], None)
+                return contents
+            params = {
+                'tweet_id': self.tweet.id,
+                'cursor': response.data['next_cursor'],
+            }
+
+    def test_list_pagination(self):
+        page_size = CommentPagination.page_size
+        expected = [str(i) for i in range(page_size * 2 + 3)]
+        for content in expected:
+            self.create_comment(self.dongxie, self.tweet, content)
+        self.assertEqual(
+            self._list_all_comments(self.linghu_client, page_size),
+            expected,
+        )
+
+        # cache 热了之后，每一页只需要一次查询 has_liked
+        response = self.linghu_client.get(COMMENT_URL, {'tweet_id': self.tweet.id})
+        with self.assertNumQueries(1):
+            self.linghu_client.get(COMMENT_URL, {
+                'tweet_id': self.tweet.id,
+                'cursor': response.data['next_cursor'],
+            })
+
+        # 新的评论和删掉的评论马上就能在列表里看到
+        self.create_comment(self.linghu, self.tweet, 'new')
+        Comment.objects.filter(content='0').delete()
+        self.assertEqual(
+            self._list_all_comments(self.linghu_client, page_size),
+            expected[1:] + ['new'],
+        )
+
+        response = self.anonymous_client.get(COMMENT_URL, {
+            'tweet_id': self.tweet.id,
+            'cursor': 'not-a-cursor',
+        })
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(CACHED_LIST_LENGTH_LIMIT=5)
+    def test_list_pagination_beyond_cached_list(self):
+        page_size = CommentPagination.page_size
+        expected = [str(i) for i in range(page_size + 8)]
+        for content in expected:
+            self.create_comment(self.dongxie, self.tweet, content)
+        # cache 里只有最新的 5 条评论，前面的页从数据库里读
+        self.assertEqual(
+            self._list_all_comments(self.anonymous_client, page_size),
+            expected,
+        )
+        # 修改评论之后 object cache 也会更新
+        comment = Comment.objects.get(content=expected[-1])
+        self.dongxie_client.put(COMMENT_DETAIL_URL.format(comment.id), {
+            'content': 'updated',
+        })
+        self.assertEqual(
+            self._list_all_comments(self.anonymous_client, page_size),
+            expected[:-1] + ['updated'],
+        )
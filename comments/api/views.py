@@ -8,15 +8,21 @@ from comments.api.serializers import (
     CommentSerializerForCreate,
     CommentSerializerForUpdate,
 )
+from comments.api.paginations import CommentPagination
 from comments.models import Comment
+from comments.services import CommentService
 from inbox.services import NotificationService
+from likes.services import LikeService
+from tweets.models import Tweet
 from utils.decorators import required_params
+from utils.memcached_helper import MemcachedHelper
 
 
 class CommentViewSet(viewsets.GenericViewSet):
     serializer_class = CommentSerializerForCreate
     queryset = Comment.objects.all()
     filterset_fields = ('tweet_id',)
+    pagination_class = CommentPagination
 
     def get_permissions(self):
         if self.action == 'create':
@@ -25,18 +31,39 @@ class CommentViewSet(viewsets.GenericViewSet):
             return [IsAuthenticated(), IsObjectOwner()]
         return [AllowAny()]
 
+    def _get_tweet(self, tweet_id):
+        try:
+            return MemcachedHelper.get_object_through_cache(Tweet, int(tweet_id))
+        except ValueError:
+            return None
+
     @required_params(params=['tweet_id'])
     def list(self, request):
-        queryset = self.get_queryset()
-        comments = self.filter_queryset(queryset)\
-            .prefetch_related('user')\
-            .order_by('created_at')
+        # 大部分请求都在 cache 的范围之内，不需要查询 comment 表
+        comments = None
+        tweet = self._get_tweet(request.query_params['tweet_id'])
+        if tweet is not None:
+            cached_comments = CommentService.get_cached_comments(tweet.id)
+            comments = self.paginator.slice_cached_list(cached_comments, request)
+        if comments is None:
+            # tweet_id 不合法的时候 filter_queryset 会返回 400
+            # 只取 id 和 created_at 用来翻页，完整的 comment 从 cache 里批量读
+            queryset = self.filter_queryset(self.get_queryset()).only('id', 'created_at')
+            comments = self.paginator.slice_queryset(queryset, request)
+        page = self.paginate_queryset(comments)
+        comments = CommentService.hydrate_comments(page)
         serializer = CommentSerializer(
             comments,
-            context={'request': request},
+            context={
+                'request': request,
+                'liked_comment_ids': LikeService.get_liked_object_ids(
+                    request.user,
+                    comments,
+                ),
+            },
             many=True,
         )
-        return Response({'comments': serializer.data}, status=status.HTTP_200_OK)
+        return self.get_paginated_response(serializer.data)
 
     def create(self, request, *args, **kwargs):
         data = {
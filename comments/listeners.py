@@ -0,0 +1,39 @@
+from django.db.models import F
+
+
+def incr_comments_count(sender, instance, created, **kwargs):
+    if not created:
+        return
+    _update_comments_count(instance, 1)
+
+
+def decr_comments_count(sender, instance, **kwargs):
+    _update_comments_count(instance, -1)
+
+
+def _update_comments_count(comment, delta):
+    # import 写在函数里面避免循环依赖
+    from tweets.models import Tweet
+    from utils.memcached_helper import MemcachedHelper
+
+    if comment.tweet_id is None:
+        return
+    # 用 F expression 在数据库里原子地 +1/-1，并发的时候不会丢失更新
+    Tweet.objects.filter(id=comment.tweet_id).update(
+        comments_count=F('comments_count') + delta,
+    )
+    # update 不会触发 post_save，需要手动更新 cache
+    MemcachedHelper.update_cached_object(Tweet, comment.tweet_id)
+
+
+def push_comment_to_cache(sender, instance, created, **kwargs):
+    # 评论的内容修改之后 id 和 created_at 都不变，只需要更新 object cache
+    if not created:
+        return
+    from comments.services import CommentService
+    CommentService.push_comment_to_cache(instance)
+
+
+def remove_comment_from_cache(sender, instance, **kwargs):
+    from comments.services import CommentService
+    CommentService.remove_comment_from_cache(instance)
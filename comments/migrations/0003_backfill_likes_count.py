@@ -0,0 +1,35 @@
+from django.db import migrations
+from django.db.models import Count
+
+
+def backfill_likes_count(apps, schema_editor):
+    Comment = apps.get_model('comments', 'Comment')
+    Like = apps.get_model('likes', 'Like')
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+
+    # 新建的数据库里还没有 content type，也就不会有 like
+    content_type = ContentType.objects.filter(app_label='comments', model='comment').first()
+    if content_type is None:
+        return
+    # order_by() 去掉 Meta.ordering 对 GROUP BY 的影响
+    likes_counts = Like.objects.filter(
+        content_type_id=content_type.id,
+    ).order_by().values_list('object_id').annotate(Count('id'))
+    for comment_id, likes_count in likes_counts:
+        Comment.objects.filter(id=comment_id).update(likes_count=likes_count)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comments', '0002_comment_likes_count'),
+        ('likes', '0001_initial'),
+        ('contenttypes', '0002_remove_content_type_name'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            backfill_likes_count,
+            migrations.RunPython.noop,
+        ),
+    ]
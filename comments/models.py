@@ -1,9 +1,18 @@
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
 from django.db import models
+from django.db.models.signals import post_save, pre_delete
 
+from comments.listeners import (
+    decr_comments_count,
+    incr_comments_count,
+    push_comment_to_cache,
+    remove_comment_from_cache,
+)
 from likes.models import Like
 from tweets.models import Tweet
+from utils.cache_codecs import ModelCodec
+from utils.listeners import invalidate_object_cache
 from utils.memcached_helper import MemcachedHelper
 
 
@@ -13,6 +22,8 @@ class Comment(models.Model):
     content = models.TextField(max_length=140)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # 冗余存储的 likes 数量，在 like 创建和删除的时候更新
+    likes_count = models.IntegerField(default=0)
 
     class Meta:
         # 有在某个 tweet 下排序所有 comments 的需求
@@ -35,4 +46,18 @@ class Comment(models.Model):
 
     @property
     def cached_user(self):
+        # 翻页的时候 UserService.hydrate_users 会批量预先加载好
+        if hasattr(self, '_cached_user'):
+            return self._cached_user
         return MemcachedHelper.get_object_through_cache(User, self.user_id)
+
+
+ModelCodec.register(Comment)
+
+post_save.connect(incr_comments_count, sender=Comment)
+pre_delete.connect(decr_comments_count, sender=Comment)
+# hook up with listeners to update cache
+post_save.connect(invalidate_object_cache, sender=Comment)
+pre_delete.connect(invalidate_object_cache, sender=Comment)
+post_save.connect(push_comment_to_cache, sender=Comment)
+pre_delete.connect(remove_comment_from_cache, sender=Comment)
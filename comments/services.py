@@ -0,0 +1,62 @@
+from django.conf import settings
+
+from accounts.services import UserService
+from comments.models import Comment
+from likes.services import LikeService
+from twitter.cache import TWEET_COMMENTS_PATTERN
+from utils.memcached_helper import MemcachedHelper
+
+
+class CommentService(object):
+
+    @classmethod
+    def get_cached_comments(cls, tweet_id):
+        """
+        cache 里存的是 tweet 最新的 CACHED_LIST_LENGTH_LIMIT 条评论的 (id, created_at)
+        按照 (created_at, id) 倒序排列，返回只有 id 和 created_at 的 Comment 对象
+        """
+        key = TWEET_COMMENTS_PATTERN.format(tweet_id=tweet_id)
+        entries = MemcachedHelper.get_through_cache(
+            key,
+            lambda: list(
+                Comment.objects.filter(tweet_id=tweet_id)
+                .order_by('-created_at', '-id')
+                .values_list('id', 'created_at')
+                [:settings.CACHED_LIST_LENGTH_LIMIT]
+            ),
+        )
+        return [
+            Comment(id=comment_id, tweet_id=tweet_id, created_at=created_at)
+            for comment_id, created_at in entries
+        ]
+
+    @classmethod
+    def push_comment_to_cache(cls, comment):
+        if comment.tweet_id is None:
+            return
+        MemcachedHelper.push_to_cached_list(
+            TWEET_COMMENTS_PATTERN.format(tweet_id=comment.tweet_id),
+            (comment.id, comment.created_at),
+        )
+
+    @classmethod
+    def remove_comment_from_cache(cls, comment):
+        if comment.tweet_id is None:
+            return
+        MemcachedHelper.remove_from_cached_list(
+            TWEET_COMMENTS_PATTERN.format(tweet_id=comment.tweet_id),
+            comment.id,
+        )
+
+    @classmethod
+    def hydrate_comments(cls, comments):
+        """
+        comments 里只需要有 id，一次 multi-get 换成完整的 comment，
+        再批量加载 comment 的 user，profile 和 likes_count，已经被删掉的 comment 会被跳过
+        """
+        comments = MemcachedHelper.get_objects_through_cache(
+            Comment,
+            [comment.id for comment in comments],
+        )
+        LikeService.hydrate_likes_counts(comments)
+        return UserService.hydrate_users(comments)
@@ -1,3 +1,7 @@
+from django.test import override_settings
+
+from comments.models import Comment
+from comments.services import CommentService
 from testing.testcases import TestCase
 
 
@@ -21,4 +25,35 @@ class CommentModelTests(TestCase):
 
         dongxie = self.create_user('dongxie')
         self.create_like(dongxie, self.comment)
-        self.assertEqual(self.comment.like_set.count(), 2)
\ No newline at end of file
+        self.assertEqual(self.comment.like_set.count(), 2)
+
+    @override_settings(CACHED_LIST_LENGTH_LIMIT=3)
+    def test_cached_comments(self):
+        comments = [self.comment] + [
+            self.create_comment(self.linghu, self.tweet, str(i))
+            for i in range(3)
+        ]
+        cached = CommentService.get_cached_comments(self.tweet.id)
+        self.assertEqual(
+            [c.id for c in cached],
+            [c.id for c in comments[:0:-1]],
+        )
+
+        # 新的评论直接加到 cache 里
+        comment = self.create_comment(self.linghu, self.tweet, 'new')
+        with self.assertNumQueries(0):
+            cached = CommentService.get_cached_comments(self.tweet.id)
+        self.assertEqual(
+            [c.id for c in cached],
+            [comment.id, comments[3].id, comments[2].id],
+        )
+
+        # 满了的 list 删掉一条之后重新加载
+        comment.delete()
+        with self.assertNumQueries(1):
+            cached = CommentService.get_cached_comments(self.tweet.id)
+        self.assertEqual(
+            [c.id for c in cached],
+            [c.id for c in comments[:0:-1]],
+        )
+        self.assertEqual(Comment.objects.filter(tweet=self.tweet).count(), 4)
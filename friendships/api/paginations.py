@@ -1,8 +1,31 @@
+from functools import partial
+
+from django.conf import settings
+from django.core.paginator import Paginator
 from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
 
+from utils.paginations import EndlessPagination
+
+
+class KnownCountPaginator(Paginator):
+    """
+    总数已经知道的时候（比如 profile 上冗余存储的粉丝数）不再执行 COUNT 查询
+    """
+
+    def __init__(self, *args, count=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if count is not None:
+            # count 是 cached_property，直接写进 __dict__ 就不会再去计算
+            self.__dict__['count'] = count
+
 
 class FriendshipPagination(PageNumberPagination):
+    """
+    默认按页码翻页，请求里带了 cursor (第一页可以传空的 ?cursor=) 的时候
+    切换成和 EndlessPagination 一样的 cursor 翻页
+    cursor 翻页是 (user_id, created_at) index 上的范围扫描，第 N 页和第一页一样快
+    """
     # 默认的 page size，也就是 page 没有在 url 参数里的时候
     page_size = 20
     # 默认 page_size_query_param 是 None 表示不允许客户端指定每一页的大小
@@ -10,7 +33,51 @@ class FriendshipPagination(PageNumberPagination):
     # 允许客户端指定的最大 page_size 是多少
     max_page_size = 20
 
+    def __init__(self):
+        super().__init__()
+        self.cursor_pagination = None
+
+    def paginate_queryset(
+        self,
+        queryset,
+        request,
+        view=None,
+        count=None,
+        cached_list=None,
+    ):
+        """
+        cached_list 是按照 (created_at, id) 倒序排列的最新的一部分数据，
+        要翻的这一页在 cached_list 的范围之内的时候就不需要查询数据库
+        """
+        if EndlessPagination.is_requested(request):
+            self.cursor_pagination = EndlessPagination()
+            self.cursor_pagination.page_size = self.get_page_size(request)
+            objects = None
+            if cached_list is not None:
+                objects = self.cursor_pagination.slice_cached_list(cached_list, request)
+            if objects is None:
+                objects = self.cursor_pagination.slice_queryset(queryset, request)
+            return self.cursor_pagination.paginate_queryset(objects, request, view)
+
+        if cached_list is not None and self._is_page_cached(cached_list, request):
+            queryset = cached_list
+        self.django_paginator_class = partial(KnownCountPaginator, count=count)
+        return super().paginate_queryset(queryset, request, view)
+
+    def _is_page_cached(self, cached_list, request):
+        # cached_list 不足最大长度的时候说明已经是全部数据了
+        if len(cached_list) < settings.CACHED_LIST_LENGTH_LIMIT:
+            return True
+        try:
+            page_number = int(request.query_params.get(self.page_query_param, 1))
+        except ValueError:
+            # 交给 PageNumberPagination 返回 404
+            return False
+        return page_number * self.get_page_size(request) <= len(cached_list)
+
     def get_paginated_response(self, data):
+        if self.cursor_pagination is not None:
+            return self.cursor_pagination.get_paginated_response(data)
         return Response({
             'total_results': self.page.paginator.count,
             'total_pages': self.page.paginator.num_pages,
@@ -1,3 +1,4 @@
+from django.test import override_settings
 from friendships.models import Friendship
 from rest_framework.test import APIClient
 from testing.testcases import TestCase
@@ -215,4 +216,109 @@ class FriendshipApiTests(TestCase):
         self.assertEqual(response.data['total_pages'], page_size)
         self.assertEqual(response.data['total_results'], page_size * 2)
         self.assertEqual(response.data['page_number'], 1)
-        self.assertEqual(response.data['has_next_page'], True)
\ No newline at end of file
+        self.assertEqual(response.data['has_next_page'], True)
+
+    def test_pagination_uses_counters(self):
+        url = FOLLOWINGS_URL.format(self.dongxie.id)
+        response = self.anonymous_client.get(url, {'page': 1})
+        self.assertEqual(response.data['total_results'], 3)
+
+        # 总数来自 profile 上的 counter，列表来自 cache，不需要查询数据库
+        with self.assertNumQueries(0):
+            response = self.anonymous_client.get(url, {'page': 1})
+        self.assertEqual(response.data['total_results'], 3)
+        self.assertEqual(len(response.data['results']), 3)
+        # 列表里嵌套的 user 不带粉丝数和关注数
+        self.assertNotIn('followers_count', response.data['results'][0]['user'])
+
+        response = self.anonymous_client.get(FOLLOWERS_URL.format(self.dongxie.id))
+        self.assertEqual(response.data['total_results'], 2)
+        response = self.anonymous_client.get(FOLLOWERS_URL.format(0))
+        self.assertEqual(response.data['total_results'], 0)
+        self.assertEqual(response.data['results'], [])
+
+    def test_cursor_pagination(self):
+        page_size = FriendshipPagination.page_size
+        followers = []
+        for i in range(page_size * 2 + 1):
+            follower = self.create_user('linghu_follower{}'.format(i))
+            Friendship.objects.create(from_user=follower, to_user=self.linghu)
+            followers.append(follower)
+        url = FOLLOWERS_URL.format(self.linghu.id)
+
+        # 空的 cursor 表示第一页
+        response = self.anonymous_client.get(url, {'cursor': ''})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['has_next_page'], True)
+        self.assertNotIn('total_results', response.data)
+        usernames = [r['user']['username'] for r in response.data['results']]
+        self.assertEqual(usernames, [
+            user.username
+            for user in followers[::-1][:page_size]
+        ])
+
+        # 之后的每一页都是 index 上的一次范围查询，不需要 OFFSET 或者 COUNT
+        next_cursor = response.data['next_cursor']
+        self.anonymous_client.get(url, {'cursor': next_cursor})
+        # friendship 列表，user 和 profile 都在 cache 里了
+        with self.assertNumQueries(0):
+            response = self.anonymous_client.get(url, {'cursor': next_cursor})
+        self.assertEqual(response.data['has_next_page'], True)
+        self.assertEqual(
+            response.data['results'][0]['user']['username'],
+            followers[-page_size - 1].username,
+        )
+        response = self.anonymous_client.get(url, {
+            'cursor': response.data['next_cursor'],
+        })
+        self.assertEqual(response.data['has_next_page'], False)
+        self.assertEqual(response.data['next_cursor'], None)
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(
+            response.data['results'][0]['user']['username'],
+            followers[0].username,
+        )
+
+        # 用 refresh_cursor 拉取新的粉丝
+        response = self.anonymous_client.get(url, {'cursor': '', 'size': 5})
+        self.assertEqual(len(response.data['results']), 5)
+        refresh_cursor = response.data['refresh_cursor']
+        new_follower = self.create_user('new_follower')
+        Friendship.objects.create(from_user=new_follower, to_user=self.linghu)
+        response = self.anonymous_client.get(url, {'cursor': refresh_cursor})
+        self.assertEqual(
+            [r['user']['username'] for r in response.data['results']],
+            ['new_follower'],
+        )
+
+        # 不带 cursor 的时候仍然按页码翻页
+        response = self.anonymous_client.get(url, {'page': 2})
+        self.assertEqual(response.data['page_number'], 2)
+        self.assertEqual(response.data['total_results'], page_size * 2 + 2)
+
+    @override_settings(CACHED_LIST_LENGTH_LIMIT=5)
+    def test_pagination_beyond_cached_list(self):
+        followers = []
+        for i in range(12):
+            follower = self.create_user('linghu_follower{}'.format(i))
+            Friendship.objects.create(from_user=follower, to_user=self.linghu)
+            followers.append(follower)
+        expected = [user.username for user in followers[::-1]]
+        url = FOLLOWERS_URL.format(self.linghu.id)
+
+        # cache 里只有最新的 5 个粉丝，之后的页从数据库里读
+        usernames, params = [], {'cursor': '', 'size': 4}
+        while True:
+            response = self.anonymous_client.get(url, params)
+            usernames += [r['user']['username'] for r in response.data['results']]
+            if not response.data['has_next_page']:
+                break
+            params = {'cursor': response.data['next_cursor'], 'size': 4}
+        self.assertEqual(usernames, expected)
+
+        for page in (1, 2, 3):
+            response = self.anonymous_client.get(url, {'page': page, 'size': 4})
+            self.assertEqual(
+                [r['user']['username'] for r in response.data['results']],
+                expected[(page - 1) * 4:page * 4],
+            )
@@ -1,9 +1,11 @@
 from django.contrib.auth.models import User
+from django.db import transaction
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
 
+from accounts.services import UserService
 from friendships.api.serializers import (
     FollowingSerializer,
     FollowerSerializer,
@@ -12,6 +14,8 @@ from friendships.api.serializers import (
 from friendships.models import Friendship
 from friendships.api.paginations import FriendshipPagination
 from friendships.services import FriendshipService
+from utils.memcached_helper import MemcachedHelper
+from utils.paginations import EndlessPagination
 
 
 class FriendshipViewSet(viewsets.GenericViewSet):
@@ -22,10 +26,54 @@ class FriendshipViewSet(viewsets.GenericViewSet):
     def list(self, request):
         return Response({'message': 'This is friendship homepage'})
 
+    def _get_profile(self, pk):
+        # user 不存在的时候返回 None，不能给不存在的 user 创建 profile
+        try:
+            user_id = int(pk)
+        except ValueError:
+            return None
+        if MemcachedHelper.get_object_through_cache(User, user_id) is None:
+            return None
+        return UserService.get_profile_through_cache(user_id)
+
+    def _get_cached_friendships(self, pk, get_cached_list):
+        # pk 不是数字的时候交给数据库查询去处理
+        try:
+            return get_cached_list(int(pk))
+        except ValueError:
+            return None
+
+    def _paginate_friendships(self, friendships, cached_friendships, pk, count_field):
+        # cursor 翻页不需要总数
+        if EndlessPagination.is_requested(self.request):
+            count = None
+        else:
+            # 总数直接用 profile 上的 counter，不需要再 COUNT 一次
+            profile = self._get_profile(pk)
+            count = getattr(profile, count_field) if profile else 0
+        return self.paginator.paginate_queryset(
+            friendships,
+            self.request,
+            view=self,
+            count=count,
+            cached_list=cached_friendships,
+        )
+
     @action(methods=['GET'], detail=True, permission_classes=[AllowAny])
     def followers(self, request, pk):
+        # 大部分请求都是前几页，直接用 cache 里最新的粉丝列表，不需要查询 friendship 表
         friendships = Friendship.objects.filter(to_user_id=pk)
-        page = self.paginate_queryset(friendships)
+        cached_friendships = self._get_cached_friendships(
+            pk,
+            FriendshipService.get_cached_followers,
+        )
+        page = self._paginate_friendships(
+            friendships,
+            cached_friendships,
+            pk,
+            'followers_count',
+        )
+        UserService.hydrate_users(page, 'from_user_id', '_cached_from_user')
         serializer = FollowerSerializer(page, many=True,
                                         context={'request': request})
         return self.get_paginated_response(serializer.data)
@@ -33,7 +81,17 @@ class FriendshipViewSet(viewsets.GenericViewSet):
     @action(methods=['GET'], detail=True, permission_classes=[AllowAny])
     def followings(self, request, pk):
         friendships = Friendship.objects.filter(from_user_id=pk)
-        page = self.paginate_queryset(friendships)
+        cached_friendships = self._get_cached_friendships(
+            pk,
+            FriendshipService.get_cached_followings,
+        )
+        page = self._paginate_friendships(
+            friendships,
+            cached_friendships,
+            pk,
+            'followings_count',
+        )
+        UserService.hydrate_users(page, 'to_user_id', '_cached_to_user')
         serializer = FollowingSerializer(page, many=True,
                                          context={'request': request})
         return self.get_paginated_response(serializer.data)
@@ -58,7 +116,9 @@ class FriendshipViewSet(viewsets.GenericViewSet):
                 'success': False,
                 'errors': serializer.errors,
             }, status=status.HTTP_400_BAD_REQUEST)
-        serializer.save()
+        # friendship 和两个用户的 counter 要一起写入
+        with transaction.atomic():
+            serializer.save()
         # FriendshipService.invalidate_following_cache(request.user.id)
         return Response({'success': True}, status=status.HTTP_201_CREATED)
 
@@ -74,9 +134,10 @@ class FriendshipViewSet(viewsets.GenericViewSet):
                 'message': 'You cannot unfollow yourself',
             }, status=status.HTTP_400_BAD_REQUEST)
 
-        deleted, _ = Friendship.objects.filter(
-            from_user=request.user,
-            to_user=unfollow_user,
-        ).delete()
+        with transaction.atomic():
+            deleted, _ = Friendship.objects.filter(
+                from_user=request.user,
+                to_user=unfollow_user,
+            ).delete()
         # FriendshipService.invalidate_following_cache(request.user.id)
         return Response({'success': True, 'deleted': deleted})
\ No newline at end of file
@@ -1,3 +1,31 @@
-def invalidate_following_cache(sender, instance, **kwargs):
+def add_following_to_cache(sender, instance, created, **kwargs):
     from friendships.services import FriendshipService
-    FriendshipService.invalidate_following_cache(instance.from_user_id)
+    if not created:
+        FriendshipService.invalidate_following_cache(instance.from_user_id)
+        FriendshipService.invalidate_friendship_lists(instance)
+        return
+    FriendshipService.update_friendship_counts(
+        instance.from_user_id,
+        instance.to_user_id,
+        1,
+    )
+    # 只修改 cache 里的 following set，不需要重新加载所有的 friendships
+    FriendshipService.add_following_to_cache(
+        instance.from_user_id,
+        instance.to_user_id,
+    )
+    FriendshipService.push_friendship_to_cache(instance)
+
+
+def remove_following_from_cache(sender, instance, **kwargs):
+    from friendships.services import FriendshipService
+    FriendshipService.update_friendship_counts(
+        instance.from_user_id,
+        instance.to_user_id,
+        -1,
+    )
+    FriendshipService.remove_following_from_cache(
+        instance.from_user_id,
+        instance.to_user_id,
+    )
+    FriendshipService.remove_friendship_from_cache(instance)
@@ -2,7 +2,10 @@ from django.contrib.auth.models import User
 from django.db import models
 from django.db.models.signals import post_save, pre_delete
 
-from friendships.listeners import invalidate_following_cache
+from friendships.listeners import (
+    add_following_to_cache,
+    remove_following_from_cache,
+)
 from utils.memcached_helper import MemcachedHelper
 
 
@@ -36,13 +39,18 @@ class Friendship(models.Model):
 
     @property
     def cached_from_user(self):
+        # 翻页的时候 UserService.hydrate_users 会批量预先加载好
+        if hasattr(self, '_cached_from_user'):
+            return self._cached_from_user
         return MemcachedHelper.get_object_through_cache(User, self.from_user_id)
 
     @property
     def cached_to_user(self):
+        if hasattr(self, '_cached_to_user'):
+            return self._cached_to_user
         return MemcachedHelper.get_object_through_cache(User, self.to_user_id)
 
 
-# hook up with listeners to invalidate cache
-pre_delete.connect(invalidate_following_cache, sender=Friendship)
-post_save.connect(invalidate_following_cache, sender=Friendship)
+# hook up with listeners to update cache
+pre_delete.connect(remove_following_from_cache, sender=Friendship)
+post_save.connect(add_following_to_cache, sender=Friendship)
@@ -1,9 +1,17 @@
-from friendships.models import Friendship
 from django.conf import settings
-from django.core.cache import caches
-from twitter.cache import FOLLOWINGS_PATTERN
 
-cache = caches['testing'] if settings.TESTING else caches['default']
+from accounts.models import UserProfile
+from accounts.services import UserService
+from friendships.models import Friendship
+from django.db.models import F, Q
+from twitter.cache import (
+    CELEBRITY_USER_IDS_KEY,
+    FOLLOWINGS_PATTERN,
+    USER_FOLLOWERS_PATTERN,
+    USER_FOLLOWINGS_PATTERN,
+)
+from utils.cache_codecs import CompactIdSet
+from utils.memcached_helper import MemcachedHelper
 
 
 class FriendshipService(object):
@@ -14,22 +22,233 @@ class FriendshipService(object):
         ).prefetch_related('from_user')
         return [friendship.from_user for friendship in friendships]
 
+    @classmethod
+    def get_follower_id_chunks(cls, to_user_id, chunk_size=1000):
+        """
+        按照关注时间的顺序，每次读 chunk_size 个粉丝的 id
+        用 (created_at, id) 做游标而不是 offset，每一次查询都是
+        (to_user_id, created_at) 这个 index 上的一次范围扫描
+        """
+        friendships = Friendship.objects.filter(
+            to_user_id=to_user_id,
+        ).order_by('created_at', 'id')
+        last_created_at, last_id = None, None
+        while True:
+            queryset = friendships
+            if last_id is not None:
+                queryset = queryset.filter(
+                    Q(created_at__gt=last_created_at) |
+                    Q(created_at=last_created_at, id__gt=last_id)
+                )
+            rows = list(queryset.values_list(
+                'created_at',
+                'id',
+                'from_user_id',
+            )[:chunk_size])
+            if not rows:
+                return
+            # from_user 被删掉之后 from_user_id 会变成 null
+            yield [
+                from_user_id
+                for _, _, from_user_id in rows
+                if from_user_id is not None
+            ]
+            if len(rows) < chunk_size:
+                return
+            last_created_at, last_id, _ = rows[-1]
+
+    @classmethod
+    def get_follower_counts(cls, user_ids):
+        # 直接读 profile 上冗余存储的粉丝数，不需要 COUNT 整张 friendship 表
+        profile_map = UserService.get_profile_map_through_cache(user_ids)
+        return {
+            user_id: profile_map[user_id].followers_count
+            for user_id in user_ids
+        }
+
+    @classmethod
+    def update_friendship_counts(cls, from_user_id, to_user_id, delta):
+        """
+        follow 的时候 delta 是 1，unfollow 的时候是 -1
+        需要和 friendship 的写入在同一个 transaction 里调用
+        """
+        for user_id, field in (
+            (from_user_id, 'followings_count'),
+            (to_user_id, 'followers_count'),
+        ):
+            # 用户被删掉之后 friendship 上的 user_id 会变成 null
+            if user_id is None:
+                continue
+            # 用 F expression 在数据库里做加减，避免并发的时候丢失更新
+            # 大部分用户都已经有 profile 了，先 update，没有更新到的时候再创建
+            updates = {field: F(field) + delta}
+            if not UserProfile.objects.filter(user_id=user_id).update(**updates):
+                UserProfile.objects.get_or_create(user_id=user_id)
+                UserProfile.objects.filter(user_id=user_id).update(**updates)
+            if field == 'followers_count':
+                cls._update_celebrity_user_id_set(user_id, delta)
+            # update() 不会触发 post_save，需要手动更新 cache
+            UserService.update_profile_cache(user_id)
+
+    @classmethod
+    def get_celebrity_user_id_set(cls):
+        return MemcachedHelper.get_through_cache(
+            CELEBRITY_USER_IDS_KEY,
+            cls._load_celebrity_user_id_set,
+        )
+
+    @classmethod
+    def _load_celebrity_user_id_set(cls):
+        return CompactIdSet(
+            UserProfile.objects.filter(
+                followers_count__gte=settings.NEWSFEED_PULL_FOLLOWERS_THRESHOLD,
+                user_id__isnull=False,
+            ).values_list('user_id', flat=True)
+        )
+
+    @classmethod
+    def _update_celebrity_user_id_set(cls, user_id, delta):
+        """
+        粉丝数跨过阈值的时候修改 cache 里的大V集合
+        update 已经锁住了这一行，读到的是这个 transaction 自己加减之后的值，
+        并发的 follow 里只有一个会正好读到阈值
+        """
+        threshold = settings.NEWSFEED_PULL_FOLLOWERS_THRESHOLD
+        followers_count = UserProfile.objects.filter(
+            user_id=user_id,
+        ).values_list('followers_count', flat=True).first()
+        if delta > 0 and followers_count == threshold:
+            MemcachedHelper.update_cached_value(
+                CELEBRITY_USER_IDS_KEY,
+                lambda user_id_set: user_id_set | {user_id},
+            )
+        elif delta < 0 and followers_count == threshold - 1:
+            MemcachedHelper.update_cached_value(
+                CELEBRITY_USER_IDS_KEY,
+                lambda user_id_set: user_id_set - {user_id},
+            )
+
     @classmethod
     def get_following_user_id_set(cls, from_user_id):
         key = FOLLOWINGS_PATTERN.format(user_id=from_user_id)
-        user_id_set = cache.get(key)
-        if user_id_set is not None:
-            return user_id_set
+        return MemcachedHelper.get_through_cache(
+            key,
+            lambda: cls._load_following_user_id_set(from_user_id),
+        )
+
+    @classmethod
+    def _load_following_user_id_set(cls, from_user_id):
+        return CompactIdSet(
+            Friendship.objects.filter(
+                from_user_id=from_user_id,
+                to_user_id__isnull=False,
+            ).order_by().values_list('to_user_id', flat=True)
+        )
+
+    @classmethod
+    def add_following_to_cache(cls, from_user_id, to_user_id):
+        if to_user_id is None:
+            return
+        key = FOLLOWINGS_PATTERN.format(user_id=from_user_id)
+        MemcachedHelper.update_cached_value(
+            key,
+            lambda user_id_set: user_id_set | {to_user_id},
+        )
 
-        friendships = Friendship.objects.filter(from_user_id=from_user_id)
-        user_id_set = set([
-            fs.to_user_id
-            for fs in friendships
-        ])
-        cache.set(key, user_id_set)
-        return user_id_set
+    @classmethod
+    def remove_following_from_cache(cls, from_user_id, to_user_id):
+        key = FOLLOWINGS_PATTERN.format(user_id=from_user_id)
+        MemcachedHelper.update_cached_value(
+            key,
+            lambda user_id_set: user_id_set - {to_user_id},
+        )
 
     @classmethod
     def invalidate_following_cache(cls, from_user_id):
         key = FOLLOWINGS_PATTERN.format(user_id=from_user_id)
-        cache.delete(key)
+        MemcachedHelper.update_through_cache(
+            key,
+            lambda: cls._load_following_user_id_set(from_user_id),
+        )
+
+    @classmethod
+    def get_cached_followers(cls, user_id):
+        """
+        cache 里存的是最新的 CACHED_LIST_LENGTH_LIMIT 个粉丝的
+        (friendship_id, from_user_id, created_at)，返回没有保存的 Friendship 对象
+        """
+        key = USER_FOLLOWERS_PATTERN.format(user_id=user_id)
+        entries = MemcachedHelper.get_through_cache(
+            key,
+            lambda: cls._load_friendship_entries('from_user_id', to_user_id=user_id),
+        )
+        return [
+            Friendship(
+                id=friendship_id,
+                from_user_id=from_user_id,
+                to_user_id=user_id,
+                created_at=created_at,
+            )
+            for friendship_id, from_user_id, created_at in entries
+        ]
+
+    @classmethod
+    def get_cached_followings(cls, user_id):
+        # 和 get_cached_followers 一样，存的是 (friendship_id, to_user_id, created_at)
+        key = USER_FOLLOWINGS_PATTERN.format(user_id=user_id)
+        entries = MemcachedHelper.get_through_cache(
+            key,
+            lambda: cls._load_friendship_entries('to_user_id', from_user_id=user_id),
+        )
+        return [
+            Friendship(
+                id=friendship_id,
+                from_user_id=user_id,
+                to_user_id=to_user_id,
+                created_at=created_at,
+            )
+            for friendship_id, to_user_id, created_at in entries
+        ]
+
+    @classmethod
+    def _load_friendship_entries(cls, user_id_field, **filters):
+        return list(
+            Friendship.objects.filter(**filters)
+            .order_by('-created_at', '-id')
+            .values_list('id', user_id_field, 'created_at')
+            [:settings.CACHED_LIST_LENGTH_LIMIT]
+        )
+
+    @classmethod
+    def _get_friendship_list_keys(cls, friendship):
+        # 返回 [(key, 存在 entry 里的另一方的 user_id)]
+        keys = []
+        if friendship.to_user_id is not None:
+            keys.append((
+                USER_FOLLOWERS_PATTERN.format(user_id=friendship.to_user_id),
+                friendship.from_user_id,
+            ))
+        if friendship.from_user_id is not None:
+            keys.append((
+                USER_FOLLOWINGS_PATTERN.format(user_id=friendship.from_user_id),
+                friendship.to_user_id,
+            ))
+        return keys
+
+    @classmethod
+    def push_friendship_to_cache(cls, friendship):
+        for key, user_id in cls._get_friendship_list_keys(friendship):
+            MemcachedHelper.push_to_cached_list(
+                key,
+                (friendship.id, user_id, friendship.created_at),
+            )
+
+    @classmethod
+    def remove_friendship_from_cache(cls, friendship):
+        for key, _ in cls._get_friendship_list_keys(friendship):
+            MemcachedHelper.remove_from_cached_list(key, friendship.id)
+
+    @classmethod
+    def invalidate_friendship_lists(cls, friendship):
+        for key, _ in cls._get_friendship_list_keys(friendship):
+            MemcachedHelper.invalidate(key)
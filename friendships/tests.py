@@ -1,6 +1,15 @@
+from django.core.cache import caches
+from django.db import transaction
+from django.test import override_settings
+
+from accounts.models import UserProfile
+from accounts.services import UserService
 from friendships.models import Friendship
 from friendships.services import FriendshipService
 from testing.testcases import TestCase
+from twitter.cache import FOLLOWINGS_PATTERN
+from utils.cache_codecs import CompactIdSet
+from utils.memcached_helper import MemcachedHelper
 
 
 class FriendshipServiceTests(TestCase):
@@ -23,4 +32,200 @@ class FriendshipServiceTests(TestCase):
         Friendship.objects.filter(from_user=self.linghu, to_user=self.dongxie).delete()
         # FriendshipService.invalidate_following_cache(self.linghu.id)
         user_id_set = FriendshipService.get_following_user_id_set(self.linghu.id)
-        self.assertSetEqual(user_id_set, {user1.id, user2.id})
\ No newline at end of file
+        self.assertSetEqual(user_id_set, {user1.id, user2.id})
+
+    def test_following_cache_delta(self):
+        Friendship.objects.create(from_user=self.linghu, to_user=self.dongxie)
+        FriendshipService.get_following_user_id_set(self.linghu.id)
+
+        # follow 和 unfollow 只修改 cache 里的 set，不需要重新加载
+        user1 = self.create_user('user1')
+        Friendship.objects.create(from_user=self.linghu, to_user=user1)
+        with self.assertNumQueries(0):
+            user_id_set = FriendshipService.get_following_user_id_set(self.linghu.id)
+        self.assertSetEqual(user_id_set, {self.dongxie.id, user1.id})
+        Friendship.objects.filter(from_user=self.linghu, to_user=self.dongxie).delete()
+        with self.assertNumQueries(0):
+            user_id_set = FriendshipService.get_following_user_id_set(self.linghu.id)
+        self.assertSetEqual(user_id_set, {user1.id})
+
+        # 拿不到锁的时候直接删掉，下次读的时候重新加载
+        key = FOLLOWINGS_PATTERN.format(user_id=self.linghu.id)
+        caches['testing'].add(MemcachedHelper.get_lock_key(key), 1)
+        Friendship.objects.create(from_user=self.linghu, to_user=self.dongxie)
+        caches['testing'].delete(MemcachedHelper.get_lock_key(key))
+        with self.assertNumQueries(1):
+            user_id_set = FriendshipService.get_following_user_id_set(self.linghu.id)
+        self.assertSetEqual(user_id_set, {self.dongxie.id, user1.id})
+
+        # cache 里没有的时候不做任何修改
+        self.clear_cache()
+        Friendship.objects.create(from_user=self.dongxie, to_user=self.linghu)
+        self.assertIsNone(caches['testing'].get(
+            FOLLOWINGS_PATTERN.format(user_id=self.dongxie.id),
+        ))
+
+    def test_following_cache_delta_on_commit(self):
+        FriendshipService.get_following_user_id_set(self.linghu.id)
+
+        # 事务回滚的话 cache 不会被修改
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                Friendship.objects.create(from_user=self.linghu, to_user=self.dongxie)
+                raise RuntimeError
+        with self.assertNumQueries(0):
+            user_id_set = FriendshipService.get_following_user_id_set(self.linghu.id)
+        self.assertSetEqual(user_id_set, set())
+
+        # 事务提交之前别的连接读到的是旧数据，这里直接把旧数据写进 cache 模拟
+        # 提交的时候会在旧数据上修改
+        key = FOLLOWINGS_PATTERN.format(user_id=self.linghu.id)
+        with transaction.atomic():
+            Friendship.objects.create(from_user=self.linghu, to_user=self.dongxie)
+            MemcachedHelper._store(
+                key,
+                MemcachedHelper._make_entry(CompactIdSet([]), 0, None),
+                None,
+            )
+        with self.assertNumQueries(0):
+            user_id_set = FriendshipService.get_following_user_id_set(self.linghu.id)
+        self.assertSetEqual(user_id_set, {self.dongxie.id})
+
+    @override_settings(CACHE_CHUNK_SIZE_BYTES=16)
+    def test_chunked_following_cache(self):
+        to_users = [self.create_user('user{}'.format(i)) for i in range(10)]
+        for to_user in to_users:
+            Friendship.objects.create(from_user=self.linghu, to_user=to_user)
+        expected_ids = {to_user.id for to_user in to_users}
+
+        # 10 个 id 一共 40 个字节，切成 3 个 chunk
+        user_id_set = FriendshipService.get_following_user_id_set(self.linghu.id)
+        self.assertSetEqual(user_id_set, expected_ids)
+        key = FOLLOWINGS_PATTERN.format(user_id=self.linghu.id)
+        chunk_keys = [
+            chunk_key
+            for chunk_key in caches['testing']._cache
+            if ':chunk:' in chunk_key and key in chunk_key
+        ]
+        self.assertEqual(len(chunk_keys), 3)
+        with self.assertNumQueries(0):
+            user_id_set = FriendshipService.get_following_user_id_set(self.linghu.id)
+        self.assertSetEqual(user_id_set, expected_ids)
+        self.assertIn(to_users[0].id, user_id_set)
+        self.assertNotIn(self.dongxie.id, user_id_set)
+
+        # follow 之后写入新的一组 chunk
+        Friendship.objects.create(from_user=self.linghu, to_user=self.dongxie)
+        with self.assertNumQueries(0):
+            user_id_set = FriendshipService.get_following_user_id_set(self.linghu.id)
+        self.assertIn(self.dongxie.id, user_id_set)
+
+        # chunk 被 evict 了当成 cache miss
+        caches['testing'].clear()
+        FriendshipService.get_following_user_id_set(self.linghu.id)
+        chunk_key = next(
+            chunk_key
+            for chunk_key in caches['testing']._cache
+            if ':chunk:' in chunk_key
+        )
+        # 去掉 KEY_PREFIX 和 version 的前缀
+        caches['testing'].delete(chunk_key.split(':', 2)[2])
+        with self.assertNumQueries(1):
+            user_id_set = FriendshipService.get_following_user_id_set(self.linghu.id)
+        self.assertSetEqual(user_id_set, expected_ids | {self.dongxie.id})
+        # 重新加载的时候覆盖掉缺了 chunk 的数据
+        with self.assertNumQueries(0):
+            user_id_set = FriendshipService.get_following_user_id_set(self.linghu.id)
+        self.assertSetEqual(user_id_set, expected_ids | {self.dongxie.id})
+
+    def test_get_follower_id_chunks(self):
+        follower_ids = []
+        for i in range(5):
+            follower = self.create_user('follower{}'.format(i))
+            Friendship.objects.create(from_user=follower, to_user=self.linghu)
+            follower_ids.append(follower.id)
+        Friendship.objects.create(from_user=self.linghu, to_user=self.dongxie)
+
+        chunks = list(FriendshipService.get_follower_id_chunks(self.linghu.id, 2))
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 2, 1])
+        self.assertEqual(sum(chunks, []), follower_ids)
+
+        chunks = list(FriendshipService.get_follower_id_chunks(self.linghu.id, 5))
+        self.assertEqual(chunks, [follower_ids])
+
+        chunks = list(FriendshipService.get_follower_id_chunks(self.dongxie.id))
+        self.assertEqual(chunks, [[self.linghu.id]])
+        chunks = list(FriendshipService.get_follower_id_chunks(self.create_user('x').id))
+        self.assertEqual(chunks, [])
+
+    def test_friendship_counts(self):
+        user1 = self.create_user('user1')
+        Friendship.objects.create(from_user=self.linghu, to_user=self.dongxie)
+        Friendship.objects.create(from_user=user1, to_user=self.dongxie)
+        Friendship.objects.create(from_user=self.dongxie, to_user=self.linghu)
+
+        profile = UserService.get_profile_through_cache(self.dongxie.id)
+        self.assertEqual(profile.followers_count, 2)
+        self.assertEqual(profile.followings_count, 1)
+        profile = UserService.get_profile_through_cache(self.linghu.id)
+        self.assertEqual(profile.followers_count, 1)
+        self.assertEqual(profile.followings_count, 1)
+
+        Friendship.objects.filter(from_user=user1, to_user=self.dongxie).delete()
+        profile = UserService.get_profile_through_cache(self.dongxie.id)
+        self.assertEqual(profile.followers_count, 1)
+        profile = UserService.get_profile_through_cache(user1.id)
+        self.assertEqual(profile.followings_count, 0)
+        self.assertEqual(
+            UserProfile.objects.get(user_id=self.dongxie.id).followers_count,
+            1,
+        )
+
+        # 粉丝数直接从 profile 里读，不会 COUNT friendship 表
+        with self.assertNumQueries(0):
+            counts = FriendshipService.get_follower_counts([
+                self.linghu.id,
+                self.dongxie.id,
+            ])
+        self.assertEqual(counts, {self.linghu.id: 1, self.dongxie.id: 1})
+
+    @override_settings(CACHED_LIST_LENGTH_LIMIT=3)
+    def test_cached_friendship_lists(self):
+        users = [self.create_user('user{}'.format(i)) for i in range(4)]
+        friendships = [
+            Friendship.objects.create(from_user=user, to_user=self.linghu)
+            for user in users[:3]
+        ]
+        Friendship.objects.create(from_user=self.linghu, to_user=self.dongxie)
+
+        followers = FriendshipService.get_cached_followers(self.linghu.id)
+        self.assertEqual(
+            [f.from_user_id for f in followers],
+            [user.id for user in users[2::-1]],
+        )
+        followings = FriendshipService.get_cached_followings(self.linghu.id)
+        self.assertEqual([f.to_user_id for f in followings], [self.dongxie.id])
+
+        # 新的粉丝直接加到 cache 里，超过长度限制的旧数据被挤掉
+        Friendship.objects.create(from_user=users[3], to_user=self.linghu)
+        with self.assertNumQueries(0):
+            followers = FriendshipService.get_cached_followers(self.linghu.id)
+        self.assertEqual(
+            [f.from_user_id for f in followers],
+            [users[3].id, users[2].id, users[1].id],
+        )
+
+        # 满了的 list 删掉一条之后需要重新加载，才能把更早的粉丝补上
+        friendships[2].delete()
+        with self.assertNumQueries(1):
+            followers = FriendshipService.get_cached_followers(self.linghu.id)
+        self.assertEqual(
+            [f.from_user_id for f in followers],
+            [users[3].id, users[1].id, users[0].id],
+        )
+
+        # 没有满的 list 直接在 cache 里删掉
+        Friendship.objects.filter(from_user=self.linghu).delete()
+        with self.assertNumQueries(0):
+            followings = FriendshipService.get_cached_followings(self.linghu.id)
+        self.assertEqual(followings, [])
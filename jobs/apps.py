@@ -0,0 +1,11 @@
+from django.apps import AppConfig
+from django.utils.module_loading import autodiscover_modules
+
+
+class JobsConfig(AppConfig):
+    name = 'jobs'
+
+    def ready(self):
+        # 每个 app 的 tasks.py 里通过 @JobService.register 注册 job handler
+        # worker 进程启动的时候需要把它们都 import 进来
+        autodiscover_modules('tasks')
@@ -0,0 +1,22 @@
+class JobStatus:
+    PENDING = 0
+    RUNNING = 1
+    SUCCEEDED = 2
+    FAILED = 3
+
+
+JOB_STATUS_CHOICES = (
+    (JobStatus.PENDING, 'Pending'),
+    (JobStatus.RUNNING, 'Running'),
+    (JobStatus.SUCCEEDED, 'Succeeded'),
+    (JobStatus.FAILED, 'Failed'),
+)
+
+
+JOB_DEFAULT_MAX_ATTEMPTS = 3
+# 第 n 次重试之前等待 JOB_RETRY_BACKOFF_SECONDS * 2 ^ (n - 1) 秒
+JOB_RETRY_BACKOFF_SECONDS = 10
+# RUNNING 的 job 超过这么久没有更新，说明执行它的 worker 已经挂掉了，会被放回队列
+JOB_RUNNING_TIMEOUT_SECONDS = 600
+# worker 在轮询的时候检查挂掉的 job 的间隔，所有的 worker 加起来每个间隔只检查一次
+JOB_REQUEUE_STALE_INTERVAL_SECONDS = 60
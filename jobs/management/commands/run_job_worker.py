@@ -0,0 +1,65 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from jobs.services import JobService
+
+
+class Command(BaseCommand):
+    help = 'Run workers that execute the jobs queued through JobService'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='number of worker threads in this process',
+        )
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=1.0,
+            help='seconds to wait before polling again when the queue is empty',
+        )
+        parser.add_argument(
+            '--burst',
+            action='store_true',
+            help='exit once the queue is empty instead of polling forever',
+        )
+
+    def handle(self, *args, **options):
+        threads = [
+            threading.Thread(
+                target=self.work,
+                args=(options['sleep'], options['burst']),
+                daemon=True,
+            )
+            for _ in range(options['workers'])
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                thread.join()
+        except KeyboardInterrupt:
+            self.stdout.write('worker stopped')
+
+    def work(self, sleep, burst):
+        # 每个线程会有自己的数据库连接，退出的时候关掉
+        try:
+            while True:
+                # 不用等到 worker 重启，轮询的时候就会把挂掉的 worker 留下的 job 放回队列
+                requeued = JobService.requeue_stale_jobs_periodically()
+                if requeued:
+                    self.stdout.write('requeued {} stale jobs'.format(requeued))
+                executed = JobService.run_pending_jobs()
+                if executed:
+                    self.stdout.write('executed {} jobs'.format(executed))
+                    continue
+                if burst:
+                    break
+                time.sleep(sleep)
+        finally:
+            connection.close()
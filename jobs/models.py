@@ -0,0 +1,34 @@
+import json
+
+from django.db import models
+
+from jobs.constants import JobStatus, JOB_STATUS_CHOICES
+
+
+class Job(models.Model):
+    # handler 的名字，也就是 @JobService.register 时候用的名字
+    name = models.CharField(max_length=255)
+    # handler 的 kwargs, 以 json 的格式存储
+    payload = models.TextField(default='{}')
+    status = models.IntegerField(
+        default=JobStatus.PENDING,
+        choices=JOB_STATUS_CHOICES,
+    )
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=1)
+    last_error = models.TextField(null=True)
+    # job 不会在 run_after 之前被 worker 拿到，重试的时候用它来实现 backoff
+    run_after = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        # worker 按照 run_after 的顺序拿 pending 的 job
+        index_together = (('status', 'run_after'),)
+
+    def __str__(self):
+        return '{} {} [{}]'.format(self.id, self.name, self.get_status_display())
+
+    @property
+    def kwargs(self):
+        return json.loads(self.payload)
@@ -0,0 +1,137 @@
+import json
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import F
+
+from jobs.constants import (
+    JobStatus,
+    JOB_DEFAULT_MAX_ATTEMPTS,
+    JOB_REQUEUE_STALE_INTERVAL_SECONDS,
+    JOB_RETRY_BACKOFF_SECONDS,
+    JOB_RUNNING_TIMEOUT_SECONDS,
+)
+from jobs.models import Job
+from twitter.cache import JOB_REQUEUE_STALE_KEY
+from utils.time_helpers import utc_now
+
+cache = caches['testing'] if settings.TESTING else caches['default']
+
+
+class JobService(object):
+    # name -> (handler, max_attempts)
+    handlers = {}
+
+    @classmethod
+    def register(cls, name, max_attempts=JOB_DEFAULT_MAX_ATTEMPTS):
+        """
+        把一个函数注册成 job handler, 注册之后可以通过 func.delay(**kwargs)
+        把它放到队列里异步执行。kwargs 需要可以被 json 序列化。
+        """
+        def decorator(func):
+            cls.handlers[name] = (func, max_attempts)
+
+            def delay(countdown=0, **kwargs):
+                return cls.enqueue(name, countdown=countdown, **kwargs)
+
+            func.job_name = name
+            func.delay = delay
+            return func
+        return decorator
+
+    @classmethod
+    def enqueue(cls, name, countdown=0, **kwargs):
+        if name not in cls.handlers:
+            raise KeyError('job handler {} is not registered'.format(name))
+        handler, max_attempts = cls.handlers[name]
+
+        # 单元测试里直接同步执行，这样测试不需要启动 worker
+        if settings.JOB_QUEUE_ALWAYS_EAGER:
+            handler(**kwargs)
+            return None
+
+        # job 和业务数据写在同一个事务里，事务提交之后 worker 才能看到这个 job
+        return Job.objects.create(
+            name=name,
+            payload=json.dumps(kwargs),
+            max_attempts=max_attempts,
+            run_after=utc_now() + timedelta(seconds=countdown),
+        )
+
+    @classmethod
+    def claim_next_job(cls):
+        candidates = Job.objects.filter(
+            status=JobStatus.PENDING,
+            run_after__lte=utc_now(),
+        ).order_by('run_after').values_list('id', flat=True)[:10]
+        for job_id in candidates:
+            # 用带条件的 update 来抢占 job，多个 worker 同时抢的时候只有一个能成功
+            claimed = Job.objects.filter(
+                id=job_id,
+                status=JobStatus.PENDING,
+            ).update(
+                status=JobStatus.RUNNING,
+                attempts=F('attempts') + 1,
+                updated_at=utc_now(),
+            )
+            if claimed:
+                return Job.objects.get(id=job_id)
+        return None
+
+    @classmethod
+    def execute(cls, job):
+        if job.name not in cls.handlers:
+            cls._mark_failed(job, 'job handler {} is not registered'.format(job.name))
+            return False
+        handler, _ = cls.handlers[job.name]
+
+        try:
+            handler(**job.kwargs)
+        except Exception:
+            cls._mark_failed(job, traceback.format_exc())
+            return False
+
+        job.status = JobStatus.SUCCEEDED
+        job.last_error = None
+        job.save()
+        return True
+
+    @classmethod
+    def _mark_failed(cls, job, error):
+        job.last_error = error
+        if job.attempts >= job.max_attempts:
+            job.status = JobStatus.FAILED
+        else:
+            # exponential backoff
+            backoff = JOB_RETRY_BACKOFF_SECONDS * 2 ** (job.attempts - 1)
+            job.status = JobStatus.PENDING
+            job.run_after = utc_now() + timedelta(seconds=backoff)
+        job.save()
+
+    @classmethod
+    def requeue_stale_jobs(cls):
+        # worker 在执行过程中挂掉的话，job 会一直停留在 RUNNING 的状态
+        return Job.objects.filter(
+            status=JobStatus.RUNNING,
+            updated_at__lt=utc_now() - timedelta(seconds=JOB_RUNNING_TIMEOUT_SECONDS),
+        ).update(status=JobStatus.PENDING, run_after=utc_now())
+
+    @classmethod
+    def requeue_stale_jobs_periodically(cls):
+        # worker 每次轮询的时候调用，拿到 cache 里的锁的 worker 才去检查
+        if not cache.add(JOB_REQUEUE_STALE_KEY, 1, JOB_REQUEUE_STALE_INTERVAL_SECONDS):
+            return 0
+        return cls.requeue_stale_jobs()
+
+    @classmethod
+    def run_pending_jobs(cls, limit=None):
+        executed = 0
+        while limit is None or executed < limit:
+            job = cls.claim_next_job()
+            if job is None:
+                break
+            cls.execute(job)
+            executed += 1
+        return executed
@@ -0,0 +1,96 @@
+from datetime import timedelta
+
+from django.test import override_settings
+
+from jobs.constants import JobStatus
+from jobs.models import Job
+from jobs.services import JobService
+from testing.testcases import TestCase
+from utils.time_helpers import utc_now
+
+executed_kwargs = []
+
+
+@JobService.register('jobs.tests.record')
+def record_task(value):
+    executed_kwargs.append(value)
+
+
+@JobService.register('jobs.tests.broken', max_attempts=2)
+def broken_task():
+    raise ValueError('broken')
+
+
+@override_settings(JOB_QUEUE_ALWAYS_EAGER=False)
+class JobServiceTests(TestCase):
+
+    def setUp(self):
+        self.clear_cache()
+        executed_kwargs.clear()
+
+    def test_enqueue_and_run(self):
+        job = record_task.delay(value=1)
+        self.assertEqual(job.status, JobStatus.PENDING)
+        self.assertEqual(executed_kwargs, [])
+
+        # job 在 countdown 之前不会被执行
+        record_task.delay(countdown=60, value=2)
+        self.assertEqual(JobService.run_pending_jobs(), 1)
+        self.assertEqual(executed_kwargs, [1])
+        job.refresh_from_db()
+        self.assertEqual(job.status, JobStatus.SUCCEEDED)
+        self.assertEqual(job.attempts, 1)
+        self.assertEqual(JobService.run_pending_jobs(), 0)
+
+    def test_retry_and_fail(self):
+        job = broken_task.delay()
+        JobService.run_pending_jobs()
+        job.refresh_from_db()
+        self.assertEqual(job.status, JobStatus.PENDING)
+        self.assertEqual(job.attempts, 1)
+        self.assertEqual('broken' in job.last_error, True)
+        self.assertEqual(job.run_after > utc_now(), True)
+
+        # backoff 结束之后再执行一次，超过 max_attempts 就标记为失败
+        Job.objects.filter(id=job.id).update(run_after=utc_now())
+        JobService.run_pending_jobs()
+        job.refresh_from_db()
+        self.assertEqual(job.status, JobStatus.FAILED)
+        self.assertEqual(job.attempts, 2)
+        self.assertEqual(JobService.run_pending_jobs(), 0)
+
+    def test_claim_is_exclusive(self):
+        record_task.delay(value=1)
+        job = JobService.claim_next_job()
+        self.assertEqual(job.status, JobStatus.RUNNING)
+        self.assertEqual(JobService.claim_next_job(), None)
+
+        # worker 挂掉之后 job 会被重新放回队列
+        Job.objects.filter(id=job.id).update(
+            updated_at=utc_now() - timedelta(days=1),
+        )
+        self.assertEqual(JobService.requeue_stale_jobs(), 1)
+        self.assertEqual(JobService.run_pending_jobs(), 1)
+        self.assertEqual(executed_kwargs, [1])
+
+    def test_requeue_stale_jobs_periodically(self):
+        stale_at = utc_now() - timedelta(days=1)
+        record_task.delay(value=1)
+        record_task.delay(value=2)
+        job = JobService.claim_next_job()
+        Job.objects.filter(id=job.id).update(updated_at=stale_at)
+        self.assertEqual(JobService.requeue_stale_jobs_periodically(), 1)
+
+        # 一个间隔里只检查一次
+        job = JobService.claim_next_job()
+        Job.objects.filter(id=job.id).update(updated_at=stale_at)
+        self.assertEqual(JobService.requeue_stale_jobs_periodically(), 0)
+        self.assertEqual(Job.objects.get(id=job.id).status, JobStatus.RUNNING)
+        self.clear_cache()
+        self.assertEqual(JobService.requeue_stale_jobs_periodically(), 1)
+
+    def test_eager(self):
+        with override_settings(JOB_QUEUE_ALWAYS_EAGER=True):
+            self.assertEqual(record_task.delay(value=3), None)
+        self.assertEqual(executed_kwargs, [3])
+        self.assertEqual(Job.objects.count(), 0)
@@ -5,7 +5,9 @@ from rest_framework.exceptions import ValidationError
 from accounts.api.serializers import UserSerializerForLike
 from comments.models import Comment
 from likes.models import Like
+from likes.services import LikeService
 from tweets.models import Tweet
+from utils.memcached_helper import MemcachedHelper
 
 
 class LikeSerializer(serializers.ModelSerializer):
@@ -16,13 +18,35 @@ class LikeSerializer(serializers.ModelSerializer):
         fields = ('user', 'created_at')
 
 
-class BaseLikeSerializerForCreateAndCancel(serializers.ModelSerializer):
-    content_type = serializers.ChoiceField(choices=['comment', 'tweet'])
-    object_id = serializers.IntegerField()
+class LikeSerializerWithTarget(serializers.ModelSerializer):
+    """
+    某个用户点过赞的 tweet 或者 comment，liker 都是同一个用户，所以不带 user
+    target 是 view 里批量加载并且序列化好的，通过 context['target_data_map'] 传进来
+    """
+    content_type = serializers.SerializerMethodField()
+    target = serializers.SerializerMethodField()
 
     class Meta:
         model = Like
-        fields = ('content_type', 'object_id')
+        fields = ('content_type', 'object_id', 'created_at', 'target')
+
+    def get_content_type(self, obj):
+        if obj.content_type_id is None:
+            return None
+        # get_for_id 有进程内的 cache，不会查询数据库
+        return ContentType.objects.get_for_id(obj.content_type_id).model
+
+    def get_target(self, obj):
+        # 已经被删掉的 tweet 或者 comment 是 None
+        return self.context['target_data_map'].get(obj.object_id)
+
+
+class LikeTargetSerializer(serializers.Serializer):
+    """
+    通过 content_type 和 object_id 找到点赞的 tweet 或者 comment，放在 data['target'] 里
+    """
+    content_type = serializers.ChoiceField(choices=['comment', 'tweet'])
+    object_id = serializers.IntegerField()
 
     def _get_model_class(self, data):
         if data['content_type'] == 'comment':
@@ -35,29 +59,44 @@ class BaseLikeSerializerForCreateAndCancel(serializers.ModelSerializer):
         model_class = self._get_model_class(data)
         if model_class is None:
             raise ValidationError({'content_type': 'Content type does not exist'})
-        liked_object = model_class.objects.filter(id=data['object_id']).first()
-        if liked_object is None:
+        # 通过 cache 检查 object 是否存在，不需要查询数据库
+        target = MemcachedHelper.get_object_through_cache(
+            model_class,
+            data['object_id'],
+        )
+        if target is None:
             raise ValidationError({'object_id': 'Object does not exist'})
+        data['target'] = target
         return data
 
 
-class LikeSerializerForCreate(BaseLikeSerializerForCreateAndCancel):
+class LikeSerializerForCreate(LikeTargetSerializer):
     def get_or_create(self):
-        validated_data = self.validated_data
-        model_class = self._get_model_class(validated_data)
-        return Like.objects.get_or_create(
-            content_type=ContentType.objects.get_for_model(model_class),
-            object_id=validated_data['object_id'],
-            user=self.context['request'].user,
+        # 返回 (like, created)
+        return LikeService.like(
+            self.context['request'].user,
+            self.validated_data['target'],
         )
 
 
-class LikeSerializerForCancel(BaseLikeSerializerForCreateAndCancel):
+class LikeSerializerForCancel(LikeTargetSerializer):
     def cancel(self):
-        model_class = self._get_model_class(self.validated_data)
-        deleted, _ = Like.objects.filter(
-            content_type=ContentType.objects.get_for_model(model_class),
-            object_id=self.validated_data['object_id'],
-            user=self.context['request'].user,
-        ).delete()
-        return deleted
+        # 返回删掉的 like 的个数
+        return LikeService.unlike(
+            self.context['request'].user,
+            self.validated_data['target'],
+        )
+
+
+class LikeSerializerForLikers(LikeTargetSerializer):
+    pass
+
+
+class LikeSerializerForUserLikes(serializers.Serializer):
+    user_id = serializers.IntegerField()
+    content_type = serializers.ChoiceField(choices=['comment', 'tweet'])
+
+    def validate(self, data):
+        model_class = Comment if data['content_type'] == 'comment' else Tweet
+        data['content_type'] = ContentType.objects.get_for_model(model_class)
+        return data
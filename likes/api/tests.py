@@ -1,8 +1,15 @@
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+
 from testing.testcases import TestCase
+from utils.paginations import EndlessPagination
 
 
 LIKE_BASE_URL = '/api/likes/'
 LIKE_CANCEL_URL = '/api/likes/cancel/'
+LIKERS_URL = '/api/likes/likers/'
+USER_LIKES_URL = '/api/likes/by_user/'
 COMMENT_LIST_API = '/api/comments/'
 TWEET_LIST_API = '/api/tweets/'
 TWEET_DETAIL_API = '/api/tweets/{}/'
@@ -217,4 +224,165 @@ class LikeApiTests(TestCase):
         response = self.dongxie_client.get(url)
         self.assertEqual(len(response.data['likes']), 2)
         self.assertEqual(response.data['likes'][0]['user']['id'], self.linghu.id)
-        self.assertEqual(response.data['likes'][1]['user']['id'], self.dongxie.id)
\ No newline at end of file
+        self.assertEqual(response.data['likes'][1]['user']['id'], self.dongxie.id)
+
+    def _list_all(self, url, params):
+        results, page_params = [], dict(params)
+        while True:
+            response = self.anonymous_client.get(url, page_params)
+            self.assertEqual(response.status_code, 200)
+            results += response.data['results']
+            if not response.data['has_next_page']:
+                return results
+            page_params = dict(params, cursor=response.data['next_cursor'])
+
+    @override_settings(CACHED_LIST_LENGTH_LIMIT=5)
+    def test_likers(self):
+        tweet = self.create_tweet(self.linghu)
+        params = {'content_type': 'tweet', 'object_id': tweet.id}
+        # 参数不全或者 object 不存在
+        response = self.anonymous_client.get(LIKERS_URL, {'content_type': 'tweet'})
+        self.assertEqual(response.status_code, 400)
+        response = self.anonymous_client.get(LIKERS_URL, {
+            'content_type': 'tweet',
+            'object_id': -1,
+        })
+        self.assertEqual(response.status_code, 400)
+
+        response = self.anonymous_client.get(LIKERS_URL, params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'], [])
+        self.assertEqual(response.data['has_next_page'], False)
+
+        users = [
+            self.create_user('liker{}'.format(i))
+            for i in range(EndlessPagination.page_size + 3)
+        ]
+        for user in users:
+            self.create_like(user, tweet)
+        # 别的 object 的 like 不会出现
+        self.create_like(self.dongxie, self.create_tweet(self.linghu))
+
+        # cache 里只有最新的 5 个 like，之后的页从数据库里读
+        results = self._list_all(LIKERS_URL, params)
+        self.assertEqual(
+            [like['user']['username'] for like in results],
+            [user.username for user in users[::-1]],
+        )
+
+        # tweet 详情里的 likes_cursor 可以接着往下翻，cache 里只有 5 个所以只预览了 5 个
+        response = self.anonymous_client.get(TWEET_DETAIL_API.format(tweet.id))
+        self.assertEqual(len(response.data['likes']), 5)
+        response = self.anonymous_client.get(LIKERS_URL, dict(
+            params,
+            cursor=response.data['likes_cursor'],
+        ))
+        self.assertEqual(
+            [like['user']['username'] for like in response.data['results']],
+            [user.username for user in users[-6::-1]],
+        )
+
+        comment = self.create_comment(self.linghu, tweet)
+        self.create_like(self.dongxie, comment)
+        results = self._list_all(LIKERS_URL, {
+            'content_type': 'comment',
+            'object_id': comment.id,
+        })
+        self.assertEqual(
+            [like['user']['username'] for like in results],
+            ['dongxie'],
+        )
+
+    def test_likers_from_cache(self):
+        tweet = self.create_tweet(self.linghu)
+        params = {'content_type': 'tweet', 'object_id': tweet.id}
+        self.create_like(self.linghu, tweet)
+        self.create_like(self.dongxie, tweet)
+        self.anonymous_client.get(LIKERS_URL, params)
+        # tweet，like 列表，user 和 profile 都在 cache 里，不需要查询数据库
+        with self.assertNumQueries(0):
+            response = self.anonymous_client.get(LIKERS_URL, params)
+        self.assertEqual(
+            [like['user']['username'] for like in response.data['results']],
+            ['dongxie', 'linghu'],
+        )
+
+        # 取消点赞之后马上就能看到
+        self.dongxie_client.post(LIKE_CANCEL_URL, params)
+        response = self.anonymous_client.get(LIKERS_URL, params)
+        self.assertEqual(
+            [like['user']['username'] for like in response.data['results']],
+            ['linghu'],
+        )
+
+    def test_likes_by_user(self):
+        response = self.anonymous_client.get(USER_LIKES_URL, {
+            'user_id': self.linghu.id,
+        })
+        self.assertEqual(response.status_code, 400)
+        response = self.anonymous_client.get(USER_LIKES_URL, {
+            'user_id': self.linghu.id,
+            'content_type': 'tweeet',
+        })
+        self.assertEqual(response.status_code, 400)
+
+        tweets = [
+            self.create_tweet(self.dongxie)
+            for _ in range(EndlessPagination.page_size + 2)
+        ]
+        for tweet in tweets:
+            self.create_like(self.linghu, tweet)
+        comment = self.create_comment(self.dongxie, tweets[0])
+        self.create_like(self.linghu, comment)
+        self.create_like(self.dongxie, tweets[0])
+
+        results = self._list_all(USER_LIKES_URL, {
+            'user_id': self.linghu.id,
+            'content_type': 'tweet',
+        })
+        self.assertEqual(
+            [like['object_id'] for like in results],
+            [tweet.id for tweet in tweets[::-1]],
+        )
+        self.assertEqual(results[0]['content_type'], 'tweet')
+        # 点赞的 tweet 直接带在结果里，客户端不需要再一个一个去取
+        self.assertEqual(
+            [like['target']['id'] for like in results],
+            [tweet.id for tweet in tweets[::-1]],
+        )
+        self.assertEqual(results[-1]['target']['user']['username'], 'dongxie')
+        self.assertEqual(results[-1]['target']['likes_count'], 2)
+        self.assertNotIn('user', results[0])
+
+        # 一页的 tweets 和它们的 user，profile 都是批量从 cache 里读的
+        params = {'user_id': self.linghu.id, 'content_type': 'tweet'}
+        self.anonymous_client.get(USER_LIKES_URL, params)
+        with CaptureQueriesContext(connection) as context:
+            response = self.anonymous_client.get(USER_LIKES_URL, params)
+        self.assertEqual(len(response.data['results']), EndlessPagination.page_size)
+        queried_tables = [
+            table
+            for table in ('tweets_tweet', 'auth_user', 'accounts_userprofile')
+            for query in context.captured_queries
+            if 'FROM "{}"'.format(table) in query['sql']
+        ]
+        self.assertEqual(queried_tables, [])
+
+        results = self._list_all(USER_LIKES_URL, {
+            'user_id': self.linghu.id,
+            'content_type': 'comment',
+        })
+        self.assertEqual([like['object_id'] for like in results], [comment.id])
+        self.assertEqual(results[0]['target']['id'], comment.id)
+        self.assertEqual(results[0]['target']['likes_count'], 1)
+
+        # 已经被删掉的 comment
+        comment_id = comment.id
+        comment.delete()
+        results = self._list_all(USER_LIKES_URL, {
+            'user_id': self.linghu.id,
+            'content_type': 'comment',
+        })
+        self.assertEqual([like['object_id'] for like in results], [comment_id])
+        self.assertEqual(results[0]['target'], None)
+
@@ -1,22 +1,37 @@
+from django.contrib.contenttypes.models import ContentType
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 
+from accounts.services import UserService
+from comments.api.serializers import CommentSerializer
+from comments.models import Comment
+from comments.services import CommentService
 from inbox.services import NotificationService
 from likes.api.serializers import (
     LikeSerializer,
     LikeSerializerForCancel,
     LikeSerializerForCreate,
+    LikeSerializerForLikers,
+    LikeSerializerForUserLikes,
+    LikeSerializerWithTarget,
 )
 from likes.models import Like
+from likes.services import LikeService
+from tweets.api.serializers import TweetSerializer
+from tweets.models import Tweet
+from tweets.services import TweetService
 from utils.decorators import required_params
+from utils.memcached_helper import MemcachedHelper
+from utils.paginations import EndlessPagination
 
 
 class LikeViewSet(viewsets.GenericViewSet):
     queryset = Like.objects.all()
     permission_classes = [IsAuthenticated]
     serializer_class = LikeSerializerForCreate
+    pagination_class = EndlessPagination
 
     @required_params(method='POST', params=['content_type', 'object_id'])
     def create(self, request, *args, **kwargs):
@@ -54,3 +69,81 @@ class LikeViewSet(viewsets.GenericViewSet):
             'success': True,
             'deleted': deleted,
         }, status=status.HTTP_200_OK)
+
+    @action(methods=['GET'], detail=False, permission_classes=[AllowAny])
+    @required_params(params=['content_type', 'object_id'])
+    def likers(self, request):
+        # 按照时间倒序列出给某个 tweet 或者 comment 点赞的用户
+        serializer = LikeSerializerForLikers(data=request.query_params)
+        if not serializer.is_valid():
+            return Response({
+                'message': 'Please check input',
+                'errors': serializer.errors,
+            }, status=status.HTTP_400_BAD_REQUEST)
+        target = serializer.validated_data['target']
+
+        # 大部分请求都在 cache 的范围之内，不需要查询 like 表
+        cached_likes = LikeService.get_cached_likes(target)
+        likes = self.paginator.slice_cached_list(cached_likes, request)
+        if likes is None:
+            # (content_type, object_id, created_at) 上的范围扫描
+            queryset = Like.objects.filter(
+                content_type=ContentType.objects.get_for_model(target.__class__),
+                object_id=target.id,
+            )
+            likes = self.paginator.slice_queryset(queryset, request)
+        page = self.paginate_queryset(likes)
+        UserService.hydrate_users(page)
+        serializer = LikeSerializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(methods=['GET'], detail=False, permission_classes=[AllowAny])
+    @required_params(params=['user_id', 'content_type'])
+    def by_user(self, request):
+        # 按照时间倒序列出某个用户点过赞的 tweets 或者 comments
+        serializer = LikeSerializerForUserLikes(data=request.query_params)
+        if not serializer.is_valid():
+            return Response({
+                'message': 'Please check input',
+                'errors': serializer.errors,
+            }, status=status.HTTP_400_BAD_REQUEST)
+        content_type = serializer.validated_data['content_type']
+        # (user, content_type, created_at) 上的范围扫描
+        queryset = Like.objects.filter(
+            user_id=serializer.validated_data['user_id'],
+            content_type=content_type,
+        )
+        page = self.paginate_queryset(queryset)
+        serializer = LikeSerializerWithTarget(page, many=True, context={
+            'request': request,
+            'target_data_map': self._get_target_data_map(
+                request,
+                content_type.model_class(),
+                [like.object_id for like in page],
+            ),
+        })
+        return self.get_paginated_response(serializer.data)
+
+    def _get_target_data_map(self, request, model_class, object_ids):
+        """
+        一页点过赞的 tweets 或者 comments 用一次 multi-get 批量加载，
+        它们的 user，profile 和 likes_count 也都是批量加载的
+        返回 {object_id: 序列化之后的 tweet 或者 comment}
+        """
+        if model_class == Tweet:
+            targets = MemcachedHelper.get_objects_through_cache(Tweet, object_ids)
+            TweetService.hydrate_tweets(targets)
+            serializer_class, liked_ids_key = TweetSerializer, 'liked_tweet_ids'
+        else:
+            targets = CommentService.hydrate_comments([
+                Comment(id=object_id) for object_id in object_ids
+            ])
+            serializer_class, liked_ids_key = CommentSerializer, 'liked_comment_ids'
+        context = {
+            'request': request,
+            liked_ids_key: LikeService.get_liked_object_ids(request.user, targets),
+        }
+        return {
+            target.id: serializer_class(target, context=context).data
+            for target in targets
+        }
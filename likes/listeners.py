@@ -0,0 +1,27 @@
+def incr_likes_count(sender, instance, created, **kwargs):
+    if not created:
+        return
+    _update_likes_count(instance, 1)
+
+
+def decr_likes_count(sender, instance, **kwargs):
+    _update_likes_count(instance, -1)
+
+
+def _update_likes_count(like, delta):
+    # import 写在函数里面避免循环依赖
+    from likes.services import LikeService
+    # 只修改 cache 里的计数器，数据库里的 likes_count 由 flush job 批量更新
+    LikeService.update_likes_count(like, delta)
+
+
+def push_like_to_cache(sender, instance, created, **kwargs):
+    if not created:
+        return
+    from likes.services import LikeService
+    LikeService.push_like_to_cache(instance)
+
+
+def remove_like_from_cache(sender, instance, **kwargs):
+    from likes.services import LikeService
+    LikeService.remove_like_from_cache(instance)
@@ -2,8 +2,15 @@ from django.contrib.auth.models import User
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 from django.db import models
+from django.db.models.signals import post_save, pre_delete
 
 from accounts.services import UserService
+from likes.listeners import (
+    decr_likes_count,
+    incr_likes_count,
+    push_like_to_cache,
+    remove_like_from_cache,
+)
 from utils.memcached_helper import MemcachedHelper
 
 
@@ -37,4 +44,14 @@ class Like(models.Model):
 
     @property
     def cached_user(self):
-        return MemcachedHelper.get_object_through_cache(User, self.user_id)
\ No newline at end of file
+        # 翻页的时候 UserService.hydrate_users 会批量预先加载好
+        if hasattr(self, '_cached_user'):
+            return self._cached_user
+        return MemcachedHelper.get_object_through_cache(User, self.user_id)
+
+
+post_save.connect(incr_likes_count, sender=Like)
+pre_delete.connect(decr_likes_count, sender=Like)
+# hook up with listeners to update cache
+post_save.connect(push_like_to_cache, sender=Like)
+pre_delete.connect(remove_like_from_cache, sender=Like)
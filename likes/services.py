@@ -1,5 +1,23 @@
-from likes.models import Like
+from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
+from django.core.cache import caches
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from likes.models import Like
+from likes.tasks import flush_likes_count_task
+from twitter.cache import (
+    LIKES_COUNT_DECR_PATTERN,
+    LIKES_COUNT_FLUSH_PATTERN,
+    LIKES_COUNT_INCR_PATTERN,
+    LIKES_COUNT_PATTERN,
+    OBJECT_LIKES_PATTERN,
+)
+from utils.memcached_helper import MemcachedHelper
+
+cache = caches['testing'] if settings.TESTING else caches['default']
+
+LIKES_COUNT_PENDING_RETRIES = 3
 
 
 class LikeService(object):
@@ -12,4 +30,299 @@ class LikeService(object):
             content_type=ContentType.objects.get_for_model(target.__class__),
             object_id=target.id,
             user=user,
-        ).exists()
\ No newline at end of file
+        ).exists()
+
+    @classmethod
+    def get_liked_object_ids(cls, user, targets):
+        """
+        批量版本的 has_liked，targets 是同一种 model 的 objects
+        一次 object_id__in 的查询返回 user 点过赞的 object id 的集合
+        """
+        if user.is_anonymous or not targets:
+            return set()
+        liked_object_ids = Like.objects.filter(
+            content_type=ContentType.objects.get_for_model(targets[0].__class__),
+            object_id__in=[target.id for target in targets],
+            user=user,
+        ).values_list('object_id', flat=True)
+        return set(liked_object_ids)
+
+    @classmethod
+    def like(cls, user, target):
+        """
+        返回 (like, created)。不先查询有没有点过赞，直接 INSERT，
+        违反 (user, content_type, object_id) 的 unique 约束说明已经点过赞了，再读出已有的 like
+        正常情况下只有一条 INSERT，并发的重复点赞也不会报错
+        INSERT 放在 savepoint 里，IntegrityError 不会破坏外面的事务
+        """
+        lookup = {
+            'content_type': ContentType.objects.get_for_model(target.__class__),
+            'object_id': target.id,
+            'user': user,
+        }
+        for retry in range(2):
+            try:
+                with transaction.atomic():
+                    like = Like.objects.create(**lookup)
+                return like, True
+            except IntegrityError:
+                like = Like.objects.filter(**lookup).first()
+                if like is not None:
+                    return like, False
+                # 冲突的 like 在 INSERT 之后被并发的 unlike 删掉了，再 INSERT 一次
+                # 还是读不到的话不是重复点赞引起的，抛出原来的 IntegrityError
+                if retry:
+                    raise
+
+    @classmethod
+    def unlike(cls, user, target):
+        """
+        返回删掉的 like 的个数 (0 或者 1)
+        select_for_update 锁住这一行，并发的 unlike 只有一个能读到它，
+        pre_delete 的 listener (计数器等) 只会执行一次
+        """
+        with transaction.atomic():
+            like = Like.objects.select_for_update().filter(
+                content_type=ContentType.objects.get_for_model(target.__class__),
+                object_id=target.id,
+                user=user,
+            ).first()
+            if like is None:
+                return 0
+            like.delete()
+        return 1
+
+    @classmethod
+    def _get_likes_key(cls, content_type, object_id):
+        return OBJECT_LIKES_PATTERN.format(
+            content_type=content_type.model,
+            object_id=object_id,
+        )
+
+    @classmethod
+    def get_cached_likes(cls, target):
+        """
+        cache 里存的是 target 最新的 CACHED_LIST_LENGTH_LIMIT 个 like 的
+        (id, user_id, created_at)，按照 (created_at, id) 倒序排列
+        返回没有保存的 Like 对象，不需要查询数据库
+        """
+        content_type = ContentType.objects.get_for_model(target.__class__)
+        entries = MemcachedHelper.get_through_cache(
+            cls._get_likes_key(content_type, target.id),
+            lambda: list(
+                Like.objects.filter(content_type=content_type, object_id=target.id)
+                .order_by('-created_at', '-id')
+                .values_list('id', 'user_id', 'created_at')
+                [:settings.CACHED_LIST_LENGTH_LIMIT]
+            ),
+        )
+        return [
+            Like(
+                id=like_id,
+                content_type=content_type,
+                object_id=target.id,
+                user_id=user_id,
+                created_at=created_at,
+            )
+            for like_id, user_id, created_at in entries
+        ]
+
+    @classmethod
+    def push_like_to_cache(cls, like):
+        if like.content_type_id is None:
+            return
+        content_type = ContentType.objects.get_for_id(like.content_type_id)
+        MemcachedHelper.push_to_cached_list(
+            cls._get_likes_key(content_type, like.object_id),
+            (like.id, like.user_id, like.created_at),
+        )
+
+    @classmethod
+    def remove_like_from_cache(cls, like):
+        if like.content_type_id is None:
+            return
+        content_type = ContentType.objects.get_for_id(like.content_type_id)
+        MemcachedHelper.remove_from_cached_list(
+            cls._get_likes_key(content_type, like.object_id),
+            like.id,
+        )
+
+    @classmethod
+    def _get_counter_key(cls, pattern, content_type, object_id):
+        return pattern.format(content_type=content_type.model, object_id=object_id)
+
+    @classmethod
+    def update_likes_count(cls, like, delta):
+        """
+        like 和 unlike 的时候调用。cache 里的计数器用 incr / decr 原子地加减，
+        同时把变化量累加到待写回的 key 里，并安排一个 flush job
+        memcached 的计数器不能小于 0，所以增加量和减少量分成两个 key 存储
+        """
+        if like.content_type_id is None:
+            return
+        content_type = ContentType.objects.get_for_id(like.content_type_id)
+        count_key = cls._get_counter_key(LIKES_COUNT_PATTERN, content_type, like.object_id)
+        try:
+            if delta > 0:
+                cache.incr(count_key, delta)
+            else:
+                cache.decr(count_key, -delta)
+        except ValueError:
+            # 计数器不在 cache 里的时候不需要处理，读的时候会从数据库里重建
+            pass
+
+        pending_pattern = LIKES_COUNT_INCR_PATTERN if delta > 0 else LIKES_COUNT_DECR_PATTERN
+        pending_key = cls._get_counter_key(pending_pattern, content_type, like.object_id)
+        cls._add_pending_likes_delta(pending_key, abs(delta))
+
+        # 同一个 object 同时只需要一个等待执行的 flush job
+        # flush_key 会过期，flush job 丢失了的话之后的 like 会重新安排
+        flush_key = cls._get_counter_key(LIKES_COUNT_FLUSH_PATTERN, content_type, like.object_id)
+        if cache.add(flush_key, 1, timeout=settings.LIKES_COUNT_FLUSH_KEY_TIMEOUT_SECONDS):
+            flush_likes_count_task.delay(
+                countdown=settings.LIKES_COUNT_FLUSH_INTERVAL_SECONDS,
+                content_type_id=content_type.id,
+                object_id=like.object_id,
+            )
+
+    @classmethod
+    def _add_pending_likes_delta(cls, pending_key, value):
+        # 还没有写回数据库的变化量不能过期
+        # add 和 incr 之间 key 可能被 evict 掉，incr 失败的时候重新 add
+        for _ in range(LIKES_COUNT_PENDING_RETRIES):
+            if cache.add(pending_key, value, timeout=None):
+                return
+            try:
+                cache.incr(pending_key, value)
+                return
+            except ValueError:
+                continue
+        # 一直失败的话只丢掉这一次的变化量，不让 like 失败，
+        # 数据库里的 likes_count 之后由 reconcile_counters 修正
+
+    @classmethod
+    def flush_likes_count(cls, content_type_id, object_id):
+        """
+        把一段时间里累计的变化量用一次 update 写回数据库
+        """
+        content_type = ContentType.objects.get_for_id(content_type_id)
+        model_class = content_type.model_class()
+        flush_key = cls._get_counter_key(LIKES_COUNT_FLUSH_PATTERN, content_type, object_id)
+        # flush_key 过期之后重新安排的 job 可能和原来的 job 同时执行，
+        # 同一个变化量不能写回两次。拿到锁的 job 会写回所有的变化量，其他的直接跳过
+        lock_key = MemcachedHelper.get_lock_key(flush_key)
+        if not cache.add(lock_key, 1, settings.CACHE_LOCK_TIMEOUT_SECONDS):
+            return
+        try:
+            cls._flush_likes_count(content_type, model_class, flush_key, object_id)
+        finally:
+            cache.delete(lock_key)
+
+    @classmethod
+    def _flush_likes_count(cls, content_type, model_class, flush_key, object_id):
+        # 先删掉 flush_key，在这之后的 like 会安排下一次 flush
+        cache.delete(flush_key)
+
+        pending = {}
+        for pattern in (LIKES_COUNT_INCR_PATTERN, LIKES_COUNT_DECR_PATTERN):
+            key = cls._get_counter_key(pattern, content_type, object_id)
+            pending[key] = cache.get(key) or 0
+        incr_key, decr_key = pending.keys()
+        delta = pending[incr_key] - pending[decr_key]
+
+        if delta:
+            with transaction.atomic():
+                model_class.objects.filter(id=object_id).update(
+                    likes_count=F('likes_count') + delta,
+                )
+            # update 不会触发 post_save，需要手动更新 cache
+            # 要在减掉变化量之前更新，否则这之间用 cache 里旧的 likes_count 重建的计数器会少算
+            MemcachedHelper.update_cached_object(model_class, object_id)
+        # 写回数据库之后再减掉这一次写回的量，flush 期间新的变化量留给下一次
+        for key, value in pending.items():
+            if value:
+                cache.decr(key, value)
+        if delta:
+            # 上面两步之间重建的计数器会多算这一次写回的量，删掉让它用最新的数据重建
+            cls.invalidate_likes_count(model_class, object_id)
+
+    @classmethod
+    def get_pending_likes_deltas(cls, model_class, object_ids):
+        """
+        返回 {object_id: 还没有写回数据库的变化量}，没有变化量的 object 不在返回结果里
+        """
+        content_type = ContentType.objects.get_for_model(model_class)
+        keys = {
+            object_id: [
+                cls._get_counter_key(pattern, content_type, object_id)
+                for pattern in (LIKES_COUNT_INCR_PATTERN, LIKES_COUNT_DECR_PATTERN)
+            ]
+            for object_id in object_ids
+        }
+        values = cache.get_many([key for object_keys in keys.values() for key in object_keys])
+        deltas = {}
+        for object_id, (incr_key, decr_key) in keys.items():
+            delta = values.get(incr_key, 0) - values.get(decr_key, 0)
+            if delta:
+                deltas[object_id] = delta
+        return deltas
+
+    @classmethod
+    def get_cached_likes_counts(cls, model_class, object_ids):
+        # 返回 {object_id: cache 里的计数器}，cache 里没有的 object 不在返回结果里
+        content_type = ContentType.objects.get_for_model(model_class)
+        keys = {
+            cls._get_counter_key(LIKES_COUNT_PATTERN, content_type, object_id): object_id
+            for object_id in object_ids
+        }
+        return {
+            keys[key]: count
+            for key, count in cache.get_many(keys.keys()).items()
+        }
+
+    @classmethod
+    def invalidate_likes_count(cls, model_class, object_id):
+        # 删掉 cache 里的计数器，下次读的时候用数据库里的值加上变化量重建
+        content_type = ContentType.objects.get_for_model(model_class)
+        cache.delete(cls._get_counter_key(LIKES_COUNT_PATTERN, content_type, object_id))
+
+    @classmethod
+    def get_likes_count(cls, target):
+        # 列表页会通过 hydrate_likes_counts 预先批量加载好
+        if not hasattr(target, '_cached_likes_count'):
+            cls.hydrate_likes_counts([target])
+        return target._cached_likes_count
+
+    @classmethod
+    def hydrate_likes_counts(cls, targets):
+        """
+        targets 是同一种 model 的 objects，一次 get_many 读出所有的计数器
+        cache 里没有的计数器用数据库里的 likes_count 加上还没有写回的变化量重建，
+        不需要 COUNT likes 表
+        """
+        if not targets:
+            return targets
+        content_type = ContentType.objects.get_for_model(targets[0].__class__)
+        keys = {}
+        for target in targets:
+            keys[target.id] = [
+                cls._get_counter_key(pattern, content_type, target.id)
+                for pattern in (
+                    LIKES_COUNT_PATTERN,
+                    LIKES_COUNT_INCR_PATTERN,
+                    LIKES_COUNT_DECR_PATTERN,
+                )
+            ]
+        values = cache.get_many([key for target_keys in keys.values() for key in target_keys])
+        for target in targets:
+            count_key, incr_key, decr_key = keys[target.id]
+            count = values.get(count_key)
+            if count is None:
+                count = max(
+                    target.likes_count + values.get(incr_key, 0) - values.get(decr_key, 0),
+                    0,
+                )
+                # 用 add 而不是 set，不覆盖重建期间别的 worker 写进去的计数器
+                cache.add(count_key, count)
+            setattr(target, '_cached_likes_count', count)
+        return targets
@@ -0,0 +1,8 @@
+from jobs.services import JobService
+
+
+@JobService.register('likes.flush_likes_count')
+def flush_likes_count_task(content_type_id, object_id):
+    # import 写在函数里面避免循环依赖
+    from likes.services import LikeService
+    LikeService.flush_likes_count(content_type_id, object_id)
@@ -0,0 +1,318 @@
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import caches
+from django.db import IntegrityError, connection, transaction
+from django.test import override_settings, skipUnlessDBFeature
+from threading import Barrier, Thread
+from unittest import mock
+
+from jobs.models import Job
+from jobs.services import JobService
+from likes.models import Like
+from likes.services import LikeService
+from testing.testcases import TestCase, TransactionTestCase
+from tweets.models import Tweet
+from twitter.cache import (
+    LIKES_COUNT_FLUSH_PATTERN,
+    LIKES_COUNT_INCR_PATTERN,
+    LIKES_COUNT_PATTERN,
+)
+from utils.memcached_helper import MemcachedHelper
+from utils.time_helpers import utc_now
+
+
+class LikeServiceTests(TestCase):
+
+    def setUp(self):
+        self.clear_cache()
+        self.linghu = self.create_user('linghu')
+        self.dongxie = self.create_user('dongxie')
+        self.tweets = [self.create_tweet(self.linghu) for _ in range(3)]
+
+    def test_get_liked_object_ids(self):
+        self.create_like(self.dongxie, self.tweets[0])
+        self.create_like(self.dongxie, self.tweets[2])
+        self.create_like(self.linghu, self.tweets[1])
+        comment = self.create_comment(self.linghu, self.tweets[1])
+        self.create_like(self.dongxie, comment)
+
+        with self.assertNumQueries(1):
+            liked_ids = LikeService.get_liked_object_ids(self.dongxie, self.tweets)
+        self.assertEqual(liked_ids, {self.tweets[0].id, self.tweets[2].id})
+        self.assertEqual(
+            LikeService.get_liked_object_ids(self.linghu, self.tweets),
+            {self.tweets[1].id},
+        )
+        self.assertEqual(
+            LikeService.get_liked_object_ids(self.dongxie, [comment]),
+            {comment.id},
+        )
+        self.assertEqual(LikeService.get_liked_object_ids(self.dongxie, []), set())
+
+    @override_settings(JOB_QUEUE_ALWAYS_EAGER=False)
+    def test_write_behind_likes_count(self):
+        tweet = self.tweets[0]
+        users = [self.create_user('user{}'.format(i)) for i in range(3)]
+        self.assertEqual(LikeService.get_likes_count(tweet), 0)
+
+        likes = [self.create_like(user, tweet) for user in users]
+        likes[0].delete()
+        # 计数器马上就是最新的，数据库等 flush job 执行之后才更新
+        tweet = Tweet.objects.get(id=tweet.id)
+        self.assertEqual(tweet.likes_count, 0)
+        self.assertEqual(LikeService.get_likes_count(tweet), 2)
+        # 同一个 tweet 只有一个等待执行的 flush job
+        self.assertEqual(Job.objects.count(), 1)
+        self.assertEqual(JobService.run_pending_jobs(), 0)
+
+        Job.objects.update(run_after=utc_now())
+        self.assertEqual(JobService.run_pending_jobs(), 1)
+        tweet.refresh_from_db()
+        self.assertEqual(tweet.likes_count, 2)
+        self.assertEqual(LikeService.get_likes_count(tweet), 2)
+
+        # 计数器不在 cache 里的时候，用数据库里的值加上还没有写回的变化量重建
+        count_key = LikeService._get_counter_key(
+            LIKES_COUNT_PATTERN,
+            ContentType.objects.get_for_model(Tweet),
+            tweet.id,
+        )
+        caches['testing'].delete(count_key)
+        self.create_like(self.linghu, tweet)
+        tweets = [Tweet.objects.get(id=tweet.id), self.tweets[1]]
+        with self.assertNumQueries(0):
+            LikeService.hydrate_likes_counts(tweets)
+        self.assertEqual(
+            [LikeService.get_likes_count(tweet) for tweet in tweets],
+            [3, 0],
+        )
+        self.assertEqual(caches['testing'].get(count_key), 3)
+
+        Job.objects.update(run_after=utc_now())
+        JobService.run_pending_jobs()
+        tweet.refresh_from_db()
+        self.assertEqual(tweet.likes_count, 3)
+
+    @override_settings(JOB_QUEUE_ALWAYS_EAGER=False)
+    def test_flush_likes_count_refreshes_cached_object_first(self):
+        tweet = self.tweets[0]
+        MemcachedHelper.get_object_through_cache(Tweet, tweet.id)
+        self.create_like(self.dongxie, tweet)
+        self.create_like(self.linghu, tweet)
+
+        # 更新 cache 里的 tweet 的时候变化量还没有减掉，
+        # 这期间重建的计数器不会少算
+        pending_deltas = []
+        update_cached_object = MemcachedHelper.update_cached_object
+
+        def record_pending_deltas(model_class, object_id):
+            pending_deltas.append(
+                LikeService.get_pending_likes_deltas(model_class, [object_id]),
+            )
+            update_cached_object(model_class, object_id)
+
+        Job.objects.update(run_after=utc_now())
+        with mock.patch.object(
+            MemcachedHelper,
+            'update_cached_object',
+            side_effect=record_pending_deltas,
+        ):
+            JobService.run_pending_jobs()
+        self.assertEqual(pending_deltas, [{tweet.id: 2}])
+        self.assertEqual(LikeService.get_pending_likes_deltas(Tweet, [tweet.id]), {})
+
+        # 计数器用 cache 里最新的 tweet 重建
+        cached_tweet = MemcachedHelper.get_object_through_cache(Tweet, tweet.id)
+        self.assertEqual(cached_tweet.likes_count, 2)
+        self.assertEqual(LikeService.get_likes_count(cached_tweet), 2)
+
+    @override_settings(JOB_QUEUE_ALWAYS_EAGER=False)
+    def test_pending_likes_delta_evicted(self):
+        tweet = self.tweets[0]
+        pending_key = LikeService._get_counter_key(
+            LIKES_COUNT_INCR_PATTERN,
+            ContentType.objects.get_for_model(Tweet),
+            tweet.id,
+        )
+        testing_cache = caches['testing']
+        add = testing_cache.add
+        evicted = []
+
+        def add_then_evict(key, *args, **kwargs):
+            # 模拟 add 的时候 key 还在，incr 之前被 evict 掉了
+            if key == pending_key and not evicted:
+                evicted.append(key)
+                return False
+            return add(key, *args, **kwargs)
+
+        with mock.patch.object(testing_cache, 'add', side_effect=add_then_evict):
+            self.create_like(self.dongxie, tweet)
+        self.assertEqual(evicted, [pending_key])
+        self.assertEqual(LikeService.get_pending_likes_deltas(Tweet, [tweet.id]), {tweet.id: 1})
+
+    @override_settings(JOB_QUEUE_ALWAYS_EAGER=False)
+    def test_reschedule_lost_flush_job(self):
+        tweet = self.tweets[0]
+        content_type = ContentType.objects.get_for_model(Tweet)
+        flush_key = LikeService._get_counter_key(
+            LIKES_COUNT_FLUSH_PATTERN,
+            content_type,
+            tweet.id,
+        )
+        # flush_key 过期之后 (比如 flush job 丢失了) 的 like 会重新安排一个 flush job
+        with override_settings(LIKES_COUNT_FLUSH_KEY_TIMEOUT_SECONDS=0):
+            self.create_like(self.dongxie, tweet)
+        self.assertEqual(Job.objects.count(), 1)
+        self.create_like(self.linghu, tweet)
+        self.assertEqual(Job.objects.count(), 2)
+        self.assertEqual(caches['testing'].get(flush_key), 1)
+
+        # 别的 job 正在 flush 的时候直接跳过
+        lock_key = MemcachedHelper.get_lock_key(flush_key)
+        caches['testing'].add(lock_key, 1)
+        LikeService.flush_likes_count(content_type.id, tweet.id)
+        caches['testing'].delete(lock_key)
+        tweet.refresh_from_db()
+        self.assertEqual(tweet.likes_count, 0)
+
+        # 两个 job 都执行之后变化量只写回一次
+        Job.objects.update(run_after=utc_now())
+        self.assertEqual(JobService.run_pending_jobs(), 2)
+        tweet.refresh_from_db()
+        self.assertEqual(tweet.likes_count, 2)
+
+    @override_settings(JOB_QUEUE_ALWAYS_EAGER=False)
+    def test_like_and_unlike(self):
+        tweet = self.tweets[0]
+        like, created = LikeService.like(self.dongxie, tweet)
+        self.assertEqual(created, True)
+        self.assertEqual(LikeService.get_likes_count(tweet), 1)
+
+        # 正常的点赞只有一条 INSERT (加上 savepoint)，不需要先查询
+        with self.assertNumQueries(3):
+            _, created = LikeService.like(self.linghu, tweet)
+        self.assertEqual(created, True)
+
+        # 重复点赞返回已有的 like，计数器不变
+        duplicate, created = LikeService.like(self.dongxie, tweet)
+        self.assertEqual(created, False)
+        self.assertEqual(duplicate.id, like.id)
+        self.assertEqual(LikeService.get_likes_count(Tweet.objects.get(id=tweet.id)), 2)
+
+        self.assertEqual(LikeService.unlike(self.dongxie, tweet), 1)
+        self.assertEqual(LikeService.unlike(self.dongxie, tweet), 0)
+        self.assertEqual(LikeService.get_likes_count(Tweet.objects.get(id=tweet.id)), 1)
+        self.assertEqual(Like.objects.count(), 1)
+
+    def test_like_after_conflicting_unlike(self):
+        tweet = self.tweets[0]
+        create = Like.objects.create
+        attempts = []
+
+        def create_after_conflict(**kwargs):
+            # 冲突的 like 在 INSERT 之后被删掉了，再 INSERT 一次
+            attempts.append(kwargs)
+            if len(attempts) == 1:
+                raise IntegrityError
+            return create(**kwargs)
+
+        with mock.patch.object(Like.objects, 'create', side_effect=create_after_conflict):
+            like, created = LikeService.like(self.dongxie, tweet)
+        self.assertEqual(len(attempts), 2)
+        self.assertEqual(created, True)
+        self.assertEqual(like.user_id, self.dongxie.id)
+
+        # 一直读不到冲突的 like，说明不是重复点赞引起的，抛出 IntegrityError
+        with mock.patch.object(Like.objects, 'create', side_effect=IntegrityError):
+            with self.assertRaises(IntegrityError):
+                LikeService.like(self.linghu, tweet)
+        self.assertFalse(LikeService.has_liked(self.linghu, tweet))
+
+    def test_cached_likes_on_commit(self):
+        tweet = self.tweets[0]
+        self.create_like(self.dongxie, tweet)
+        self.assertEqual(len(LikeService.get_cached_likes(tweet)), 1)
+
+        # 事务回滚的话 cache 里的 likes 不会被修改
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                LikeService.like(self.linghu, tweet)
+                raise RuntimeError
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                LikeService.unlike(self.dongxie, tweet)
+                raise RuntimeError
+        with self.assertNumQueries(0):
+            likes = LikeService.get_cached_likes(tweet)
+        self.assertEqual([like.user_id for like in likes], [self.dongxie.id])
+
+        # 提交之后才修改
+        with transaction.atomic():
+            LikeService.like(self.linghu, tweet)
+            LikeService.unlike(self.dongxie, tweet)
+        with self.assertNumQueries(0):
+            likes = LikeService.get_cached_likes(tweet)
+        self.assertEqual([like.user_id for like in likes], [self.linghu.id])
+
+
+# 测试用的 sqlite 是内存数据库，多个连接同时写会直接报 database table is locked
+# 这组测试需要在 MySQL 这种支持多个连接的数据库上跑
+@skipUnlessDBFeature('test_db_allows_multiple_connections')
+class LikeServiceConcurrencyTests(TransactionTestCase):
+
+    def setUp(self):
+        self.clear_cache()
+        self.linghu = self.create_user('linghu')
+        self.tweet = self.create_tweet(self.linghu)
+
+    def _run_concurrently(self, func, count):
+        barrier = Barrier(count)
+        results, errors = [], []
+
+        def run():
+            try:
+                barrier.wait()
+                results.append(func())
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [Thread(target=run) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        return results
+
+    def test_concurrent_like(self):
+        # 同一个用户同时点赞，只有一个会真正创建，并且都不会报错
+        results = self._run_concurrently(
+            lambda: LikeService.like(self.linghu, self.tweet)[1],
+            5,
+        )
+        self.assertEqual(sorted(results), [False] * 4 + [True])
+        self.assertEqual(Like.objects.count(), 1)
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.likes_count, 1)
+        self.assertEqual(
+            LikeService.get_likes_count(Tweet.objects.get(id=self.tweet.id)),
+            1,
+        )
+
+    def test_concurrent_unlike(self):
+        LikeService.like(self.linghu, self.tweet)
+        # 同时取消点赞，只有一个会真正删除，计数器只减一次
+        results = self._run_concurrently(
+            lambda: LikeService.unlike(self.linghu, self.tweet),
+            5,
+        )
+        self.assertEqual(sorted(results), [0] * 4 + [1])
+        self.assertEqual(Like.objects.count(), 0)
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.likes_count, 0)
+        self.assertEqual(
+            LikeService.get_likes_count(Tweet.objects.get(id=self.tweet.id)),
+            0,
+        )
+
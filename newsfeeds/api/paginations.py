@@ -0,0 +1,9 @@
+from utils.paginations import EndlessPagination
+
+
+class NewsFeedPagination(EndlessPagination):
+    """
+    newsfeed 和大V的 tweet 合并在一起翻页，newsfeed 的 id 和 tweet 的 id 没法比较，
+    所以同一时刻的数据用 tweet_id 排序，大V的 tweet 用它自己的 id
+    """
+    tiebreak_field = 'tweet_id'
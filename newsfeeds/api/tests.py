@@ -1,6 +1,14 @@
+from datetime import timedelta
+
+from django.test import override_settings
 from rest_framework.test import APIClient
+
+from friendships.models import Friendship
+from newsfeeds.models import NewsFeed
 from testing.testcases import TestCase
+from tweets.models import Tweet
 from utils.paginations import EndlessPagination
+from utils.time_helpers import utc_now
 
 NEWSFEEDS_URL = '/api/newsfeeds/'
 POST_TWEETS_URL = '/api/tweets/'
@@ -146,4 +154,187 @@ class NewsFeedApiTests(TestCase):
         tweet.save()
         response = self.dongxie_client.get(NEWSFEEDS_URL)
         results = response.data['results']
-        self.assertEqual(results[0]['tweet']['content'], 'content2')
\ No newline at end of file
+        self.assertEqual(results[0]['tweet']['content'], 'content2')
+
+    @override_settings(NEWSFEED_PULL_FOLLOWERS_THRESHOLD=2)
+    def test_celebrity_tweets_are_merged(self):
+        page_size = EndlessPagination.page_size
+        celebrity = self.create_user('celebrity')
+        Friendship.objects.create(from_user=self.linghu, to_user=celebrity)
+        Friendship.objects.create(from_user=self.dongxie, to_user=celebrity)
+
+        # 一半是 fanout 过来的 newsfeed，一半是大V的 tweet，交替创建
+        expected_tweets = []
+        for i in range(page_size):
+            tweet = self.create_tweet(self.dongxie)
+            self.create_newsfeed(self.linghu, tweet)
+            expected_tweets.append(tweet)
+            expected_tweets.append(self.create_tweet(celebrity))
+        # 大V之前 fanout 过的 tweet 不会重复出现
+        self.create_newsfeed(self.linghu, expected_tweets[-1])
+        expected_tweets = expected_tweets[::-1]
+
+        response = self.linghu_client.get(NEWSFEEDS_URL)
+        self.assertEqual(response.data['has_next_page'], True)
+        results = response.data['results']
+        self.assertEqual(
+            [result['tweet']['id'] for result in results],
+            [tweet.id for tweet in expected_tweets[:page_size]],
+        )
+
+        response = self.linghu_client.get(NEWSFEEDS_URL, {
+            'created_at__lt': results[-1]['created_at'],
+        })
+        self.assertEqual(response.data['has_next_page'], False)
+        self.assertEqual(
+            [result['tweet']['id'] for result in response.data['results']],
+            [tweet.id for tweet in expected_tweets[page_size:]],
+        )
+
+        # pull latest newsfeeds
+        new_tweet = self.create_tweet(celebrity)
+        response = self.linghu_client.get(NEWSFEEDS_URL, {
+            'created_at__gt': results[0]['created_at'],
+        })
+        self.assertEqual(response.data['has_next_page'], False)
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['tweet']['id'], new_tweet.id)
+
+    @override_settings(NEWSFEED_PULL_FOLLOWERS_THRESHOLD=2)
+    def test_celebrity_tweets_with_same_created_at(self):
+        page_size = EndlessPagination.page_size
+        celebrity = self.create_user('celebrity')
+        Friendship.objects.create(from_user=self.linghu, to_user=celebrity)
+        Friendship.objects.create(from_user=self.dongxie, to_user=celebrity)
+        tweet_ids = set()
+        for i in range(page_size):
+            tweet = self.create_tweet(self.dongxie)
+            self.create_newsfeed(self.linghu, tweet)
+            tweet_ids.add(tweet.id)
+            tweet_ids.add(self.create_tweet(celebrity).id)
+
+        # 所有的数据都在同一时刻，只能靠 tiebreak 翻页，不同数据源的数据不能被跳过
+        created_at = utc_now()
+        Tweet.objects.update(created_at=created_at)
+        NewsFeed.objects.update(created_at=created_at)
+        self.clear_cache()
+
+        seen_tweet_ids = []
+        response = self.linghu_client.get(NEWSFEEDS_URL)
+        seen_tweet_ids += [r['tweet']['id'] for r in response.data['results']]
+        self.assertEqual(response.data['has_next_page'], True)
+        response = self.linghu_client.get(NEWSFEEDS_URL, {
+            'cursor': response.data['next_cursor'],
+        })
+        seen_tweet_ids += [r['tweet']['id'] for r in response.data['results']]
+        self.assertEqual(response.data['has_next_page'], False)
+        self.assertEqual(len(seen_tweet_ids), len(tweet_ids))
+        self.assertEqual(set(seen_tweet_ids), tweet_ids)
+        self.assertEqual(seen_tweet_ids, sorted(tweet_ids, reverse=True))
+
+
+    @override_settings(CACHED_LIST_LENGTH_LIMIT=25)
+    def test_pagination_beyond_cached_newsfeeds(self):
+        page_size = EndlessPagination.page_size
+        followed_user = self.create_user('followed')
+        newsfeeds = []
+        for i in range(page_size * 2):
+            tweet = self.create_tweet(followed_user)
+            newsfeeds.append(self.create_newsfeed(user=self.linghu, tweet=tweet))
+        newsfeeds = newsfeeds[::-1]
+
+        # 第一页在 cache 里
+        response = self.linghu_client.get(NEWSFEEDS_URL)
+        self.assertEqual(response.data['has_next_page'], True)
+        self.assertEqual(
+            [result['id'] for result in response.data['results']],
+            [newsfeed.id for newsfeed in newsfeeds[:page_size]],
+        )
+
+        # 第二页超出了 cache 的范围，从数据库里读
+        response = self.linghu_client.get(NEWSFEEDS_URL, {
+            'created_at__lt': newsfeeds[page_size - 1].created_at,
+        })
+        self.assertEqual(response.data['has_next_page'], False)
+        self.assertEqual(
+            [result['id'] for result in response.data['results']],
+            [newsfeed.id for newsfeed in newsfeeds[page_size:]],
+        )
+
+    @override_settings(CACHED_LIST_LENGTH_LIMIT=25)
+    def test_cursor_pagination(self):
+        page_size = EndlessPagination.page_size
+        followed_user = self.create_user('followed')
+        for i in range(page_size * 2 + 5):
+            tweet = self.create_tweet(followed_user)
+            self.create_newsfeed(user=self.linghu, tweet=tweet)
+        # fanout 批量插入的 newsfeed 会有相同的 created_at
+        first_newsfeed = NewsFeed.objects.filter(user=self.linghu).first()
+        NewsFeed.objects.filter(user=self.linghu).update(
+            created_at=first_newsfeed.created_at,
+        )
+        self.clear_cache()
+        expected_ids = list(
+            NewsFeed.objects.filter(user=self.linghu)
+            .order_by('-id')
+            .values_list('id', flat=True)
+        )
+
+        # 一直往下翻，跨过 cache 和数据库的边界，不会漏掉也不会重复
+        newsfeed_ids, params, refresh_cursor = [], {}, None
+        while True:
+            response = self.linghu_client.get(NEWSFEEDS_URL, params)
+            self.assertEqual(response.status_code, 200)
+            newsfeed_ids += [result['id'] for result in response.data['results']]
+            refresh_cursor = refresh_cursor or response.data['refresh_cursor']
+            if not response.data['has_next_page']:
+                self.assertEqual(response.data['next_cursor'], None)
+                break
+            params = {'cursor': response.data['next_cursor']}
+        self.assertEqual(newsfeed_ids, expected_ids)
+
+        # 往上翻的时候一次最多返回一页，从离 cursor 最近的开始
+        new_newsfeeds = []
+        for i in range(page_size + 5):
+            tweet = self.create_tweet(followed_user)
+            new_newsfeeds.append(self.create_newsfeed(user=self.linghu, tweet=tweet))
+        response = self.linghu_client.get(NEWSFEEDS_URL, {'cursor': refresh_cursor})
+        self.assertEqual(response.data['has_next_page'], True)
+        self.assertEqual(response.data['next_cursor'], None)
+        self.assertEqual(
+            [result['id'] for result in response.data['results']],
+            [newsfeed.id for newsfeed in new_newsfeeds[:page_size]][::-1],
+        )
+        response = self.linghu_client.get(NEWSFEEDS_URL, {
+            'cursor': response.data['refresh_cursor'],
+        })
+        self.assertEqual(response.data['has_next_page'], False)
+        self.assertEqual(
+            [result['id'] for result in response.data['results']],
+            [newsfeed.id for newsfeed in new_newsfeeds[page_size:]][::-1],
+        )
+
+        # 没有更新的数据的时候 refresh_cursor 保持不变
+        refresh_cursor = response.data['refresh_cursor']
+        response = self.linghu_client.get(NEWSFEEDS_URL, {'cursor': refresh_cursor})
+        self.assertEqual(len(response.data['results']), 0)
+        self.assertEqual(response.data['refresh_cursor'], refresh_cursor)
+
+        response = self.linghu_client.get(NEWSFEEDS_URL, {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_naive_created_at(self):
+        tweet = self.create_tweet(self.dongxie)
+        newsfeed = self.create_newsfeed(self.linghu, tweet)
+        # 旧的参数不带时区的时候当成 UTC
+        created_at = newsfeed.created_at.replace(tzinfo=None)
+        response = self.linghu_client.get(NEWSFEEDS_URL, {
+            'created_at__lt': (created_at + timedelta(seconds=1)).isoformat(),
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'][0]['id'], newsfeed.id)
+        response = self.linghu_client.get(NEWSFEEDS_URL, {
+            'created_at__gt': created_at.isoformat(),
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'], [])
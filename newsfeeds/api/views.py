@@ -1,21 +1,58 @@
 from rest_framework import viewsets
 from rest_framework.permissions import IsAuthenticated
 
+from likes.services import LikeService
+from newsfeeds.api.paginations import NewsFeedPagination
 from newsfeeds.api.serializers import NewsFeedSerializer
 from newsfeeds.models import NewsFeed
-from utils.paginations import EndlessPagination
+from newsfeeds.services import NewsFeedService
+from tweets.models import Tweet
 
 
 class NewsFeedViewSet(viewsets.GenericViewSet):
     permission_classes = [IsAuthenticated]
-    pagination_class = EndlessPagination
+    pagination_class = NewsFeedPagination
 
     def list(self, request):
-        queryset = NewsFeed.objects.filter(user=self.request.user)
-        page = self.paginate_queryset(queryset)
+        # 大部分的请求都在 cache 的范围之内，不需要查询 newsfeed 表
+        cached_newsfeeds = NewsFeedService.get_cached_newsfeeds(request.user.id)
+        newsfeeds = self.paginator.slice_cached_list(cached_newsfeeds, request)
+        if newsfeeds is None:
+            queryset = NewsFeed.objects.filter(user=request.user)
+            newsfeeds = self.paginator.slice_queryset(queryset, request)
+
+        celebrity_ids = NewsFeedService.get_followed_celebrity_ids(request.user.id)
+        if celebrity_ids:
+            # 每个大V各自取出 cursor 之后的一页，用的是 (user, created_at) 的 index
+            # 和 newsfeed 归并之后再统一翻页
+            newsfeeds = NewsFeedService.merge_celebrity_tweets(
+                request.user,
+                newsfeeds,
+                [
+                    self.paginator.slice_queryset(
+                        Tweet.objects.filter(user_id=celebrity_id),
+                        request,
+                        tiebreak_field='id',
+                    )
+                    for celebrity_id in celebrity_ids
+                ],
+            )
+        page = self.paginate_queryset(newsfeeds)
+        NewsFeedService.hydrate_newsfeeds(page)
+        tweets = [
+            newsfeed.cached_tweet
+            for newsfeed in page
+            if newsfeed.cached_tweet is not None
+        ]
         serializer = NewsFeedSerializer(
             page,
-            context={'request': request},
+            context={
+                'request': request,
+                'liked_tweet_ids': LikeService.get_liked_object_ids(
+                    request.user,
+                    tweets,
+                ),
+            },
             many=True,
         )
         return self.get_paginated_response(serializer.data)
@@ -0,0 +1,3 @@
+# fanout 的时候每次从 friendship 表里读多少个粉丝，同时也是每条 insert 语句写入的
+# newsfeed 的行数上限。粉丝再多，内存和单条 sql 的大小也不会超过这个量级
+FANOUT_BATCH_SIZE = 1000
@@ -0,0 +1,7 @@
+def push_newsfeed_to_cache(sender, instance, created, **kwargs):
+    # 只有新创建的 newsfeed 需要加到 cache 里，instance 里已经有 id 和 created_at 了
+    if not created:
+        return
+    # import 写在函数里面避免循环依赖
+    from newsfeeds.services import NewsFeedService
+    NewsFeedService.push_newsfeed_to_cache(instance)
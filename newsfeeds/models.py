@@ -1,5 +1,8 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.db.models.signals import post_save
+
+from newsfeeds.listeners import push_newsfeed_to_cache
 from tweets.models import Tweet
 from utils.memcached_helper import MemcachedHelper
 
@@ -20,4 +23,10 @@ class NewsFeed(models.Model):
 
     @property
     def cached_tweet(self):
+        # 翻页的时候 NewsFeedService.hydrate_newsfeeds 会批量预先加载好
+        if hasattr(self, '_cached_tweet'):
+            return self._cached_tweet
         return MemcachedHelper.get_object_through_cache(Tweet, self.tweet_id)
+
+
+post_save.connect(push_newsfeed_to_cache, sender=NewsFeed)
@@ -1,14 +1,131 @@
-from newsfeeds.models import NewsFeed
+import heapq
+
+from django.conf import settings
+
 from friendships.services import FriendshipService
+from newsfeeds.models import NewsFeed
+from newsfeeds.tasks import fanout_newsfeeds_task
+from tweets.models import Tweet
+from tweets.services import TweetService
+from twitter.cache import USER_NEWSFEEDS_PATTERN
+from utils.memcached_helper import MemcachedHelper
 
 
 class NewsFeedService(object):
     @classmethod
     def fanout_to_followers(cls, tweet):
-        # 正确的方法：使用 bulk_create，会把 insert 语句合成一条
-        newsfeeds = [
-            NewsFeed(user=follower, tweet=tweet)
-            for follower in FriendshipService.get_followers(tweet.user)
+        # 自己发的 tweet 同步写入自己的 newsfeed，保证发完马上就能看到
+        NewsFeed.objects.create(user=tweet.user, tweet=tweet)
+        # 写入粉丝的 newsfeed 的工作量和粉丝数成正比，放到异步任务里去做
+        # 这样发 tweet 的请求的耗时和粉丝数无关
+        fanout_newsfeeds_task.delay(tweet_id=tweet.id)
+
+    @classmethod
+    def is_celebrity(cls, user_id):
+        return user_id in FriendshipService.get_celebrity_user_id_set()
+
+    @classmethod
+    def get_followed_celebrity_ids(cls, user_id):
+        # 大V的集合很小，用它去和关注的人的集合求交集，不需要读每一个关注的人的粉丝数
+        celebrity_ids = FriendshipService.get_celebrity_user_id_set()
+        if not celebrity_ids:
+            return []
+        following_user_ids = FriendshipService.get_following_user_id_set(user_id)
+        return sorted(
+            celebrity_id
+            for celebrity_id in celebrity_ids
+            if celebrity_id in following_user_ids
+        )
+
+    @classmethod
+    def merge_celebrity_tweets(cls, user, newsfeeds, tweet_lists):
+        """
+        newsfeeds 和 tweet_lists 里的每一个 list 都是按照 (created_at, tweet_id) 倒序排列的
+        用 k 路归并把它们合成一个按照 created_at 倒序排列的 newsfeed list
+        大V的 tweet 没有存在 newsfeed 表里，用一个没有保存的 NewsFeed 对象来表示
+        所有数据源都用 tweet_id 作为同一时刻的 tiebreak，cursor 里的 id 在每个数据源里含义相同
+        """
+        celebrity_newsfeeds = [
+            [
+                NewsFeed(user=user, tweet=tweet, created_at=tweet.created_at)
+                for tweet in tweets
+            ]
+            for tweets in tweet_lists
         ]
-        newsfeeds.append(NewsFeed(user=tweet.user, tweet=tweet))
-        NewsFeed.objects.bulk_create(newsfeeds)
\ No newline at end of file
+        merged_newsfeeds = heapq.merge(
+            newsfeeds,
+            *celebrity_newsfeeds,
+            key=lambda newsfeed: (newsfeed.created_at, newsfeed.tweet_id),
+            reverse=True,
+        )
+        # 粉丝数刚刚超过阈值的用户，之前的 tweet 已经 fanout 过了，需要去重
+        results, tweet_ids = [], set()
+        for newsfeed in merged_newsfeeds:
+            if newsfeed.tweet_id in tweet_ids:
+                continue
+            tweet_ids.add(newsfeed.tweet_id)
+            results.append(newsfeed)
+        return results
+
+    @classmethod
+    def get_cached_newsfeeds(cls, user_id):
+        """
+        cache 里存的是用户最新的 CACHED_LIST_LENGTH_LIMIT 条 newsfeed 的
+        (tweet_id, id, created_at)，返回没有保存的 NewsFeed 对象，不需要查询数据库
+        一个用户的 newsfeed 里 tweet_id 是唯一的，用它作为 entry 的 id 和排序的 tiebreak
+        """
+        key = USER_NEWSFEEDS_PATTERN.format(user_id=user_id)
+        entries = MemcachedHelper.get_through_cache(
+            key,
+            lambda: list(
+                NewsFeed.objects.filter(user_id=user_id, tweet_id__isnull=False)
+                .order_by('-created_at', '-tweet_id')
+                .values_list('tweet_id', 'id', 'created_at')
+                [:settings.CACHED_LIST_LENGTH_LIMIT]
+            ),
+        )
+        return [
+            NewsFeed(
+                id=newsfeed_id,
+                user_id=user_id,
+                tweet_id=tweet_id,
+                created_at=created_at,
+            )
+            for tweet_id, newsfeed_id, created_at in entries
+        ]
+
+    @classmethod
+    def push_newsfeed_to_cache(cls, newsfeed):
+        if newsfeed.user_id is None or newsfeed.tweet_id is None:
+            return
+        MemcachedHelper.push_to_cached_list(
+            USER_NEWSFEEDS_PATTERN.format(user_id=newsfeed.user_id),
+            (newsfeed.tweet_id, newsfeed.id, newsfeed.created_at),
+        )
+
+    @classmethod
+    def push_newsfeeds_to_cache(cls, tweet_id, user_ids):
+        """
+        fanout 的时候把 tweet_id 对应的 newsfeed 加到这些用户的 cached list 里
+        cache 里没有的用户也要走一遍 push_to_cached_list，增加版本号之后
+        正在从数据库里加载旧数据的 worker 就不会把旧的 list 写进 cache
+        """
+        # bulk_create 在 MySQL 上拿不到自增的 id，所以从数据库里查回来
+        newsfeeds = NewsFeed.objects.filter(
+            tweet_id=tweet_id,
+            user_id__in=user_ids,
+        ).only('id', 'user_id', 'tweet_id', 'created_at')
+        for newsfeed in newsfeeds:
+            cls.push_newsfeed_to_cache(newsfeed)
+
+    @classmethod
+    def hydrate_newsfeeds(cls, newsfeeds):
+        # 一页 newsfeed 的 tweets，以及这些 tweets 的 user 和 profile 都批量加载
+        tweet_map = MemcachedHelper.get_object_map_through_cache(
+            Tweet,
+            [newsfeed.tweet_id for newsfeed in newsfeeds],
+        )
+        TweetService.hydrate_tweets(list(tweet_map.values()))
+        for newsfeed in newsfeeds:
+            setattr(newsfeed, '_cached_tweet', tweet_map.get(newsfeed.tweet_id))
+        return newsfeeds
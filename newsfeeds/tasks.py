@@ -0,0 +1,34 @@
+from friendships.services import FriendshipService
+from jobs.services import JobService
+from newsfeeds.constants import FANOUT_BATCH_SIZE
+from newsfeeds.models import NewsFeed
+from tweets.models import Tweet
+
+
+@JobService.register('newsfeeds.fanout')
+def fanout_newsfeeds_task(tweet_id):
+    # import 写在函数里面避免循环依赖
+    from newsfeeds.services import NewsFeedService
+
+    tweet = Tweet.objects.filter(id=tweet_id).first()
+    # tweet 在 job 执行之前被删掉了
+    if tweet is None:
+        return
+    # 大V的粉丝太多，不做 fanout，由粉丝在读 newsfeed 的时候去拉取
+    if NewsFeedService.is_celebrity(tweet.user_id):
+        return
+
+    # 分批读粉丝的 id，每一批用一条 bulk_create 写入
+    # 重试的时候用 ignore_conflicts 跳过已经写入的 newsfeed
+    follower_id_chunks = FriendshipService.get_follower_id_chunks(
+        tweet.user_id,
+        chunk_size=FANOUT_BATCH_SIZE,
+    )
+    for follower_ids in follower_id_chunks:
+        newsfeeds = [
+            NewsFeed(user_id=follower_id, tweet_id=tweet.id)
+            for follower_id in follower_ids
+        ]
+        NewsFeed.objects.bulk_create(newsfeeds, ignore_conflicts=True)
+        # bulk_create 不会触发 post_save，需要手动更新 cache
+        NewsFeedService.push_newsfeeds_to_cache(tweet.id, follower_ids)
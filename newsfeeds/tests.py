@@ -0,0 +1,187 @@
+from django.test import override_settings
+
+from django.core.cache import caches
+
+from friendships.models import Friendship
+from friendships.services import FriendshipService
+from jobs.services import JobService
+from newsfeeds.models import NewsFeed
+from newsfeeds.services import NewsFeedService
+from testing.testcases import TestCase
+from twitter.cache import USER_NEWSFEEDS_PATTERN
+from utils.memcached_helper import MemcachedHelper
+
+
+class NewsFeedServiceTests(TestCase):
+
+    def setUp(self):
+        self.clear_cache()
+        self.linghu = self.create_user('linghu')
+        self.dongxie = self.create_user('dongxie')
+        Friendship.objects.create(from_user=self.dongxie, to_user=self.linghu)
+
+    @override_settings(JOB_QUEUE_ALWAYS_EAGER=False)
+    def test_fanout_to_followers_async(self):
+        tweet = self.create_tweet(self.linghu)
+        NewsFeedService.fanout_to_followers(tweet)
+        # 自己的 newsfeed 是同步写入的
+        self.assertEqual(NewsFeed.objects.filter(user=self.linghu).count(), 1)
+        self.assertEqual(NewsFeed.objects.filter(user=self.dongxie).count(), 0)
+
+        self.assertEqual(JobService.run_pending_jobs(), 1)
+        self.assertEqual(NewsFeed.objects.filter(user=self.dongxie).count(), 1)
+        self.assertEqual(NewsFeed.objects.filter(tweet=tweet).count(), 2)
+
+    def test_fanout_to_all_followers(self):
+        followers = [self.dongxie]
+        for i in range(3):
+            follower = self.create_user('follower{}'.format(i))
+            Friendship.objects.create(from_user=follower, to_user=self.linghu)
+            followers.append(follower)
+
+        tweet = self.create_tweet(self.linghu)
+        NewsFeedService.fanout_to_followers(tweet)
+        user_ids = NewsFeed.objects.filter(tweet=tweet).values_list('user_id', flat=True)
+        self.assertEqual(
+            set(user_ids),
+            {self.linghu.id} | set(follower.id for follower in followers),
+        )
+
+    @override_settings(NEWSFEED_PULL_FOLLOWERS_THRESHOLD=2)
+    def test_fanout_skipped_for_celebrity(self):
+        tweet = self.create_tweet(self.linghu)
+        NewsFeedService.fanout_to_followers(tweet)
+        self.assertEqual(NewsFeed.objects.filter(tweet=tweet).count(), 2)
+
+        Friendship.objects.create(
+            from_user=self.create_user('follower'),
+            to_user=self.linghu,
+        )
+        self.assertEqual(NewsFeedService.is_celebrity(self.linghu.id), True)
+        self.assertEqual(
+            NewsFeedService.get_followed_celebrity_ids(self.dongxie.id),
+            [self.linghu.id],
+        )
+        tweet = self.create_tweet(self.linghu)
+        NewsFeedService.fanout_to_followers(tweet)
+        # 只有自己的 newsfeed
+        self.assertEqual(NewsFeed.objects.filter(tweet=tweet).count(), 1)
+
+    @override_settings(NEWSFEED_PULL_FOLLOWERS_THRESHOLD=2)
+    def test_celebrity_user_id_set(self):
+        # 没有大V的时候不需要读关注的人的集合
+        with self.assertNumQueries(1):
+            self.assertEqual(NewsFeedService.get_followed_celebrity_ids(self.dongxie.id), [])
+        FriendshipService.get_following_user_id_set(self.dongxie.id)
+        follower = self.create_user('follower')
+        friendship = Friendship.objects.create(from_user=follower, to_user=self.linghu)
+        # 粉丝数跨过阈值的时候直接修改 cache 里的集合
+        with self.assertNumQueries(0):
+            self.assertEqual(NewsFeedService.is_celebrity(self.linghu.id), True)
+            celebrity_ids = NewsFeedService.get_followed_celebrity_ids(self.dongxie.id)
+        self.assertEqual(celebrity_ids, [self.linghu.id])
+        self.assertEqual(NewsFeedService.get_followed_celebrity_ids(follower.id), [self.linghu.id])
+        self.assertEqual(NewsFeedService.get_followed_celebrity_ids(self.linghu.id), [])
+
+        friendship.delete()
+        with self.assertNumQueries(0):
+            self.assertEqual(NewsFeedService.is_celebrity(self.linghu.id), False)
+            self.assertEqual(NewsFeedService.get_followed_celebrity_ids(self.dongxie.id), [])
+
+        # cache 里没有的时候从数据库里加载
+        Friendship.objects.create(from_user=follower, to_user=self.linghu)
+        self.clear_cache()
+        self.assertEqual(NewsFeedService.is_celebrity(self.linghu.id), True)
+
+    def test_get_cached_newsfeeds(self):
+        newsfeed_ids = []
+        for i in range(3):
+            tweet = self.create_tweet(self.linghu)
+            newsfeed_ids.append(self.create_newsfeed(self.dongxie, tweet).id)
+        newsfeed_ids = newsfeed_ids[::-1]
+
+        # cache miss
+        key = USER_NEWSFEEDS_PATTERN.format(user_id=self.dongxie.id)
+        self.assertEqual(caches['testing'].get(key), None)
+        newsfeeds = NewsFeedService.get_cached_newsfeeds(self.dongxie.id)
+        self.assertEqual([f.id for f in newsfeeds], newsfeed_ids)
+        self.assertEqual(len(MemcachedHelper._get(key).obj), 3)
+
+        # cache hit
+        newsfeeds = NewsFeedService.get_cached_newsfeeds(self.dongxie.id)
+        self.assertEqual([f.id for f in newsfeeds], newsfeed_ids)
+        self.assertEqual(newsfeeds[0].user_id, self.dongxie.id)
+
+        # 新创建的 newsfeed 会被加到 cache 里，只有一条 INSERT，不需要再查询
+        tweet = self.create_tweet(self.linghu)
+        with self.assertNumQueries(1):
+            newsfeed = self.create_newsfeed(self.dongxie, tweet)
+        newsfeeds = NewsFeedService.get_cached_newsfeeds(self.dongxie.id)
+        self.assertEqual([f.id for f in newsfeeds], [newsfeed.id] + newsfeed_ids)
+
+        # fanout 也会更新 cache
+        tweet = self.create_tweet(self.linghu)
+        NewsFeedService.fanout_to_followers(tweet)
+        newsfeeds = NewsFeedService.get_cached_newsfeeds(self.dongxie.id)
+        self.assertEqual(len(newsfeeds), 5)
+        self.assertEqual(newsfeeds[0].tweet_id, tweet.id)
+        self.assertEqual(
+            newsfeeds[0].id,
+            NewsFeed.objects.get(user=self.dongxie, tweet=tweet).id,
+        )
+
+    def test_push_newsfeeds_during_cache_miss(self):
+        tweet = self.create_tweet(self.linghu)
+        self.create_newsfeed(self.dongxie, tweet)
+
+        # 从数据库里加载 list 的时候有新的 newsfeed 写进来，旧的 list 不能写进 cache
+        newsfeed = None
+
+        def fanout_during_load():
+            nonlocal newsfeed
+            entries = list(
+                NewsFeed.objects.filter(user=self.dongxie)
+                .values_list('id', 'tweet_id', 'created_at')
+            )
+            newsfeed = self.create_newsfeed(self.dongxie, self.create_tweet(self.linghu))
+            return entries
+
+        key = USER_NEWSFEEDS_PATTERN.format(user_id=self.dongxie.id)
+        MemcachedHelper.get_through_cache(key, fanout_during_load)
+        newsfeeds = NewsFeedService.get_cached_newsfeeds(self.dongxie.id)
+        self.assertEqual(len(newsfeeds), 2)
+        self.assertEqual(newsfeeds[0].id, newsfeed.id)
+
+    @override_settings(CACHED_LIST_LENGTH_LIMIT=3)
+    def test_cached_newsfeeds_limit(self):
+        for i in range(5):
+            self.create_newsfeed(self.dongxie, self.create_tweet(self.linghu))
+        newsfeeds = NewsFeedService.get_cached_newsfeeds(self.dongxie.id)
+        self.assertEqual(len(newsfeeds), 3)
+        newsfeed = self.create_newsfeed(self.dongxie, self.create_tweet(self.linghu))
+        newsfeeds = NewsFeedService.get_cached_newsfeeds(self.dongxie.id)
+        self.assertEqual(len(newsfeeds), 3)
+        self.assertEqual(newsfeeds[0].id, newsfeed.id)
+
+    def test_hydrate_newsfeeds(self):
+        tweets = [self.create_tweet(user) for user in [self.linghu, self.dongxie] * 2]
+        newsfeeds = [self.create_newsfeed(self.dongxie, tweet) for tweet in tweets]
+        self.linghu.profile
+        self.dongxie.profile
+        self.clear_cache()
+        newsfeeds = NewsFeedService.get_cached_newsfeeds(self.dongxie.id)
+
+        # tweets, users, profiles 各查询一次
+        with self.assertNumQueries(3):
+            NewsFeedService.hydrate_newsfeeds(newsfeeds)
+        with self.assertNumQueries(0):
+            for newsfeed in newsfeeds:
+                self.assertEqual(newsfeed.cached_tweet.id, newsfeed.tweet_id)
+                user = newsfeed.cached_tweet.cached_user
+                self.assertEqual(user.id, newsfeed.cached_tweet.user_id)
+                self.assertEqual(user.profile.user_id, user.id)
+
+        # 全部都在 cache 里的时候不需要查询数据库
+        newsfeeds = NewsFeedService.get_cached_newsfeeds(self.dongxie.id)
+        with self.assertNumQueries(0):
+            NewsFeedService.hydrate_newsfeeds(newsfeeds)
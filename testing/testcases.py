@@ -1,7 +1,11 @@
+from unittest import mock
+
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
 from django.core.cache import caches
+from django.db import transaction
 from django.test import TestCase as DjangoTestCase
+from django.test import TransactionTestCase as DjangoTransactionTestCase
 from rest_framework.test import APIClient
 
 from comments.models import Comment
@@ -10,7 +14,7 @@ from newsfeeds.models import NewsFeed
 from tweets.models import Tweet
 
 
-class TestCase(DjangoTestCase):
+class TestCaseMixin:
 
     def clear_cache(self):
         caches['testing'].clear()
@@ -59,4 +63,52 @@ class TestCase(DjangoTestCase):
         user = self.create_user(*args, **kwargs)
         client = APIClient()
         client.force_authenticate(user)
-        return user, client
\ No newline at end of file
+        return user, client
+
+
+class TestCase(TestCaseMixin, DjangoTestCase):
+    """
+    DjangoTestCase 把每个测试包在一个不会提交的事务里，transaction.on_commit 永远不会执行
+    这里模拟真实的提交：除了测试自己的事务之外没有别的 atomic block 的时候，
+    on_commit 马上执行；最外层的 atomic block 结束的时候执行在它里面注册的 on_commit，
+    回滚了的 atomic block 里注册的 on_commit 会被 django 丢掉
+    """
+
+    def _fixture_setup(self):
+        super()._fixture_setup()
+        connection = transaction.get_connection()
+        base_depth = len(connection.savepoint_ids)
+        original_on_commit = transaction.on_commit
+        original_exit = transaction.Atomic.__exit__
+
+        def on_commit(func, using=None):
+            if len(transaction.get_connection(using).savepoint_ids) == base_depth:
+                func()
+            else:
+                original_on_commit(func, using)
+
+        def atomic_exit(atomic, exc_type, exc_value, traceback):
+            original_exit(atomic, exc_type, exc_value, traceback)
+            connection = transaction.get_connection(atomic.using)
+            if len(connection.savepoint_ids) == base_depth:
+                callbacks, connection.run_on_commit = connection.run_on_commit, []
+                for _, func in callbacks:
+                    func()
+
+        self._on_commit_patches = [
+            mock.patch.object(transaction, 'on_commit', on_commit),
+            mock.patch.object(transaction.Atomic, '__exit__', atomic_exit),
+        ]
+        for patch in self._on_commit_patches:
+            patch.start()
+
+    def _fixture_teardown(self):
+        for patch in self._on_commit_patches:
+            patch.stop()
+        super()._fixture_teardown()
+
+
+# 不会把每个测试包在一个事务里，transaction.on_commit 会马上执行
+# 并发的测试也需要用它，其他线程才能看到测试里写入的数据
+class TransactionTestCase(TestCaseMixin, DjangoTransactionTestCase):
+    pass
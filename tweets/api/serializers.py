@@ -1,12 +1,21 @@
+from django.conf import settings
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 
 from accounts.api.serializers import UserSerializerForTweet
+from accounts.services import UserService
+from comments.api.paginations import CommentPagination
 from comments.api.serializers import CommentSerializer
+from comments.services import CommentService
 from likes.api.serializers import LikeSerializer
 from likes.services import LikeService
-from tweets.constants import TWEET_PHOTOS_UPLOAD_LIMIT
+from tweets.constants import (
+    TWEET_COMMENTS_PREVIEW_LIMIT,
+    TWEET_LIKES_PREVIEW_LIMIT,
+    TWEET_PHOTOS_UPLOAD_LIMIT,
+)
 from tweets.models import Tweet
+from utils.paginations import EndlessPagination
 
 
 # ModelSerializer只需要在class Meta里指定field是什么，它就默认包含了，
@@ -37,12 +46,17 @@ class TweetSerializer(serializers.ModelSerializer):
         )
 
     def get_likes_count(self, obj):
-        return obj.like_set.count()
+        # cache 里的计数器比数据库里的 likes_count 更新
+        return LikeService.get_likes_count(obj)
 
     def get_comments_count(self, obj):
-        return obj.comment_set.count()
+        return obj.comments_count
 
     def get_has_liked(self, obj):
+        # 列表页会把整页的结果通过 LikeService.get_liked_object_ids 预先算好
+        liked_tweet_ids = self.context.get('liked_tweet_ids')
+        if liked_tweet_ids is not None:
+            return obj.id in liked_tweet_ids
         return LikeService.has_liked(self.context['request'].user, obj)
 
     def get_photo_urls(self, obj):
@@ -86,8 +100,14 @@ class TweetSerializerForCreate(serializers.ModelSerializer):
 
 
 class TweetSerializerForDetail(TweetSerializer):
-    comments = CommentSerializer(source='comment_set', many=True)
-    likes = LikeSerializer(source='like_set', many=True)
+    """
+    只包含最新的几条评论和点赞，数据都来自 cache，tweet 再热门耗时也是固定的
+    comments_cursor / likes_cursor 用来去评论和点赞的列表接口继续往前翻
+    """
+    comments = serializers.SerializerMethodField()
+    comments_cursor = serializers.SerializerMethodField()
+    likes = serializers.SerializerMethodField()
+    likes_cursor = serializers.SerializerMethodField()
 
     class Meta:
         model = Tweet
@@ -99,9 +119,71 @@ class TweetSerializerForDetail(TweetSerializer):
             'content',
             'likes',
             'comments',
+            'comments_cursor',
+            'likes_cursor',
             'likes_count',
             'comments_count',
             'has_liked',
             'photo_urls',
         )
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # 预览和 cursor 共用一次 cache 读取，按照 tweet id 分开存
+        # many=True 的时候所有的 tweet 共用同一个 serializer
+        self._comments_previews = {}
+        self._likes_previews = {}
+
+    def _get_preview(self, cached_list, limit):
+        # 返回 (最新的 limit 条数据, 是否还有更早的数据)
+        has_more = len(cached_list) > limit or \
+            len(cached_list) >= settings.CACHED_LIST_LENGTH_LIMIT
+        return cached_list[:limit], has_more
+
+    def _get_comments_preview(self, obj):
+        if obj.id not in self._comments_previews:
+            self._comments_previews[obj.id] = self._get_preview(
+                CommentService.get_cached_comments(obj.id),
+                TWEET_COMMENTS_PREVIEW_LIMIT,
+            )
+        return self._comments_previews[obj.id]
+
+    def _get_likes_preview(self, obj):
+        if obj.id not in self._likes_previews:
+            self._likes_previews[obj.id] = self._get_preview(
+                LikeService.get_cached_likes(obj),
+                TWEET_LIKES_PREVIEW_LIMIT,
+            )
+        return self._likes_previews[obj.id]
+
+    def get_comments(self, obj):
+        comments, _ = self._get_comments_preview(obj)
+        # 和评论列表一样按照时间正序排列
+        comments = CommentService.hydrate_comments(comments[::-1])
+        context = dict(self.context)
+        context['liked_comment_ids'] = LikeService.get_liked_object_ids(
+            self.context['request'].user,
+            comments,
+        )
+        return CommentSerializer(comments, many=True, context=context).data
+
+    def get_comments_cursor(self, obj):
+        comments, has_more = self._get_comments_preview(obj)
+        if not comments or not has_more:
+            return None
+        # 最早的一条预览评论之前的评论
+        return CommentPagination().encode_cursor(
+            comments[-1],
+            CommentPagination.OLDER,
+        )
+
+    def get_likes(self, obj):
+        likes, _ = self._get_likes_preview(obj)
+        likes = UserService.hydrate_users(likes)
+        return LikeSerializer(likes, many=True, context=self.context).data
+
+    def get_likes_cursor(self, obj):
+        likes, has_more = self._get_likes_preview(obj)
+        if not likes or not has_more:
+            return None
+        return EndlessPagination().encode_cursor(likes[-1], EndlessPagination.OLDER)
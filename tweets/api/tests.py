@@ -1,13 +1,17 @@
+from django.contrib.auth.models import AnonymousUser
 from django.core.files.uploadedfile import SimpleUploadedFile
-from rest_framework.test import APIClient
+from rest_framework.test import APIClient, APIRequestFactory
 
 from testing.testcases import TestCase
+from tweets.api.serializers import TweetSerializerForDetail
+from tweets.constants import TWEET_COMMENTS_PREVIEW_LIMIT, TWEET_LIKES_PREVIEW_LIMIT
 from tweets.models import Tweet, TweetPhoto
 from utils.paginations import EndlessPagination
 
 TWEET_LIST_API = '/api/tweets/'
 TWEET_CREATE_API = '/api/tweets/'
 TWEET_RETRIEVE_API = '/api/tweets/{}/'
+COMMENT_LIST_API = '/api/comments/'
 
 
 class TweetApiTests(TestCase):
@@ -89,6 +93,81 @@ class TweetApiTests(TestCase):
         response = self.anonymous_client.get(url)
         self.assertEqual(len(response.data['comments']), 2)
 
+    def test_retrieve_previews(self):
+        tweet = self.create_tweet(self.user1)
+        comment_limit = TWEET_COMMENTS_PREVIEW_LIMIT
+        like_limit = TWEET_LIKES_PREVIEW_LIMIT
+        for i in range(comment_limit + 2):
+            self.create_comment(self.user2, tweet, str(i))
+        users = [
+            self.create_user('liker{}'.format(i))
+            for i in range(like_limit + 1)
+        ]
+        for user in users:
+            self.create_like(user, tweet)
+
+        url = TWEET_RETRIEVE_API.format(tweet.id)
+        response = self.anonymous_client.get(url)
+        # 只预览最新的几条评论，按照时间正序排列
+        self.assertEqual(
+            [c['content'] for c in response.data['comments']],
+            [str(i) for i in range(2, comment_limit + 2)],
+        )
+        self.assertEqual(
+            [like['user']['username'] for like in response.data['likes']],
+            [user.username for user in users[:0:-1]],
+        )
+        self.assertEqual(response.data['comments_count'], comment_limit + 2)
+        self.assertEqual(response.data['likes_count'], like_limit + 1)
+
+        # 用 comments_cursor 去评论列表里拿更早的评论
+        response = self.anonymous_client.get(COMMENT_LIST_API, {
+            'tweet_id': tweet.id,
+            'cursor': response.data['comments_cursor'],
+        })
+        self.assertEqual(
+            [c['content'] for c in response.data['comments']],
+            ['0', '1'],
+        )
+        self.assertEqual(response.data['has_next_page'], False)
+
+        # 评论和点赞越来越多，详情的查询数量也不会变
+        with self.assertNumQueries(2):
+            response = self.anonymous_client.get(url)
+        self.create_comment(self.user2, tweet, 'new')
+        self.create_like(self.user2, tweet)
+        response = self.anonymous_client.get(url)
+        self.assertEqual(response.data['comments'][-1]['content'], 'new')
+        self.assertEqual(response.data['likes'][0]['user']['username'], 'user2')
+        with self.assertNumQueries(2):
+            self.anonymous_client.get(url)
+
+        # 没有更多数据的时候没有 cursor
+        tweet = self.create_tweet(self.user1)
+        self.create_comment(self.user2, tweet)
+        response = self.anonymous_client.get(TWEET_RETRIEVE_API.format(tweet.id))
+        self.assertEqual(response.data['comments_cursor'], None)
+        self.assertEqual(response.data['likes_cursor'], None)
+
+    def test_detail_serializer_with_many(self):
+        tweets = self.tweets1[:2]
+        self.create_comment(self.user2, tweets[0], 'first')
+        self.create_like(self.user2, tweets[0])
+        self.create_comment(self.user1, tweets[1], 'second')
+
+        request = APIRequestFactory().get(TWEET_LIST_API)
+        request.user = AnonymousUser()
+        data = TweetSerializerForDetail(
+            tweets,
+            many=True,
+            context={'request': request},
+        ).data
+        # 每个 tweet 的预览都是它自己的
+        self.assertEqual([c['content'] for c in data[0]['comments']], ['first'])
+        self.assertEqual([c['content'] for c in data[1]['comments']], ['second'])
+        self.assertEqual(len(data[0]['likes']), 1)
+        self.assertEqual(data[1]['likes'], [])
+
     def test_create_with_files(self):
         # 上传的data没有files，兼容旧的客户端API
         response = self.user1_client.post(TWEET_CREATE_API, {
@@ -2,6 +2,7 @@ from rest_framework import viewsets
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
 
+from likes.services import LikeService
 from newsfeeds.services import NewsFeedService
 from tweets.api.serializers import (
     TweetSerializer,
@@ -9,6 +10,7 @@ from tweets.api.serializers import (
     TweetSerializerForDetail,
 )
 from tweets.models import Tweet
+from tweets.services import TweetService
 from utils.decorators import required_params
 from utils.paginations import EndlessPagination
 
@@ -34,12 +36,19 @@ class TweetViewSet(viewsets.GenericViewSet):
     def list(self, request):
         tweets = Tweet.objects.filter(
             user_id=request.query_params['user_id']
-        ).order_by('-created_at')
+        ).order_by('-created_at', '-id')
         tweets = self.paginate_queryset(tweets)
+        TweetService.hydrate_tweets(tweets)
 
         serializer = TweetSerializer(
             tweets,
-            context={'request': request},
+            context={
+                'request': request,
+                'liked_tweet_ids': LikeService.get_liked_object_ids(
+                    request.user,
+                    tweets,
+                ),
+            },
             many=True,
         )
         return self.get_paginated_response(serializer.data)
@@ -13,3 +13,7 @@ TWEET_PHOTO_STATUS_CHOICES = (
 
 TWEET_PHOTOS_UPLOAD_LIMIT = 9
 
+
+# tweet 详情里只预览最新的几条评论和点赞，更多的通过 cursor 去列表接口翻页
+TWEET_COMMENTS_PREVIEW_LIMIT = 20
+TWEET_LIKES_PREVIEW_LIMIT = 20
@@ -0,0 +1,95 @@
+import pickle
+import timeit
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from accounts.models import UserProfile
+from tweets.models import Tweet
+from utils.cache_codecs import ModelCodec, decode_id_set, encode_id_set
+from utils.time_helpers import utc_now
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare payload size and decode time of the compact cache codecs '
+        'against pickling whole model instances. Nothing is written to the '
+        'database or the cache.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--number',
+            type=int,
+            default=10000,
+            help='number of decodes timed for each payload',
+        )
+
+    def handle(self, *args, **options):
+        now = utc_now()
+        user = User(
+            id=123456,
+            username='linghu',
+            email='linghu@jiuzhang.com',
+            password=make_password('correct horse battery staple'),
+            last_login=now,
+            date_joined=now,
+        )
+        samples = [
+            ('User', user),
+            ('UserProfile', UserProfile(
+                id=123456,
+                user_id=user.id,
+                avatar='avatars/linghu.png',
+                nickname='linghuchong',
+                created_at=now,
+                updated_at=now,
+            )),
+            ('Tweet', Tweet(
+                id=987654321,
+                user_id=user.id,
+                content='hello world ' * 10,
+                created_at=now,
+                likes_count=42,
+                comments_count=7,
+            )),
+        ]
+
+        self.stdout.write('{:<16}{:>14}{:>14}{:>16}{:>16}'.format(
+            'payload', 'pickle bytes', 'codec bytes', 'pickle us/op', 'codec us/op',
+        ))
+        for name, obj in samples:
+            pickled = pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+            encoded = ModelCodec.get_codec(type(obj)).encode(obj)
+            self.report(
+                name,
+                pickled,
+                encoded,
+                lambda: pickle.loads(pickled),
+                lambda: ModelCodec.loads(encoded),
+                options['number'],
+            )
+
+        following_ids = set(range(10 ** 6, 10 ** 6 + 1000))
+        pickled = pickle.dumps(following_ids, pickle.HIGHEST_PROTOCOL)
+        encoded, _ = encode_id_set(following_ids)
+        self.report(
+            '1000 ids',
+            pickled,
+            encoded,
+            lambda: pickle.loads(pickled),
+            lambda: decode_id_set(encoded),
+            options['number'] // 10,
+        )
+
+    def report(self, name, pickled, encoded, pickle_decode, codec_decode, number):
+        pickle_time = timeit.timeit(pickle_decode, number=number) / number
+        codec_time = timeit.timeit(codec_decode, number=number) / number
+        self.stdout.write('{:<16}{:>14}{:>14}{:>16.2f}{:>16.2f}'.format(
+            name,
+            len(pickled),
+            len(encoded),
+            pickle_time * 10 ** 6,
+            codec_time * 10 ** 6,
+        ))
@@ -0,0 +1,104 @@
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from comments.models import Comment
+from likes.models import Like
+from likes.services import LikeService
+from tweets.models import Tweet
+from utils.memcached_helper import MemcachedHelper
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute Tweet.likes_count, Tweet.comments_count and '
+        'Comment.likes_count from the likes and comments tables'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='number of tweets or comments checked per query',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        fixed = self.reconcile(
+            Tweet,
+            batch_size,
+            likes_count=lambda ids: self.count_likes(Tweet, ids),
+            comments_count=lambda ids: self.count_comments(ids),
+        )
+        self.stdout.write('fixed {} tweets'.format(fixed))
+        fixed = self.reconcile(
+            Comment,
+            batch_size,
+            likes_count=lambda ids: self.count_likes(Comment, ids),
+        )
+        self.stdout.write('fixed {} comments'.format(fixed))
+
+    def reconcile(self, model_class, batch_size, **counters):
+        """
+        likes_count 是 write-behind 的，还没有 flush 的变化量在 cache 里，
+        数据库里的值应该等于 COUNT 减掉这部分变化量，否则下一次 flush 会重复加上
+        cache 里的计数器和 COUNT 不一致的时候删掉，读的时候会重建
+        """
+        fixed = 0
+        last_id = 0
+        fields = ['id'] + list(counters.keys())
+        while True:
+            rows = list(
+                model_class.objects.filter(id__gt=last_id)
+                .order_by('id')
+                .values(*fields)[:batch_size]
+            )
+            if not rows:
+                return fixed
+            ids = [row['id'] for row in rows]
+            actual_counts = {
+                field: counter(ids)
+                for field, counter in counters.items()
+            }
+            pending_deltas = LikeService.get_pending_likes_deltas(model_class, ids)
+            cached_likes_counts = LikeService.get_cached_likes_counts(model_class, ids)
+            for row in rows:
+                expected_counts = {
+                    field: actual_counts[field].get(row['id'], 0)
+                    for field in counters
+                }
+                expected_counts['likes_count'] -= pending_deltas.get(row['id'], 0)
+                drifted = {
+                    field: count
+                    for field, count in expected_counts.items()
+                    if row[field] != count
+                }
+                cached_likes_count = cached_likes_counts.get(row['id'])
+                counter_drifted = (
+                    cached_likes_count is not None and
+                    cached_likes_count != actual_counts['likes_count'].get(row['id'], 0)
+                )
+                if not drifted and not counter_drifted:
+                    continue
+                if drifted:
+                    model_class.objects.filter(id=row['id']).update(**drifted)
+                    MemcachedHelper.invalidate_cached_object(model_class, row['id'])
+                if counter_drifted:
+                    LikeService.invalidate_likes_count(model_class, row['id'])
+                fixed += 1
+            last_id = ids[-1]
+
+    def count_likes(self, model_class, object_ids):
+        # order_by() 去掉 Meta.ordering 对 GROUP BY 的影响
+        rows = Like.objects.filter(
+            content_type=ContentType.objects.get_for_model(model_class),
+            object_id__in=object_ids,
+        ).order_by().values('object_id').annotate(count=Count('id'))
+        return {row['object_id']: row['count'] for row in rows}
+
+    def count_comments(self, tweet_ids):
+        rows = Comment.objects.filter(
+            tweet_id__in=tweet_ids,
+        ).order_by().values('tweet_id').annotate(count=Count('id'))
+        return {row['tweet_id']: row['count'] for row in rows}
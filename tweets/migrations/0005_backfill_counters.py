@@ -0,0 +1,47 @@
+from django.db import migrations
+from django.db.models import Count
+
+
+def backfill_counters(apps, schema_editor):
+    Tweet = apps.get_model('tweets', 'Tweet')
+    Comment = apps.get_model('comments', 'Comment')
+    Like = apps.get_model('likes', 'Like')
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+
+    # order_by() 去掉 Meta.ordering 对 GROUP BY 的影响
+    comments_counts = dict(
+        Comment.objects.filter(tweet_id__isnull=False)
+        .order_by().values_list('tweet_id').annotate(Count('id'))
+    )
+    # 新建的数据库里还没有 content type，也就不会有 like
+    content_type = ContentType.objects.filter(app_label='tweets', model='tweet').first()
+    likes_counts = {}
+    if content_type is not None:
+        likes_counts = dict(
+            Like.objects.filter(content_type_id=content_type.id)
+            .order_by().values_list('object_id').annotate(Count('id'))
+        )
+
+    # 新加的 counter 默认是 0，只需要更新有评论或者有点赞的 tweet
+    for tweet_id in set(comments_counts) | set(likes_counts):
+        Tweet.objects.filter(id=tweet_id).update(
+            comments_count=comments_counts.get(tweet_id, 0),
+            likes_count=likes_counts.get(tweet_id, 0),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tweets', '0004_auto_20261018_0609'),
+        ('comments', '0001_initial'),
+        ('likes', '0001_initial'),
+        ('contenttypes', '0002_remove_content_type_name'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            backfill_counters,
+            migrations.RunPython.noop,
+        ),
+    ]
@@ -5,6 +5,7 @@ from django.db.models.signals import post_save, pre_delete
 
 from likes.models import Like
 from tweets.constants import TweetPhotoStatus, TWEET_PHOTO_STATUS_CHOICES
+from utils.cache_codecs import ModelCodec
 from utils.listeners import invalidate_object_cache
 from utils.memcached_helper import MemcachedHelper
 from utils.time_helpers import utc_now
@@ -19,6 +20,10 @@ class Tweet(models.Model):
     )
     content = models.CharField(max_length=255)
     created_at = models.DateTimeField(auto_now_add=True)
+    # 冗余存储的 likes 和 comments 的数量，避免每次序列化的时候都去 count
+    # 在 like 和 comment 创建和删除的时候用 F expression 更新
+    likes_count = models.IntegerField(default=0)
+    comments_count = models.IntegerField(default=0)
 
     class Meta:
         index_together = (('user', 'created_at'),)
@@ -46,6 +51,9 @@ class Tweet(models.Model):
 
     @property
     def cached_user(self):
+        # 翻页的时候 TweetService.hydrate_tweets 会批量预先加载好
+        if hasattr(self, '_cached_user'):
+            return self._cached_user
         return MemcachedHelper.get_object_through_cache(User, self.user_id)
 
 
@@ -80,5 +88,7 @@ class TweetPhoto(models.Model):
         return f'{self.tweet_id}: {self.file}'
 
 
+ModelCodec.register(Tweet)
+
 post_save.connect(invalidate_object_cache, sender=Tweet)
 pre_delete.connect(invalidate_object_cache, sender=Tweet)
@@ -1,3 +1,5 @@
+from accounts.services import UserService
+from likes.services import LikeService
 from tweets.models import TweetPhoto
 
 
@@ -14,4 +16,13 @@ class TweetService(object):
                 order=index,
             )
             photos.append(photo)
-        TweetPhoto.objects.bulk_create(photos)
\ No newline at end of file
+        TweetPhoto.objects.bulk_create(photos)
+
+    @classmethod
+    def hydrate_tweets(cls, tweets):
+        """
+        批量加载一页 tweets 的 user，user profile 和 likes_count，每一种只需要一次 multi-get
+        序列化的时候 tweet.cached_user 和 user.profile 就不会再访问 cache 了
+        """
+        LikeService.hydrate_likes_counts(tweets)
+        return UserService.hydrate_users(tweets)
@@ -1,8 +1,18 @@
 from datetime import timedelta
+from io import StringIO
 
+from django.core.cache import caches
+from django.core.management import call_command
+from django.test import override_settings
+
+from jobs.models import Job
+from jobs.services import JobService
+from likes.models import Like
+from likes.services import LikeService
 from testing.testcases import TestCase
 from tweets.constants import TweetPhotoStatus
-from tweets.models import TweetPhoto
+from tweets.models import Tweet, TweetPhoto
+from twitter.cache import LIKES_COUNT_PATTERN
 from utils.time_helpers import utc_now
 
 
@@ -36,4 +46,80 @@ class TweetTests(TestCase):
         )
         self.assertEqual(photo.user, self.linghu)
         self.assertEqual(photo.status, TweetPhotoStatus.PENDING)
-        self.assertEqual(self.tweet.tweetphoto_set.count(), 1)
\ No newline at end of file
+        self.assertEqual(self.tweet.tweetphoto_set.count(), 1)
+
+    def test_counters(self):
+        dongxie = self.create_user('dongxie')
+        comment = self.create_comment(dongxie, self.tweet)
+        self.create_comment(self.linghu, self.tweet)
+        self.create_like(self.linghu, self.tweet)
+        like = self.create_like(dongxie, self.tweet)
+        self.create_like(dongxie, comment)
+        self.tweet.refresh_from_db()
+        comment.refresh_from_db()
+        self.assertEqual(self.tweet.likes_count, 2)
+        self.assertEqual(self.tweet.comments_count, 2)
+        self.assertEqual(comment.likes_count, 1)
+
+        like.delete()
+        comment.delete()
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.likes_count, 1)
+        self.assertEqual(self.tweet.comments_count, 1)
+
+    def test_reconcile_counters(self):
+        comment = self.create_comment(self.linghu, self.tweet)
+        self.create_like(self.linghu, self.tweet)
+        self.create_like(self.linghu, comment)
+        Tweet.objects.filter(id=self.tweet.id).update(likes_count=10, comments_count=0)
+        another_tweet = self.create_tweet(self.linghu)
+
+        out = StringIO()
+        call_command('reconcile_counters', batch_size=1, stdout=out)
+        self.assertEqual('fixed 1 tweets' in out.getvalue(), True)
+        self.assertEqual('fixed 0 comments' in out.getvalue(), True)
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.likes_count, 1)
+        self.assertEqual(self.tweet.comments_count, 1)
+        another_tweet.refresh_from_db()
+        self.assertEqual(another_tweet.likes_count, 0)
+
+    @override_settings(JOB_QUEUE_ALWAYS_EAGER=False)
+    def test_reconcile_counters_with_pending_likes(self):
+        self.create_like(self.linghu, self.tweet)
+
+        # 还没有 flush 的变化量不算 drift，flush 之后不会重复加上
+        out = StringIO()
+        call_command('reconcile_counters', stdout=out)
+        self.assertEqual('fixed 0 tweets' in out.getvalue(), True)
+        Job.objects.update(run_after=utc_now())
+        JobService.run_pending_jobs()
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.likes_count, 1)
+
+        # cache 里的计数器不对的时候删掉重建
+        LikeService.update_likes_count(Like.objects.get(), 1)
+        Job.objects.update(run_after=utc_now())
+        JobService.run_pending_jobs()
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.likes_count, 2)
+        out = StringIO()
+        call_command('reconcile_counters', stdout=out)
+        self.assertEqual('fixed 1 tweets' in out.getvalue(), True)
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.likes_count, 1)
+        self.assertEqual(
+            LikeService.get_likes_count(Tweet.objects.get(id=self.tweet.id)),
+            1,
+        )
+
+        count_key = LIKES_COUNT_PATTERN.format(content_type='tweet', object_id=self.tweet.id)
+        caches['testing'].set(count_key, 5)
+        out = StringIO()
+        call_command('reconcile_counters', stdout=out)
+        self.assertEqual('fixed 1 tweets' in out.getvalue(), True)
+        self.assertEqual(caches['testing'].get(count_key), None)
+        self.assertEqual(
+            LikeService.get_likes_count(Tweet.objects.get(id=self.tweet.id)),
+            1,
+        )
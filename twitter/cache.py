@@ -1,6 +1,21 @@
 # memcached
 FOLLOWINGS_PATTERN = 'followings:{user_id}'
 USER_PROFILE_PATTERN = 'userprofile:{user_id}'
+# newsfeed 的 cached list 按照 (created_at, tweet_id) 排序，和之前按 id 排序的 list 用不同的 key
+USER_NEWSFEEDS_PATTERN = 'user_newsfeed_list:{user_id}'
+# 粉丝数超过 NEWSFEED_PULL_FOLLOWERS_THRESHOLD 的用户的 id 的集合
+CELEBRITY_USER_IDS_KEY = 'celebrity_user_ids'
+USER_FOLLOWERS_PATTERN = 'user_followers:{user_id}'
+USER_FOLLOWINGS_PATTERN = 'user_followings:{user_id}'
+TWEET_COMMENTS_PATTERN = 'tweet_comments:{tweet_id}'
+OBJECT_LIKES_PATTERN = 'object_likes:{content_type}:{object_id}'
+# likes_count 的计数器，以及还没有写回数据库的增加量和减少量
+LIKES_COUNT_PATTERN = 'likes_count:{content_type}:{object_id}'
+LIKES_COUNT_INCR_PATTERN = 'likes_count_incr:{content_type}:{object_id}'
+LIKES_COUNT_DECR_PATTERN = 'likes_count_decr:{content_type}:{object_id}'
+LIKES_COUNT_FLUSH_PATTERN = 'likes_count_flush:{content_type}:{object_id}'
+# 保证同一段时间里只有一个 worker 去检查挂掉的 job
+JOB_REQUEUE_STALE_KEY = 'jobs_requeue_stale'
 
 # redis
 # ...
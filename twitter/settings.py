@@ -51,6 +51,7 @@ INSTALLED_APPS = [
     'newsfeeds',
     'comments',
     'likes',
+    'jobs',
 ]
 
 REST_FRAMEWORK = {
@@ -67,6 +68,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'utils.middleware.IdentityMapMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'debug_toolbar.middleware.DebugToolbarMiddleware',
@@ -155,6 +157,37 @@ TESTING = ((" ".join(sys.argv)).find('manage.py test') != -1)
 if TESTING:
     DEFAULT_FILE_STORAGE = 'django.core.files.storage.FileSystemStorage'
 
+# 通过 JobService 放进队列里的 job 由 `python manage.py run_job_worker` 来执行
+# 单元测试里不启动 worker，job 会在 enqueue 的时候直接同步执行
+JOB_QUEUE_ALWAYS_EAGER = TESTING
+
+# 粉丝数达到这个值的用户发 tweet 的时候不再 fanout 到粉丝的 newsfeed (push)
+# 而是由粉丝在读取 newsfeed 的时候去拉取他们最新的 tweets (pull)
+NEWSFEED_PULL_FOLLOWERS_THRESHOLD = 10000
+
+# cache 里的 list (比如每个用户的 newsfeed 列表) 最多存多少个元素
+# 翻页超过这个范围的时候去数据库里查询
+CACHED_LIST_LENGTH_LIMIT = 200
+
+# cache miss 的时候只有拿到锁的 worker 去数据库里加载，其他的 worker 最多等
+# CACHE_LOCK_WAIT_SECONDS 秒，锁最多持有 CACHE_LOCK_TIMEOUT_SECONDS 秒
+CACHE_LOCK_TIMEOUT_SECONDS = 5
+CACHE_LOCK_WAIT_SECONDS = 0.5
+# probabilistic early refresh 的参数，越大越早刷新，设成 0 关闭
+CACHE_EARLY_REFRESH_BETA = 1.0
+# 不存在的 object 在 cache 里记一个 tombstone，避免每次都查询数据库
+CACHE_TOMBSTONE_TIMEOUT_SECONDS = 60
+# 数据修改之后，事务提交的时候把最新的数据写回 cache，而不是等下一次读的时候再加载
+CACHE_WRITE_THROUGH = True
+# memcached 单个 item 最大 1MB，超过 CACHE_CHUNK_SIZE_BYTES 的 id 集合会被切成多个 key 存储
+CACHE_CHUNK_SIZE_BYTES = 512 * 1024
+# likes_count 先在 cache 里用 incr / decr 计数，最多 LIKES_COUNT_FLUSH_INTERVAL_SECONDS 秒
+# 之后由一个 job 把这段时间里累计的变化一次性写回数据库
+LIKES_COUNT_FLUSH_INTERVAL_SECONDS = 10
+# flush job 丢失了的话 (比如 worker 挂掉)，LIKES_COUNT_FLUSH_KEY_TIMEOUT_SECONDS 秒之后
+# 下一次 like 会重新安排一个 flush job
+LIKES_COUNT_FLUSH_KEY_TIMEOUT_SECONDS = LIKES_COUNT_FLUSH_INTERVAL_SECONDS * 6
+
 # 当用s3boto3 作为用户上传文件存储时，需要按照你在 AWS 上创建的配置来设置你的 BUCKET_NAME
 # 和 REGION_NAME，这个值你可以改成你自己创建的 bucket 的名字和所在的 region
 AWS_STORAGE_BUCKET_NAME = 'yufei-twitter'
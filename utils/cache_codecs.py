@@ -0,0 +1,200 @@
+import pickle
+from array import array
+from bisect import bisect_left
+from collections.abc import Set
+from datetime import datetime, timedelta
+
+import pytz
+from django.db import models
+from django.db.models.base import ModelState
+
+# 编码格式本身的版本号，格式发生变化的时候加一，旧格式的数据会被当成 cache miss
+MODEL_CODEC_PREFIX = b'm1:'
+ID_SET_CODEC_PREFIX = b'i2:'
+
+EPOCH = datetime(1970, 1, 1, tzinfo=pytz.utc)
+ONE_MICROSECOND = timedelta(microseconds=1)
+
+
+class ModelCodec:
+    """
+    把 model instance 编码成紧凑的 bytes 存在 memcached 里，只存注册过的字段
+    比 pickle 整个 instance 小很多，也不会把 password 之类不需要的字段放进 cache
+    解码出来的 instance 上没有存的字段是 deferred 的，访问的时候才会查询数据库
+    """
+    # model class -> codec
+    codecs = {}
+    # model label -> codec
+    codecs_by_label = {}
+
+    def __init__(self, model_class, fields, version):
+        self.model_class = model_class
+        self.label = model_class._meta.label_lower
+        self.version = version
+        # from_db 要求 values 按照 concrete_fields 的顺序排列
+        self.fields = [
+            field
+            for field in model_class._meta.concrete_fields
+            if fields is None or field.name in fields or field.attname in fields
+        ]
+        self.attnames = [field.attname for field in self.fields]
+        self.field_names = set(self.attnames) | set(
+            field.name for field in self.fields
+        )
+        self.datetime_attnames = [
+            field.attname
+            for field in self.fields
+            if isinstance(field, models.DateTimeField)
+        ]
+
+    @classmethod
+    def register(cls, model_class, fields=None, version=1):
+        """
+        fields 是 None 的时候存所有的字段
+        字段发生变化的时候需要增加 version，旧版本的数据会被当成 cache miss
+        """
+        codec = cls(model_class, fields, version)
+        cls.codecs[model_class] = codec
+        cls.codecs_by_label[codec.label] = codec
+
+    @classmethod
+    def get_codec(cls, model_class):
+        return cls.codecs.get(model_class)
+
+    def _encode_value(self, field, value):
+        if value is not None and isinstance(field, models.DateTimeField):
+            return (value - EPOCH) // ONE_MICROSECOND
+        if value is not None and isinstance(field, models.FileField):
+            return value.name
+        return value
+
+    def encode(self, obj, *header):
+        values = [
+            self._encode_value(field, getattr(obj, field.attname))
+            for field in self.fields
+        ]
+        # 只包含基本类型的 tuple，pickle 之后很紧凑，解码也比 json 快很多
+        data = (self.label, self.version, header, *values)
+        return MODEL_CODEC_PREFIX + pickle.dumps(data, protocol=4)
+
+    def decode(self, values):
+        # 不走 Model.__init__ (以及 pre_init / post_init signal)，直接填 __dict__
+        # 没有填的字段 Django 会当成 deferred 字段
+        obj = self.model_class.__new__(self.model_class)
+        obj.__dict__.update(zip(self.attnames, values))
+        for attname in self.datetime_attnames:
+            if obj.__dict__[attname] is not None:
+                obj.__dict__[attname] = EPOCH + obj.__dict__[attname] * ONE_MICROSECOND
+        obj._state = ModelState()
+        obj._state.adding = False
+        return obj
+
+    @classmethod
+    def loads(cls, data):
+        """
+        返回 (header, obj)，数据无法识别的时候返回 (None, None)
+        """
+        if not data.startswith(MODEL_CODEC_PREFIX):
+            return None, None
+        label, version, header, *values = pickle.loads(data[len(MODEL_CODEC_PREFIX):])
+        codec = cls.codecs_by_label.get(label)
+        if codec is None or codec.version != version:
+            return None, None
+        return header, codec.decode(values)
+
+
+class CompactIdSet(Set):
+    """
+    只读的 id 集合，内部是排好序的定长整数数组
+    id 都小于 2^31 的时候每个 id 占 4 个字节，否则占 8 个字节
+    判断 id 在不在集合里用二分查找，不需要展开成 python 的 set
+    """
+
+    def __init__(self, ids=()):
+        ids = sorted(set(ids))
+        typecode = 'i' if not ids or ids[-1] < 2 ** 31 else 'q'
+        self._ids = array(typecode, ids)
+
+    @classmethod
+    def frombytes(cls, typecode, packed):
+        id_set = cls.__new__(cls)
+        id_set._ids = array(typecode)
+        id_set._ids.frombytes(packed)
+        return id_set
+
+    @classmethod
+    def _from_iterable(cls, iterable):
+        # |, -, & 之类的运算返回的也是 CompactIdSet
+        return cls(iterable)
+
+    @property
+    def typecode(self):
+        return self._ids.typecode
+
+    @property
+    def itemsize(self):
+        return self._ids.itemsize
+
+    def tobytes(self):
+        return self._ids.tobytes()
+
+    def difference(self, *others):
+        result = set()
+        for other in others:
+            result.update(other)
+        return self - result
+
+    def __contains__(self, value):
+        if not isinstance(value, int):
+            return False
+        index = bisect_left(self._ids, value)
+        return index < len(self._ids) and self._ids[index] == value
+
+    def __iter__(self):
+        return iter(self._ids)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __repr__(self):
+        return 'CompactIdSet({})'.format(list(self._ids))
+
+
+def encode_id_set(ids, *header, chunk_size=None, generation=None):
+    """
+    返回 (payload, chunks)。数组超过 chunk_size 个字节的时候切成多个 chunk，
+    payload 里只记录 generation 和 chunk 的个数，chunk 由调用者存到别的 key 里
+    """
+    if not isinstance(ids, CompactIdSet):
+        ids = CompactIdSet(ids)
+    packed = ids.tobytes()
+    if chunk_size is None or len(packed) <= chunk_size:
+        data = (header, ids.typecode, packed, generation, 0)
+        return ID_SET_CODEC_PREFIX + pickle.dumps(data, protocol=4), []
+
+    # chunk 的边界要和 id 的边界对齐
+    chunk_size -= chunk_size % ids.itemsize
+    chunks = [
+        packed[start:start + chunk_size]
+        for start in range(0, len(packed), chunk_size)
+    ]
+    data = (header, ids.typecode, b'', generation, len(chunks))
+    return ID_SET_CODEC_PREFIX + pickle.dumps(data, protocol=4), chunks
+
+
+def decode_id_set(data, load_chunks=None):
+    """
+    返回 (header, CompactIdSet)，无法识别的格式或者 chunk 不全的时候返回 (None, None)
+    load_chunks(generation, count) 按顺序返回所有的 chunk，缺了的时候返回 None
+    """
+    if not isinstance(data, bytes) or not data.startswith(ID_SET_CODEC_PREFIX):
+        return None, None
+    header, typecode, packed, generation, chunk_count = pickle.loads(
+        data[len(ID_SET_CODEC_PREFIX):],
+    )
+    if chunk_count:
+        chunks = load_chunks(generation, chunk_count) if load_chunks else None
+        if chunks is None:
+            return None, None
+        packed = b''.join(chunks)
+    return header, CompactIdSet.frombytes(typecode, packed)
@@ -0,0 +1,56 @@
+from asgiref.local import Local
+
+_local = Local()
+
+
+class IdentityMap:
+    """
+    一个请求内的 L1 cache，key 和 memcached 里的 key 一样
+    由 IdentityMapMiddleware 在请求开始的时候创建，请求结束的时候清空，
+    所以不会在请求之间产生过期的数据。不在请求里的时候 (比如 job, shell)
+    所有的操作都是空操作
+    """
+
+    @classmethod
+    def activate(cls):
+        _local.objects = {}
+
+    @classmethod
+    def deactivate(cls):
+        _local.objects = None
+
+    @classmethod
+    def _get_objects(cls):
+        return getattr(_local, 'objects', None)
+
+    @classmethod
+    def get(cls, key):
+        objects = cls._get_objects()
+        if objects is None:
+            return None
+        return objects.get(key)
+
+    @classmethod
+    def get_many(cls, keys):
+        objects = cls._get_objects()
+        if not objects:
+            return {}
+        return {key: objects[key] for key in keys if key in objects}
+
+    @classmethod
+    def set(cls, key, obj):
+        objects = cls._get_objects()
+        if objects is not None:
+            objects[key] = obj
+
+    @classmethod
+    def set_many(cls, mapping):
+        objects = cls._get_objects()
+        if objects is not None:
+            objects.update(mapping)
+
+    @classmethod
+    def delete(cls, key):
+        objects = cls._get_objects()
+        if objects is not None:
+            objects.pop(key, None)
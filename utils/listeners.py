@@ -1,3 +1,8 @@
-def invalidate_object_cache(sender, instance, **kwargs):
+def invalidate_object_cache(sender, instance, update_fields=None, **kwargs):
     from utils.memcached_helper import MemcachedHelper
-    MemcachedHelper.invalidate_cached_object(sender, instance.id)
\ No newline at end of file
+    # save(update_fields=...) 只更新了 cache 里没有存的字段的时候不需要 invalidate
+    # 比如每次登录的时候更新的 User.last_login
+    if update_fields and not MemcachedHelper.has_cached_fields(sender, update_fields):
+        return
+    # write-through 模式下事务提交之后会把最新的数据写回 cache
+    MemcachedHelper.update_cached_object(sender, instance.id)
@@ -1,8 +1,36 @@
+import math
+import random
+import time
+import uuid
+from collections import namedtuple
+
 from django.conf import settings
 from django.core.cache import caches
+from django.db import transaction
+
+from utils.cache_codecs import (
+    ID_SET_CODEC_PREFIX,
+    CompactIdSet,
+    ModelCodec,
+    decode_id_set,
+    encode_id_set,
+)
+from utils.identity_map import IdentityMap
 
 cache = caches['testing'] if settings.TESTING else caches['default']
 
+# cache 里存的是 CacheEntry，除了 object 之外还记录了过期时间和重新加载花的时间
+# 用来做 probabilistic early refresh。version 用来保证 write-through 的时候
+# 旧的数据不会覆盖掉新的数据
+CacheEntry = namedtuple(
+    'CacheEntry',
+    ['obj', 'expire_at', 'delta', 'version'],
+    defaults=(0,),
+)
+
+# 等待其他 worker 加载的时候每次 poll 的间隔
+CACHE_LOCK_POLL_INTERVAL = 0.05
+
 
 class MemcachedHelper:
 
@@ -11,20 +39,425 @@ class MemcachedHelper:
         return '{}:{}'.format(model_class.__name__, object_id)
 
     @classmethod
-    def get_object_through_cache(cls, model_class, object_id):
-        key = cls.get_key(model_class, object_id)
-        # cache hit
-        obj = cache.get(key)
+    def get_lock_key(cls, key):
+        return '{}:lock'.format(key)
+
+    @classmethod
+    def get_version_key(cls, key):
+        return '{}:version'.format(key)
+
+    @classmethod
+    def get_chunk_key(cls, key, generation, index):
+        return '{}:chunk:{}:{}'.format(key, generation, index)
+
+    @classmethod
+    def _make_entry(cls, obj, delta, timeout, version=0):
+        expire_at = None if timeout is None else time.time() + timeout
+        return CacheEntry(obj, expire_at, delta, version)
+
+    @classmethod
+    def _dumps(cls, key, entry, timeout):
+        # 注册过 ModelCodec 的 model 和 id 的集合用紧凑的格式存储，其他的还是交给 pickle
+        if isinstance(entry.obj, (set, frozenset, CompactIdSet)):
+            return cls._dumps_id_set(key, entry, timeout)
+        codec = ModelCodec.get_codec(type(entry.obj))
+        if codec is None:
+            return entry
+        return codec.encode(entry.obj, *entry[1:])
+
+    @classmethod
+    def _dumps_id_set(cls, key, entry, timeout):
+        # 很大的集合会超过 memcached 单个 item 的大小限制，切成多个 chunk 存在不同的 key 里
+        # 每次写入用一个新的 generation，读的时候不会混用不同版本的 chunk
+        generation = uuid.uuid4().hex[:8]
+        payload, chunks = encode_id_set(
+            entry.obj,
+            *entry[1:],
+            chunk_size=settings.CACHE_CHUNK_SIZE_BYTES,
+            generation=generation,
+        )
+        if chunks:
+            # 先写 chunk，读到 payload 的时候 chunk 已经在 cache 里了
+            cache.set_many({
+                cls.get_chunk_key(key, generation, index): chunk
+                for index, chunk in enumerate(chunks)
+            }, timeout)
+        return payload
+
+    @classmethod
+    def _load_chunks(cls, key, generation, count):
+        chunk_keys = [
+            cls.get_chunk_key(key, generation, index)
+            for index in range(count)
+        ]
+        chunks = cache.get_many(chunk_keys)
+        # 有 chunk 被 evict 了就当成 cache miss
+        if len(chunks) != count:
+            return None
+        return [chunks[chunk_key] for chunk_key in chunk_keys]
+
+    @classmethod
+    def _loads(cls, key, value):
+        if isinstance(value, CacheEntry):
+            return value
+        # 不是 CacheEntry 也不是 codec 的格式，比如之前直接 pickle 进 cache 的 model 和 set，
+        # 都当成 cache miss，重新加载之后会被覆盖掉
+        if not isinstance(value, bytes):
+            return None
+        if value.startswith(ID_SET_CODEC_PREFIX):
+            header, obj = decode_id_set(
+                value,
+                lambda generation, count: cls._load_chunks(key, generation, count),
+            )
+        else:
+            header, obj = ModelCodec.loads(value)
+        # 旧版本的数据当成 cache miss
+        if obj is None:
+            return None
+        return CacheEntry(obj, *header)
+
+    @classmethod
+    def _get(cls, key):
+        return cls._loads(key, cache.get(key))
+
+    @classmethod
+    def _store(cls, key, entry, timeout):
+        # cache 里已经有版本更新的数据的时候不覆盖
+        # memcached 的 cas 用不了，get 和 set 之间还是有很小的窗口
+        current = cls._get(key)
+        if current is not None and current.version > entry.version:
+            return False
+        cache.set(key, cls._dumps(key, entry, timeout), timeout)
+        return True
+
+    @classmethod
+    def _next_version(cls, key):
+        version_key = cls.get_version_key(key)
+        try:
+            return cache.incr(version_key)
+        except ValueError:
+            # 版本号不在 cache 里 (第一次写或者被 evict 了)，用当前的毫秒数作为起点
+            # 这样一定比 evict 之前用过的版本号大
+            cache.add(version_key, int(time.time() * 1000), None)
+            return cache.incr(version_key)
+
+    @classmethod
+    def _get_timeout(cls, obj):
+        # 不存在的 object 用 obj=None 的 CacheEntry 作为 tombstone，只缓存很短的时间
+        if obj is None:
+            return settings.CACHE_TOMBSTONE_TIMEOUT_SECONDS
+        return cache.default_timeout
+
+    @classmethod
+    def _should_refresh_early(cls, entry):
+        """
+        XFetch: 越接近过期时间、重新加载越慢，越有可能提前刷新
+        这样 key 过期之前就会有一个 worker 提前把它刷新掉，不会所有请求同时 miss
+        """
+        beta = settings.CACHE_EARLY_REFRESH_BETA
+        if not beta or entry.expire_at is None:
+            return False
+        gap = -entry.delta * beta * math.log(1 - random.random())
+        return time.time() + gap >= entry.expire_at
+
+    @classmethod
+    def _load(cls, key, loader, stale_entry=None):
+        version_key = cls.get_version_key(key)
+        version = cache.get(version_key)
+        start = time.time()
+        obj = loader()
+        timeout = cls._get_timeout(obj)
+        delta = time.time() - start
+        # 加载的过程中数据被修改过，读到的可能是旧数据，不写回 cache
+        if cache.get(version_key) != version:
+            return obj
+        if stale_entry is None:
+            # 用 add 写入，不会覆盖掉同时 write-through 进来的新数据
+            entry = cls._make_entry(obj, delta, timeout)
+            value = cls._dumps(key, entry, timeout)
+            # key 还在但是读不出来 (旧版本的 codec，或者有 chunk 被 evict 了) 的时候
+            # add 不会成功，需要直接覆盖，否则在过期之前每次读都会 miss
+            if not cache.add(key, value, timeout) and cls._get(key) is None:
+                cache.set(key, value, timeout)
+        else:
+            # 提前刷新的数据和原来的数据是同一个版本
+            entry = cls._make_entry(obj, delta, timeout, stale_entry.version)
+            cls._store(key, entry, timeout)
+        return obj
+
+    @classmethod
+    def _load_single_flight(cls, key, loader, stale_entry=None):
+        # 只有拿到锁的 worker 去数据库里加载，同一个 key 数据库只会看到一次查询
+        lock_key = cls.get_lock_key(key)
+        if cache.add(lock_key, 1, settings.CACHE_LOCK_TIMEOUT_SECONDS):
+            try:
+                return cls._load(key, loader, stale_entry)
+            finally:
+                cache.delete(lock_key)
+
+        # 提前刷新的时候 cache 里的数据还没有过期，直接用
+        if stale_entry is not None:
+            return stale_entry.obj
+
+        # 其他 worker 正在加载，等一小会儿
+        deadline = time.time() + settings.CACHE_LOCK_WAIT_SECONDS
+        while time.time() < deadline:
+            time.sleep(CACHE_LOCK_POLL_INTERVAL)
+            entry = cls._get(key)
+            if entry is not None:
+                return entry.obj
+
+        # 等太久了 (比如拿到锁的 worker 挂掉了)，自己去数据库里读
+        return cls._load(key, loader)
+
+    @classmethod
+    def get_through_cache(cls, key, loader):
+        """
+        通用的读 cache 的方法，cache miss 的时候调用 loader() 从数据库里读
+        loader 返回 None 表示 object 不存在，会被缓存成 tombstone
+        """
+        # 同一个请求里已经读过的 object 直接返回
+        obj = IdentityMap.get(key)
         if obj is not None:
             return obj
 
+        entry = cls._get(key)
+        # cache hit
+        if entry is not None and not cls._should_refresh_early(entry):
+            obj = entry.obj
         # cache miss
-        obj = model_class.objects.get(id=object_id)
-        # using default expire time
-        cache.set(key, obj)
+        else:
+            obj = cls._load_single_flight(key, loader, stale_entry=entry)
+        if obj is not None:
+            IdentityMap.set(key, obj)
         return obj
 
     @classmethod
-    def invalidate_cached_object(cls, model_class, object_id):
+    def get_many_through_cache(cls, keys, loader):
+        """
+        批量版本的 get_through_cache，keys 是 {key: id}
+        cache 里没有的 id 调用一次 loader(missing_ids) 从数据库里读，它返回 {id: object}
+        返回 {id: object}，loader 没有返回的 id 会被缓存成 tombstone，
+        不会出现在返回结果里
+        """
+        # 先查请求内的 identity map，剩下的再去 cache 里读
+        cached_objects = IdentityMap.get_many(keys.keys())
+        missing_keys = [key for key in keys if key not in cached_objects]
+        if missing_keys:
+            # cache hit
+            memcached_objects = {}
+            for key, value in cache.get_many(missing_keys).items():
+                entry = cls._loads(key, value)
+                if entry is not None:
+                    memcached_objects[key] = entry.obj
+            IdentityMap.set_many({
+                key: obj
+                for key, obj in memcached_objects.items()
+                if obj is not None
+            })
+            cached_objects.update(memcached_objects)
+        # tombstone 也算 cache hit，但是不出现在返回结果里
+        object_map = {
+            keys[key]: obj
+            for key, obj in cached_objects.items()
+            if obj is not None
+        }
+
+        # cache miss
+        missing_ids = [
+            object_id
+            for key, object_id in keys.items()
+            if key not in cached_objects
+        ]
+        if missing_ids:
+            version_keys = [
+                cls.get_version_key(key)
+                for key, object_id in keys.items()
+                if key not in cached_objects
+            ]
+            versions = cache.get_many(version_keys)
+            start = time.time()
+            loaded_object_map = loader(missing_ids)
+            delta = time.time() - start
+            # 加载的过程中被 write-through 更新过的 key 不写回 cache，避免覆盖新数据
+            updated_keys = {
+                version_key
+                for version_key, version in cache.get_many(version_keys).items()
+                if versions.get(version_key) != version
+            }
+            loaded_objects, tombstones = {}, {}
+            for key, object_id in keys.items():
+                if key in cached_objects or cls.get_version_key(key) in updated_keys:
+                    continue
+                if object_id in loaded_object_map:
+                    loaded_objects[key] = loaded_object_map[object_id]
+                else:
+                    tombstones[key] = None
+            # 存在的 object 和 tombstone 的过期时间不一样，分开写
+            for objects in (loaded_objects, tombstones):
+                if not objects:
+                    continue
+                timeout = cls._get_timeout(next(iter(objects.values())))
+                cache.set_many({
+                    key: cls._dumps(key, cls._make_entry(obj, delta, timeout), timeout)
+                    for key, obj in objects.items()
+                }, timeout)
+            IdentityMap.set_many(loaded_objects)
+            object_map.update(loaded_object_map)
+        return object_map
+
+    @classmethod
+    def get_object_through_cache(cls, model_class, object_id):
+        # object 不存在的时候返回 None，比如 SET_NULL 之后的 user_id
+        if object_id is None:
+            return None
         key = cls.get_key(model_class, object_id)
+        return cls.get_through_cache(
+            key,
+            lambda: model_class.objects.filter(id=object_id).first(),
+        )
+
+    @classmethod
+    def get_object_map_through_cache(cls, model_class, object_ids):
+        """
+        一次 get_many 拿到所有的 object，cache 里没有的用一次 id__in 的查询
+        从数据库里读出来，再用一次 set_many 写回 cache。返回 {id: object}
+        数据库里也没有的 id 不会出现在返回结果里
+        """
+        keys = {
+            cls.get_key(model_class, object_id): object_id
+            for object_id in set(object_ids)
+            if object_id is not None
+        }
+        return cls.get_many_through_cache(
+            keys,
+            lambda missing_ids: {
+                obj.id: obj
+                for obj in model_class.objects.filter(id__in=missing_ids)
+            },
+        )
+
+    @classmethod
+    def get_objects_through_cache(cls, model_class, object_ids):
+        # 按照 object_ids 的顺序返回，不存在的 object 会被跳过
+        object_map = cls.get_object_map_through_cache(model_class, object_ids)
+        return [
+            object_map[object_id]
+            for object_id in object_ids
+            if object_id in object_map
+        ]
+
+    @classmethod
+    def has_cached_fields(cls, model_class, field_names):
+        # 没有注册 ModelCodec 的 model 整个 instance 都在 cache 里
+        codec = ModelCodec.get_codec(model_class)
+        if codec is None:
+            return True
+        return any(name in codec.field_names for name in field_names)
+
+    @classmethod
+    def invalidate(cls, key):
         cache.delete(key)
+        IdentityMap.delete(key)
+
+    @classmethod
+    def invalidate_cached_object(cls, model_class, object_id):
+        cls.invalidate(cls.get_key(model_class, object_id))
+
+    @classmethod
+    def update_through_cache(cls, key, loader, allow_tombstone=True):
+        """
+        数据修改之后调用。先删掉 cache 里的数据，保证同一个事务里读到的是自己写的数据
+        write-through 模式下，事务提交之后再用 loader() 把最新的数据写进 cache，
+        热点数据在修改之后仍然在 cache 里。每次写入都会增加 key 的版本号，
+        并发的写入不会用旧的数据覆盖新的数据
+        """
+        cls.invalidate(key)
+        if not settings.CACHE_WRITE_THROUGH:
+            return
+
+        def write_through():
+            version = cls._next_version(key)
+            start = time.time()
+            obj = loader()
+            if obj is None and not allow_tombstone:
+                cls.invalidate(key)
+                return
+            timeout = cls._get_timeout(obj)
+            entry = cls._make_entry(obj, time.time() - start, timeout, version)
+            cls._store(key, entry, timeout)
+
+        # 事务回滚的话不会执行，不在事务里的时候会马上执行
+        transaction.on_commit(write_through)
+
+    @classmethod
+    def update_cached_value(cls, key, update):
+        """
+        直接修改 cache 里的数据 (比如往 set 里加一个 id)，不需要从数据库里重新加载
+        update(obj) 返回修改之后的 object。memcached 没有 cas，用锁保证并发的修改
+        不会丢失，拿不到锁的时候直接删掉，下次读的时候从数据库里加载。
+        cache 里没有的时候什么都不做，读的时候会从数据库里加载
+        update(obj) 返回 None 表示没法在 cache 里直接修改，同样删掉等下次重新加载
+        和 update_through_cache 一样在事务提交之后才修改，事务回滚的话 cache 不会变，
+        事务提交之前从数据库里加载到 cache 里的旧数据也会在提交的时候被修改。
+        所以 update(obj) 要是幂等的，对已经包含这次修改的数据再执行一次结果不变
+        """
+        def apply_update():
+            # 先增加版本号，正在从数据库里加载旧数据的 worker 就不会把旧数据写进 cache
+            version = cls._next_version(key)
+            IdentityMap.delete(key)
+            lock_key = cls.get_lock_key(key)
+            if not cache.add(lock_key, 1, settings.CACHE_LOCK_TIMEOUT_SECONDS):
+                cache.delete(key)
+                return
+            try:
+                entry = cls._get(key)
+                if entry is None or entry.obj is None:
+                    return
+                obj = update(entry.obj)
+                if obj is None:
+                    cache.delete(key)
+                    return
+                cls._store(
+                    key,
+                    entry._replace(obj=obj, version=version),
+                    cls._get_timeout(obj),
+                )
+            finally:
+                cache.delete(lock_key)
+
+        # 事务回滚的话不会执行，不在事务里的时候会马上执行
+        transaction.on_commit(apply_update)
+
+    @classmethod
+    def push_to_cached_list(cls, key, entry):
+        """
+        cached list 是按照 (created_at, id) 倒序排列的最多 CACHED_LIST_LENGTH_LIMIT
+        个 (id, ..., created_at)，把 entry 插入到对应的位置
+        和 update_cached_value 一样等事务提交之后才修改
+        """
+        def push(entries):
+            entries = [e for e in entries if e[0] != entry[0]]
+            entries.append(entry)
+            entries.sort(key=lambda e: (e[-1], e[0]), reverse=True)
+            return entries[:settings.CACHED_LIST_LENGTH_LIMIT]
+        cls.update_cached_value(key, push)
+
+    @classmethod
+    def remove_from_cached_list(cls, key, entry_id):
+        def remove(entries):
+            remaining = [e for e in entries if e[0] != entry_id]
+            # 满了的 list 删掉一条之后，数据库里下一条不在 cache 里，
+            # 不能再用长度判断 cache 是否是全部数据，所以返回 None 让它重新加载
+            if len(remaining) < len(entries) and \
+                    len(entries) >= settings.CACHED_LIST_LENGTH_LIMIT:
+                return None
+            return remaining
+        cls.update_cached_value(key, remove)
+
+    @classmethod
+    def update_cached_object(cls, model_class, object_id):
+        cls.update_through_cache(
+            cls.get_key(model_class, object_id),
+            lambda: model_class.objects.filter(id=object_id).first(),
+        )
@@ -0,0 +1,14 @@
+from utils.identity_map import IdentityMap
+
+
+class IdentityMapMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        IdentityMap.activate()
+        try:
+            return self.get_response(request)
+        finally:
+            IdentityMap.deactivate()
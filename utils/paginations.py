@@ -1,35 +1,219 @@
+import base64
+import binascii
+import json
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import BasePagination
 from rest_framework.response import Response
 
 
 class EndlessPagination(BasePagination):
     page_size = 20
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    # 翻页的方向：往下翻拿更早的数据，往上翻 (刷新) 拿更新的数据
+    OLDER = 'older'
+    NEWER = 'newer'
+
+    # created_at 相同的数据用这个字段排序，cursor 里存的也是这个字段的值
+    tiebreak_field = 'id'
 
     def __init__(self):
         super(EndlessPagination, self).__init__()
         self.has_next_page = False
+        self.direction = None
+        self.page = []
+        self.request_cursor = None
 
     def to_html(self):
         pass
 
-    def paginate_queryset(self, queryset, request, view=None):
-        if 'created_at__gt' in request.query_params:
-            created_at__gt = request.query_params['created_at__gt']
-            queryset = queryset.filter(created_at__gt=created_at__gt)
-            self.has_next_page = False
-            return queryset.order_by('-created_at')
+    @classmethod
+    def is_requested(cls, request):
+        # 请求里带了 cursor 或者旧的 created_at__lt / created_at__gt 参数
+        return any(
+            param in request.query_params
+            for param in (cls.cursor_query_param, 'created_at__lt', 'created_at__gt')
+        )
+
+    def encode_cursor(self, obj, direction):
+        # cursor 对客户端是不透明的，里面是 (created_at, id) 和翻页的方向
+        data = [obj.created_at.isoformat(), self._get_tiebreak(obj), direction]
+        return base64.urlsafe_b64encode(json.dumps(data).encode()).decode()
+
+    def decode_cursor(self, request):
+        """
+        返回 (direction, created_at, id)，没有 cursor 的时候返回 (None, None, None)
+        兼容旧的 created_at__lt / created_at__gt 参数，这时 id 是 None
+        """
+        # cursor 为空的时候 (?cursor=) 表示从第一页开始
+        if request.query_params.get(self.cursor_query_param):
+            try:
+                token = request.query_params[self.cursor_query_param]
+                created_at, object_id, direction = json.loads(
+                    base64.urlsafe_b64decode(token.encode()).decode()
+                )
+                created_at = parse_datetime(created_at)
+                object_id = int(object_id)
+            except (TypeError, ValueError, binascii.Error):
+                raise NotFound(self.invalid_cursor_message)
+            if created_at is None or direction not in (self.OLDER, self.NEWER):
+                raise NotFound(self.invalid_cursor_message)
+            return direction, self._make_aware(created_at), object_id
+
+        for param, direction in (
+            ('created_at__gt', self.NEWER),
+            ('created_at__lt', self.OLDER),
+        ):
+            if param in request.query_params:
+                created_at = parse_datetime(request.query_params[param])
+                if created_at is None:
+                    raise NotFound(self.invalid_cursor_message)
+                return direction, self._make_aware(created_at), None
+        return None, None, None
+
+    def _make_aware(self, created_at):
+        # 没有带时区的时间当成默认时区 (UTC)，否则和 cache 里带时区的时间比较会报错
+        if timezone.is_naive(created_at):
+            return timezone.make_aware(created_at)
+        return created_at
+
+    def _get_tiebreak(self, obj):
+        return getattr(obj, self.tiebreak_field) or 0
+
+    def _is_after_cursor(self, obj, direction, created_at, object_id):
+        if object_id is None:
+            if direction == self.NEWER:
+                return obj.created_at > created_at
+            return obj.created_at < created_at
+        if direction == self.NEWER:
+            return (obj.created_at, self._get_tiebreak(obj)) > (created_at, object_id)
+        return (obj.created_at, self._get_tiebreak(obj)) < (created_at, object_id)
 
-        if 'created_at__lt' in request.query_params:
-            created_at__lt = request.query_params['created_at__lt']
-            queryset = queryset.filter(created_at__lt=created_at__lt)
+    def slice_queryset(self, queryset, request, tiebreak_field=None):
+        """
+        返回 cursor 之后按照 (created_at, id) 倒序排列的数据，最多 page_size + 1 个
+        多出来的一个用来判断是否还有下一页。多个数据源合并之后再交给
+        paginate_ordered_list 进行翻页
+        用 created_at__lte 加上 exclude 的写法，让数据库可以在 (xxx, created_at)
+        的 index 上做范围扫描，tiebreak_field (默认是 id) 作为同一时刻的数据的 tiebreak
+        合并的数据源的 model 不一样的时候，可以传入这个数据源里对应的字段
+        """
+        tiebreak_field = tiebreak_field or self.tiebreak_field
+        direction, created_at, object_id = self.decode_cursor(request)
+        if direction == self.NEWER:
+            # 往上翻的时候从 cursor 开始按时间正序取，这样数据再多也不会漏掉
+            if object_id is None:
+                queryset = queryset.filter(created_at__gt=created_at)
+            else:
+                queryset = queryset.filter(created_at__gte=created_at).exclude(
+                    created_at=created_at,
+                    **{tiebreak_field + '__lte': object_id},
+                )
+            objects = queryset.order_by('created_at', tiebreak_field)[:self.page_size + 1]
+            return list(objects)[::-1]
+
+        if direction == self.OLDER:
+            if object_id is None:
+                queryset = queryset.filter(created_at__lt=created_at)
+            else:
+                queryset = queryset.filter(created_at__lte=created_at).exclude(
+                    created_at=created_at,
+                    **{tiebreak_field + '__gte': object_id},
+                )
 
         # 第一次打开，什么参数都不带的情况
-        queryset = queryset.order_by('-created_at')[:self.page_size + 1]
-        self.has_next_page = len(queryset) > self.page_size
-        return queryset[:self.page_size]
+        return list(
+            queryset.order_by('-created_at', '-' + tiebreak_field)[:self.page_size + 1]
+        )
+
+    def slice_ordered_list(self, reverse_ordered_list, request):
+        # 和 slice_queryset 一样，只不过数据源是一个已经按照 created_at 倒序排好的 list
+        direction, created_at, object_id = self.decode_cursor(request)
+        if direction == self.NEWER:
+            objects = []
+            for obj in reverse_ordered_list:
+                if not self._is_after_cursor(obj, direction, created_at, object_id):
+                    break
+                objects.append(obj)
+            return objects[-(self.page_size + 1):]
+
+        index = 0
+        if direction == self.OLDER:
+            for index, obj in enumerate(reverse_ordered_list):
+                if self._is_after_cursor(obj, direction, created_at, object_id):
+                    break
+            else:
+                # 没有比 cursor 更早的数据了
+                return []
+        return reverse_ordered_list[index: index + self.page_size + 1]
+
+    def slice_cached_list(self, cached_list, request, limit=None):
+        """
+        cached_list 是数据库里最新的 limit 条数据，当 cursor 超出了 cache 的范围的时候
+        返回 None，调用者需要去数据库里查询
+        """
+        if limit is None:
+            limit = settings.CACHED_LIST_LENGTH_LIMIT
+        objects = self.slice_ordered_list(cached_list, request)
+        # cached_list 的长度不足最大限制，说明 cached_list 里已经是所有数据了
+        if len(cached_list) < limit:
+            return objects
+        direction, created_at, object_id = self.decode_cursor(request)
+        # 往上翻的时候，cache 里只要有一条数据不比 cursor 新，就说明已经拿全了
+        if direction == self.NEWER:
+            oldest = cached_list[-1]
+            if self._is_after_cursor(oldest, direction, created_at, object_id):
+                return None
+            return objects
+        # 往下翻的时候，能从 cache 里拿到完整的一页 (以及判断下一页的那一条) 就够了
+        if len(objects) > self.page_size:
+            return objects
+        return None
+
+    def paginate_ordered_list(self, reverse_ordered_list, request):
+        objects = self.slice_ordered_list(reverse_ordered_list, request)
+        return self._paginate_objects(objects, request)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if type(queryset) == list:
+            return self.paginate_ordered_list(queryset, request)
+        objects = self.slice_queryset(queryset, request)
+        return self._paginate_objects(objects, request)
+
+    def _paginate_objects(self, objects, request):
+        self.direction, _, _ = self.decode_cursor(request)
+        self.request_cursor = request.query_params.get(self.cursor_query_param)
+        self.has_next_page = len(objects) > self.page_size
+        if self.direction == self.NEWER:
+            # 往上翻的时候多出来的是最新的那一条，保留离 cursor 最近的一页
+            self.page = objects[-self.page_size:] if self.has_next_page else objects
+        else:
+            self.page = objects[:self.page_size]
+        return self.page
+
+    def get_next_cursor(self):
+        # 继续往下翻的 cursor，往上翻的时候更早的数据客户端已经有了
+        if self.direction == self.NEWER or not self.has_next_page:
+            return None
+        return self.encode_cursor(self.page[-1], self.OLDER)
+
+    def get_refresh_cursor(self):
+        # 拉取比这一页更新的数据的 cursor
+        if self.page:
+            return self.encode_cursor(self.page[0], self.NEWER)
+        if self.direction == self.NEWER:
+            return self.request_cursor
+        return None
 
     def get_paginated_response(self, data):
         return Response({
             'has_next_page': self.has_next_page,
+            'next_cursor': self.get_next_cursor(),
+            'refresh_cursor': self.get_refresh_cursor(),
             'results': data,
-        })
\ No newline at end of file
+        })
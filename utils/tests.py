@@ -0,0 +1,403 @@
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import transaction
+from django.test import RequestFactory, override_settings
+
+from accounts.services import UserService
+from friendships.models import Friendship
+from friendships.services import FriendshipService
+from testing.testcases import TestCase, TransactionTestCase
+from tweets.models import Tweet
+from twitter.cache import FOLLOWINGS_PATTERN
+from utils.cache_codecs import (
+    CompactIdSet,
+    ModelCodec,
+    decode_id_set,
+    encode_id_set,
+)
+from utils.identity_map import IdentityMap
+from utils.memcached_helper import CacheEntry, MemcachedHelper
+from utils.middleware import IdentityMapMiddleware
+
+
+class MemcachedHelperTests(TestCase):
+
+    def setUp(self):
+        self.clear_cache()
+        self.linghu = self.create_user('linghu')
+        self.tweets = [self.create_tweet(self.linghu) for _ in range(3)]
+
+    def test_get_objects_through_cache(self):
+        # 创建的时候已经 write through 到 cache 里了，先清掉
+        self.clear_cache()
+        ids = [self.tweets[2].id, -1, self.tweets[0].id, self.tweets[1].id]
+        # cache miss, 一次查询
+        with self.assertNumQueries(1):
+            tweets = MemcachedHelper.get_objects_through_cache(Tweet, ids)
+        self.assertEqual(
+            [tweet.id for tweet in tweets],
+            [self.tweets[2].id, self.tweets[0].id, self.tweets[1].id],
+        )
+
+        # cache hit, 不需要查询
+        with self.assertNumQueries(0):
+            tweets = MemcachedHelper.get_objects_through_cache(
+                Tweet,
+                [self.tweets[2].id, self.tweets[0].id],
+            )
+        self.assertEqual(
+            [tweet.id for tweet in tweets],
+            [self.tweets[2].id, self.tweets[0].id],
+        )
+
+        # 部分 miss 的时候只查询 miss 的部分
+        dongxie = self.create_user('dongxie')
+        MemcachedHelper.invalidate_cached_object(User, dongxie.id)
+        with self.assertNumQueries(1):
+            users = MemcachedHelper.get_objects_through_cache(
+                User,
+                [dongxie.id, self.linghu.id, dongxie.id],
+            )
+        self.assertEqual(
+            [user.id for user in users],
+            [dongxie.id, self.linghu.id, dongxie.id],
+        )
+        with self.assertNumQueries(0):
+            MemcachedHelper.get_objects_through_cache(User, [dongxie.id])
+
+    def test_invalidate_cached_object(self):
+        MemcachedHelper.get_objects_through_cache(Tweet, [self.tweets[0].id])
+        self.tweets[0].content = 'updated'
+        self.tweets[0].save()
+        tweets = MemcachedHelper.get_objects_through_cache(Tweet, [self.tweets[0].id])
+        self.assertEqual(tweets[0].content, 'updated')
+
+    def test_negative_cache(self):
+        tweet = self.tweets[0]
+        tweet_id = tweet.id
+        tweet.delete()
+        self.clear_cache()
+        # 第一次查询数据库，之后命中 tombstone
+        with self.assertNumQueries(1):
+            self.assertIsNone(MemcachedHelper.get_object_through_cache(Tweet, tweet_id))
+        with self.assertNumQueries(0):
+            self.assertIsNone(MemcachedHelper.get_object_through_cache(Tweet, tweet_id))
+            self.assertEqual(
+                MemcachedHelper.get_objects_through_cache(Tweet, [tweet_id]),
+                [],
+            )
+            self.assertIsNone(MemcachedHelper.get_object_through_cache(User, None))
+
+        # 批量查询的时候不存在的 id 也会被缓存
+        with self.assertNumQueries(1):
+            MemcachedHelper.get_objects_through_cache(User, [self.linghu.id, -1])
+        with self.assertNumQueries(0):
+            MemcachedHelper.get_objects_through_cache(User, [self.linghu.id, -1])
+
+        # 重新创建之后 post_save 会清掉 tombstone
+        Tweet.objects.create(id=tweet_id, user=self.linghu, content='back')
+        tweet = MemcachedHelper.get_object_through_cache(Tweet, tweet_id)
+        self.assertEqual(tweet.content, 'back')
+
+    @override_settings(CACHE_LOCK_WAIT_SECONDS=1)
+    def test_single_flight(self):
+        cache = caches['testing']
+        key, calls = 'single_flight_key', []
+
+        def loader():
+            calls.append(1)
+            return 'loaded'
+
+        # 没有人在加载的时候自己拿锁加载，加载完释放锁
+        self.assertEqual(MemcachedHelper.get_through_cache(key, loader), 'loaded')
+        self.assertEqual(len(calls), 1)
+        self.assertIsNone(cache.get(MemcachedHelper.get_lock_key(key)))
+
+        # 其他 worker 拿着锁，等它把数据写进 cache
+        cache.delete(key)
+        cache.add(MemcachedHelper.get_lock_key(key), 1)
+        timer = threading.Timer(0.1, lambda: cache.set(
+            key,
+            CacheEntry('from other worker', None, 0),
+        ))
+        timer.start()
+        self.assertEqual(
+            MemcachedHelper.get_through_cache(key, loader),
+            'from other worker',
+        )
+        timer.join()
+        self.assertEqual(len(calls), 1)
+
+        # 拿着锁的 worker 一直没有写 cache，等一会儿之后自己加载
+        cache.delete(key)
+        start = time.time()
+        self.assertEqual(MemcachedHelper.get_through_cache(key, loader), 'loaded')
+        self.assertGreaterEqual(time.time() - start, 1)
+        self.assertEqual(len(calls), 2)
+        cache.delete(MemcachedHelper.get_lock_key(key))
+
+    def test_early_refresh(self):
+        cache = caches['testing']
+        key, calls = 'early_refresh_key', []
+
+        def loader():
+            calls.append(1)
+            return 'refreshed'
+
+        # 马上就要过期的 key 会被提前刷新
+        cache.set(key, CacheEntry('cached', time.time(), 1))
+        self.assertEqual(MemcachedHelper.get_through_cache(key, loader), 'refreshed')
+        self.assertEqual(len(calls), 1)
+
+        # 其他 worker 正在刷新的时候，直接使用还没过期的数据
+        cache.set(key, CacheEntry('cached', time.time() + 1, 100))
+        cache.add(MemcachedHelper.get_lock_key(key), 1)
+        self.assertEqual(MemcachedHelper.get_through_cache(key, loader), 'cached')
+        self.assertEqual(len(calls), 1)
+        cache.delete(MemcachedHelper.get_lock_key(key))
+
+        with self.settings(CACHE_EARLY_REFRESH_BETA=0):
+            self.assertEqual(MemcachedHelper.get_through_cache(key, loader), 'cached')
+        self.assertEqual(len(calls), 1)
+
+
+class CacheCodecTests(TestCase):
+
+    def setUp(self):
+        self.clear_cache()
+        self.linghu = self.create_user('linghu')
+        self.tweet = self.create_tweet(self.linghu)
+
+    def test_model_codec(self):
+        tweet = Tweet.objects.get(id=self.tweet.id)
+        header, decoded = ModelCodec.loads(
+            ModelCodec.get_codec(Tweet).encode(tweet, 1, 2),
+        )
+        self.assertEqual(header, (1, 2))
+        for field in Tweet._meta.concrete_fields:
+            self.assertEqual(
+                getattr(decoded, field.attname),
+                getattr(tweet, field.attname),
+            )
+
+        # password 不会放进 cache，用到的时候才去数据库里读
+        data = ModelCodec.get_codec(User).encode(self.linghu)
+        self.assertNotIn(self.linghu.password.encode(), data)
+        _, user = ModelCodec.loads(data)
+        with self.assertNumQueries(0):
+            self.assertEqual(user.username, 'linghu')
+        with self.assertNumQueries(1):
+            self.assertEqual(user.password, self.linghu.password)
+
+    def test_codec_version(self):
+        codec = ModelCodec.get_codec(Tweet)
+        data = codec.encode(self.tweet)
+        codec.version += 1
+        try:
+            # 旧版本的数据当成 cache miss
+            self.assertEqual(ModelCodec.loads(data), (None, None))
+            MemcachedHelper.get_object_through_cache(Tweet, self.tweet.id)
+            with self.assertNumQueries(0):
+                MemcachedHelper.get_object_through_cache(Tweet, self.tweet.id)
+        finally:
+            codec.version -= 1
+        with self.assertNumQueries(1):
+            MemcachedHelper.get_object_through_cache(Tweet, self.tweet.id)
+
+        # cache 里还是旧版本的数据的时候，重新加载之后会覆盖掉
+        key = MemcachedHelper.get_key(Tweet, self.tweet.id)
+        codec.version -= 1
+        try:
+            caches['testing'].set(key, codec.encode(self.tweet))
+        finally:
+            codec.version += 1
+        with self.assertNumQueries(1):
+            MemcachedHelper.get_object_through_cache(Tweet, self.tweet.id)
+        with self.assertNumQueries(0):
+            MemcachedHelper.get_object_through_cache(Tweet, self.tweet.id)
+
+    def test_legacy_cache_values(self):
+        # 之前的代码直接把 model 和 set pickle 进 cache，没有 CacheEntry 的包装
+        tweet_key = MemcachedHelper.get_key(Tweet, self.tweet.id)
+        user_key = MemcachedHelper.get_key(User, self.linghu.id)
+        followings_key = FOLLOWINGS_PATTERN.format(user_id=self.linghu.id)
+        caches['testing'].set(tweet_key, Tweet.objects.get(id=self.tweet.id))
+        caches['testing'].set(user_key, User.objects.get(id=self.linghu.id))
+        caches['testing'].set(followings_key, {1, 2})
+
+        with self.assertNumQueries(1):
+            tweet = MemcachedHelper.get_object_through_cache(Tweet, self.tweet.id)
+        self.assertEqual(tweet.id, self.tweet.id)
+        with self.assertNumQueries(1):
+            user_map = MemcachedHelper.get_object_map_through_cache(User, [self.linghu.id])
+        self.assertEqual(user_map[self.linghu.id].username, 'linghu')
+        with self.assertNumQueries(1):
+            user_id_set = FriendshipService.get_following_user_id_set(self.linghu.id)
+        self.assertEqual(set(user_id_set), set())
+
+        # 重新加载之后旧的数据被覆盖掉了
+        with self.assertNumQueries(0):
+            MemcachedHelper.get_object_through_cache(Tweet, self.tweet.id)
+            MemcachedHelper.get_object_map_through_cache(User, [self.linghu.id])
+            FriendshipService.get_following_user_id_set(self.linghu.id)
+
+    def test_id_set_codec(self):
+        ids = {3, 1, 2 ** 40}
+        payload, chunks = encode_id_set(ids, 1, 2)
+        self.assertEqual(chunks, [])
+        header, id_set = decode_id_set(payload)
+        self.assertEqual(header, (1, 2))
+        self.assertIsInstance(id_set, CompactIdSet)
+        self.assertEqual(id_set, ids)
+        self.assertEqual(decode_id_set(encode_id_set(set())[0]), ((), set()))
+        self.assertEqual(decode_id_set(None), (None, None))
+        self.assertEqual(decode_id_set({1, 2}), (None, None))
+
+        # 超过 chunk_size 的时候切成多个 chunk，每个 id 4 个字节
+        payload, chunks = encode_id_set(range(100), chunk_size=42, generation='g')
+        self.assertEqual(len(chunks), 10)
+        header, id_set = decode_id_set(payload, lambda generation, count: chunks)
+        self.assertEqual(id_set, set(range(100)))
+        self.assertEqual(
+            decode_id_set(payload, lambda generation, count: None),
+            (None, None),
+        )
+
+    def test_compact_id_set(self):
+        id_set = CompactIdSet([5, 3, 2 ** 40, 3])
+        self.assertEqual(len(id_set), 3)
+        self.assertEqual(list(id_set), [3, 5, 2 ** 40])
+        self.assertIn(2 ** 40, id_set)
+        self.assertNotIn(4, id_set)
+        self.assertNotIn(None, id_set)
+        self.assertEqual(id_set | {4}, {3, 4, 5, 2 ** 40})
+        self.assertIsInstance(id_set - {3}, CompactIdSet)
+        self.assertEqual(id_set.difference({3}, [5]), {2 ** 40})
+
+
+class IdentityMapTests(TestCase):
+
+    def setUp(self):
+        self.clear_cache()
+        self.linghu = self.create_user('linghu')
+        self.tweet = self.create_tweet(self.linghu)
+
+    def tearDown(self):
+        IdentityMap.deactivate()
+
+    def test_identity_map(self):
+        IdentityMap.activate()
+        tweet = MemcachedHelper.get_object_through_cache(Tweet, self.tweet.id)
+        # memcached 里的数据没有了，同一个请求里还是拿到同一个 object
+        caches['testing'].clear()
+        with self.assertNumQueries(0):
+            self.assertIs(
+                MemcachedHelper.get_object_through_cache(Tweet, self.tweet.id),
+                tweet,
+            )
+            tweets = MemcachedHelper.get_objects_through_cache(Tweet, [self.tweet.id])
+            self.assertIs(tweets[0], tweet)
+
+        # invalidate 的时候 identity map 里的也要删掉
+        MemcachedHelper.invalidate_cached_object(Tweet, self.tweet.id)
+        with self.assertNumQueries(1):
+            MemcachedHelper.get_object_through_cache(Tweet, self.tweet.id)
+
+        # 请求结束之后不再使用 identity map
+        IdentityMap.deactivate()
+        caches['testing'].clear()
+        with self.assertNumQueries(1):
+            MemcachedHelper.get_object_through_cache(Tweet, self.tweet.id)
+
+    def test_identity_map_middleware(self):
+        def get_response(request):
+            MemcachedHelper.get_object_through_cache(Tweet, self.tweet.id)
+            key = MemcachedHelper.get_key(Tweet, self.tweet.id)
+            self.assertIsNotNone(IdentityMap.get(key))
+            return 'response'
+
+        middleware = IdentityMapMiddleware(get_response)
+        self.assertEqual(middleware(RequestFactory().get('/')), 'response')
+        key = MemcachedHelper.get_key(Tweet, self.tweet.id)
+        self.assertIsNone(IdentityMap.get(key))
+
+
+class WriteThroughTests(TransactionTestCase):
+
+    def setUp(self):
+        self.clear_cache()
+        self.linghu = self.create_user('linghu')
+        self.tweet = self.create_tweet(self.linghu, 'original')
+
+    def test_write_through(self):
+        MemcachedHelper.get_object_through_cache(Tweet, self.tweet.id)
+        self.tweet.content = 'updated'
+        self.tweet.save()
+        # 提交之后最新的数据已经写进了 cache
+        with self.assertNumQueries(0):
+            tweet = MemcachedHelper.get_object_through_cache(Tweet, self.tweet.id)
+        self.assertEqual(tweet.content, 'updated')
+
+        # likes_count 是用 update 更新的，也会 write-through
+        self.create_like(self.linghu, self.tweet)
+        with self.assertNumQueries(0):
+            tweet = MemcachedHelper.get_object_through_cache(Tweet, self.tweet.id)
+        self.assertEqual(tweet.likes_count, 1)
+
+        # profile 和 following set 也一样
+        profile = self.linghu.profile
+        profile.nickname = 'linghuchong'
+        profile.save()
+        dongxie = self.create_user('dongxie')
+        FriendshipService.get_following_user_id_set(self.linghu.id)
+        Friendship.objects.create(from_user=self.linghu, to_user=dongxie)
+        with self.assertNumQueries(0):
+            profile = UserService.get_profile_through_cache(self.linghu.id)
+            following_user_ids = FriendshipService.get_following_user_id_set(
+                self.linghu.id,
+            )
+        self.assertEqual(profile.nickname, 'linghuchong')
+        self.assertEqual(following_user_ids, {dongxie.id})
+
+    def test_rollback(self):
+        MemcachedHelper.get_object_through_cache(Tweet, self.tweet.id)
+        try:
+            with transaction.atomic():
+                self.tweet.content = 'rolled back'
+                self.tweet.save()
+                raise ValueError
+        except ValueError:
+            pass
+        # 事务回滚了，不会把没有提交的数据写进 cache
+        with self.assertNumQueries(1):
+            tweet = MemcachedHelper.get_object_through_cache(Tweet, self.tweet.id)
+        self.assertEqual(tweet.content, 'original')
+
+    def test_version(self):
+        key = MemcachedHelper.get_key(Tweet, self.tweet.id)
+        version = MemcachedHelper._get(key).version
+        self.tweet.save()
+        self.tweet.save()
+        self.assertEqual(MemcachedHelper._get(key).version, version + 2)
+
+        # 旧版本的数据不会覆盖新版本的数据
+        stale_entry = CacheEntry(self.tweet, None, 0, version + 1)
+        self.assertFalse(MemcachedHelper._store(key, stale_entry, None))
+        self.assertEqual(MemcachedHelper._get(key).version, version + 2)
+
+        # 版本号被 evict 之后新的版本号还是更大
+        caches['testing'].delete(MemcachedHelper.get_version_key(key))
+        self.tweet.save()
+        self.assertGreater(MemcachedHelper._get(key).version, version + 2)
+
+    @override_settings(CACHE_WRITE_THROUGH=False)
+    def test_invalidate_mode(self):
+        MemcachedHelper.get_object_through_cache(Tweet, self.tweet.id)
+        self.tweet.content = 'updated'
+        self.tweet.save()
+        with self.assertNumQueries(1):
+            tweet = MemcachedHelper.get_object_through_cache(Tweet, self.tweet.id)
+        self.assertEqual(tweet.content, 'updated')